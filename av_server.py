@@ -0,0 +1,358 @@
+"""Local stand-in for the Alpha Vantage API.
+
+Serves /query like AV: recorded payloads are replayed from a folder of
+`SYMBOL_kind_DATE.json` files (e.g. request_db/ISRG_is_2025-04-11.json,
+kind being ov, is, bs or scf), the latest file winning per symbol &
+function. Symbols without a recording get a deterministic synthetic
+payload, so bulk fetches over the whole universe work offline.
+
+The server can add latency & reply with AV's throttle message past a
+per-minute limit, so rate limiting & retries are exercised too. Point
+the client at it with avclient.configure_client(base_url=server.url)
+or the AV_BASE_URL environment variable.
+
+Run standalone:
+
+    python av_server.py --port 8765 --latency 0.05 --per-minute 75
+
+Classes:
+Recordings -- recorded payloads by (function, symbol).
+AVServer -- threaded local AV server.
+
+Functions:
+synthetic_payload -- deterministic fake payload for any symbol.
+synthetic_daily -- deterministic fake daily price history.
+
+"""
+import argparse
+import collections
+import datetime as dt
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+import polars as pl
+
+import statements
+from dumps import FILENAME
+from dumps import KINDS
+from dumps import load_dump
+
+THROTTLE_MESSAGE = (
+    'Thank you for using Alpha Vantage! Our standard API call frequency '
+    'is {per_minute} calls per minute. Please visit '
+    'https://www.alphavantage.co/premium/ if you would like to target a '
+    'higher API call frequency.'
+)
+INVALID_MESSAGE = (
+    'Invalid API call. Please retry or visit the documentation '
+    '(https://www.alphavantage.co/documentation/) for {function}.'
+)
+
+DAILY_FUNCTION = 'TIME_SERIES_DAILY'
+# First bar of synthetic price histories, & bars in a compact reply.
+DAILY_ORIGIN = dt.date(2005, 1, 3)
+COMPACT_BARS = 100
+
+_DEFAULT_DATA = Path(__file__).resolve().parent / 'request_db'
+
+
+class Recordings:
+    """Recorded AV payloads, keyed by (function, symbol).
+
+    Files may hold a raw AV response, or a statement dumped as a list
+    of report records (see dumps.load_dump()).
+    """
+
+    def __init__(self, folder: Optional[Path] = None):
+        self.folder = _DEFAULT_DATA if folder is None else Path(folder)
+        self._paths = {}
+        if self.folder.is_dir():
+            for path in sorted(self.folder.iterdir()):
+                match = FILENAME.match(path.name)
+                if match:
+                    # Sorted by name, so a later date replaces earlier.
+                    key = (KINDS[match['kind']], match['symbol'].upper())
+                    self._paths[key] = path
+
+    def __contains__(self, key) -> bool:
+        return key in self._paths
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def get(self, fn: str, symbol: str) -> Optional[dict]:
+        path = self._paths.get((fn, symbol))
+        if path is None:
+            return None
+        return load_dump(path, fn, symbol)
+
+
+def _quarter_ends(as_of: dt.date, count: int) -> list:
+    # The `count` calendar quarter ends before as_of's quarter, newest
+    # first.
+    year, quarter = as_of.year, (as_of.month - 1) // 3
+    if quarter == 0:
+        year, quarter = year - 1, 4
+    ends = []
+    for _ in range(count):
+        month = quarter * 3
+        day = 31 if month in (3, 12) else 30
+        ends.append(dt.date(year, month, day))
+        quarter -= 1
+        if quarter == 0:
+            year, quarter = year - 1, 4
+    return ends
+
+
+def synthetic_payload(fn: str, symbol: str, as_of: Optional[dt.date] = None,
+                      years: int = 5, quarters: int = 8) -> dict:
+    """Return a fake AV payload for fn & symbol.
+
+    Values are random but fixed per (fn, symbol), & every schema field
+    of statements.SCHEMAS[fn] is filled, so payloads normalize like
+    real ones.
+    """
+    as_of = dt.date.today() if as_of is None else as_of
+    rng = random.Random(f'{fn}:{symbol}')
+    scale = 10 ** rng.uniform(8, 11)
+    quarter_ends = _quarter_ends(as_of, quarters)
+
+    if fn == 'OVERVIEW':
+        payload = {}
+        for field in statements.OVERVIEW:
+            if field.dtype == pl.String:
+                payload[field.source] = f'{field.source} {symbol}'
+            elif field.dtype == pl.Date:
+                payload[field.source] = quarter_ends[0].isoformat()
+            elif field.dtype == pl.Float64:
+                payload[field.source] = f'{rng.uniform(0.01, 40):.4f}'
+            else:
+                payload[field.source] = str(int(scale * rng.uniform(1, 50)))
+        payload.update(Symbol=symbol, AssetType='Common Stock',
+                       Currency='USD', FiscalYearEnd='December',
+                       LatestQuarter=quarter_ends[0].isoformat())
+        return payload
+
+    if fn not in statements.SCHEMAS:
+        return {'Error Message': INVALID_MESSAGE.format(function=fn)}
+
+    # Each line item is a fixed share of the company's scale, growing
+    # a few percent a year.
+    fields = statements.SCHEMAS[fn][2:]
+    shares = {f.source: rng.uniform(0.01, 1) for f in fields}
+    growth = rng.uniform(-0.05, 0.15)
+
+    def report(date: dt.date, size: float) -> dict:
+        age = (as_of - date).days / 365
+        level = scale * size * (1 + growth) ** -age
+        return {
+            'fiscalDateEnding': date.isoformat(),
+            'reportedCurrency': 'USD',
+            **{source: str(int(level * share * rng.uniform(0.95, 1.05)))
+               for source, share in shares.items()},
+        }
+
+    last_fy = as_of.year if (as_of.month, as_of.day) == (12, 31) \
+        else as_of.year - 1
+    annual_ends = [dt.date(last_fy - n, 12, 31) for n in range(years)]
+    return {
+        'symbol': symbol,
+        'annualReports': [report(d, 1.0) for d in annual_ends],
+        'quarterlyReports': [report(d, 0.25) for d in quarter_ends],
+    }
+
+
+def synthetic_daily(symbol: str, as_of: Optional[dt.date] = None,
+                    compact: bool = True) -> dict:
+    """Return a fake TIME_SERIES_DAILY payload for symbol: a random
+    walk over weekdays from DAILY_ORIGIN to as_of, newest bar first,
+    the last COMPACT_BARS only if compact.
+
+    Bars are fixed per (symbol, date), so later as_of dates only add
+    bars.
+    """
+    as_of = dt.date.today() if as_of is None else as_of
+    rng = random.Random(f'{DAILY_FUNCTION}:{symbol}')
+    close = 10 ** rng.uniform(1, 2.5)
+    drift = rng.uniform(-0.0002, 0.0008)
+    sigma = rng.uniform(0.01, 0.03)
+    volume = 10 ** rng.uniform(5, 7)
+
+    series = {}
+    day = DAILY_ORIGIN
+    while day <= as_of:
+        if day.weekday() < 5:
+            open_ = close * math.exp(rng.gauss(0, sigma / 4))
+            close = close * math.exp(rng.gauss(drift, sigma))
+            high = max(open_, close) * (1 + abs(rng.gauss(0, sigma / 2)))
+            low = min(open_, close) * (1 - abs(rng.gauss(0, sigma / 2)))
+            series[day.isoformat()] = {
+                '1. open': f'{open_:.4f}',
+                '2. high': f'{high:.4f}',
+                '3. low': f'{low:.4f}',
+                '4. close': f'{close:.4f}',
+                '5. volume': str(int(volume * rng.uniform(0.5, 1.5))),
+            }
+        day += dt.timedelta(days=1)
+
+    dates = list(reversed(series))
+    if compact:
+        dates = dates[:COMPACT_BARS]
+    return {
+        'Meta Data': {
+            '1. Information': 'Daily Prices (open, high, low, close) '
+                              'and Volumes',
+            '2. Symbol': symbol,
+            '3. Last Refreshed': dates[0] if dates else None,
+            '4. Output Size': 'Compact' if compact else 'Full size',
+            '5. Time Zone': 'US/Eastern',
+        },
+        'Time Series (Daily)': {date: series[date] for date in dates},
+    }
+
+
+class AVServer:
+    """Threaded local AV server; see the module docstring.
+
+    latency -- mean seconds added to each reply (jittered +/-50%).
+    per_minute -- requests allowed per rolling minute before
+        throttle replies; None never throttles.
+    synthetic -- serve synthetic_payload() for unrecorded symbols,
+        else AV's invalid-call error.
+
+    Use as a context manager, or call start() & close().
+    """
+
+    def __init__(self, data: Optional[Path] = None, host: str = '127.0.0.1',
+                 port: int = 0, latency: float = 0.0,
+                 per_minute: Optional[int] = None, synthetic: bool = True,
+                 as_of: Optional[dt.date] = None):
+        self.recordings = Recordings(data)
+        self.latency = latency
+        self.per_minute = per_minute
+        self.synthetic = synthetic
+        self.as_of = as_of
+        self.stats = collections.Counter()
+        self._recent = collections.deque()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                status, body = (404, {}) if url.path != '/query' \
+                    else (200, server.reply(params))
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/query'
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def _throttled(self) -> bool:
+        if self.per_minute is None:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            if len(self._recent) >= self.per_minute:
+                return True
+            self._recent.append(now)
+            return False
+
+    def reply(self, params: dict) -> dict:
+        """Return the json body AV would send for request params."""
+        self._count('requests')
+        if self.latency:
+            time.sleep(self.latency * random.uniform(0.5, 1.5))
+        if self._throttled():
+            self._count('throttled')
+            return {'Note': THROTTLE_MESSAGE.format(
+                per_minute=self.per_minute
+            )}
+
+        fn = params.get('function', '').upper()
+        symbol = params.get('symbol', '').upper()
+        payload = self.recordings.get(fn, symbol)
+        if payload is not None:
+            self._count('recorded')
+            return payload
+        if self.synthetic and symbol and fn in statements.SCHEMAS:
+            self._count('synthetic')
+            return synthetic_payload(fn, symbol, self.as_of)
+        if self.synthetic and symbol and fn == DAILY_FUNCTION:
+            self._count('synthetic')
+            return synthetic_daily(
+                symbol, self.as_of,
+                params.get('outputsize', 'compact') == 'compact'
+            )
+        self._count('errors')
+        return {'Error Message': INVALID_MESSAGE.format(function=fn)}
+
+    def start(self) -> 'AVServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> 'AVServer':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--data', type=Path, default=None,
+                        help='folder of recorded payloads')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--per-minute', type=int, default=None)
+    parser.add_argument('--no-synthetic', action='store_true')
+    args = parser.parse_args()
+
+    server = AVServer(args.data, args.host, args.port, args.latency,
+                      args.per_minute, synthetic=not args.no_synthetic)
+    print(f'Serving {len(server.recordings)} recordings at {server.url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
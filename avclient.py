@@ -0,0 +1,337 @@
+"""Process-wide Alpha Vantage HTTP client.
+
+All AV traffic goes through one AVClient so connections are kept alive
+and the per-minute & per-day request limits are respected across every
+Stock, Overview, BalanceSheet & AVRequest in the process.
+
+Classes:
+RateLimit -- per-minute & per-day request limits of an AV plan.
+TokenBucket -- thread-safe token bucket for request pacing.
+Quota -- thread-safe count of requests made against a daily limit.
+AVClient -- keep-alive session with rate limiting & throttle retries.
+
+Functions:
+loads -- parse json bytes, with orjson if it is installed.
+get_client -- return the process-wide AVClient.
+configure_client -- replace the process-wide AVClient.
+
+"""
+import datetime as dt
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+from exceptions import QuotaExceededError
+from exceptions import ThrottleError
+
+try:
+    import orjson
+except ImportError:  # optional; json is used instead
+    orjson = None
+
+# AV error, throttle & notice replies are a few hundred bytes. Larger
+# replies always carry data, so are never parsed just to check them.
+NOTICE_BYTES = 4096
+
+
+def loads(content: Union[bytes, str]):
+    """Parse json, with orjson if it is installed."""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def notice(content: bytes) -> Optional[dict]:
+    """Return a reply small enough to be an AV error or notice,
+    parsed; None for larger replies.
+
+    """
+    if len(content) > NOTICE_BYTES:
+        return None
+    result = loads(content)
+    return result if isinstance(result, dict) else None
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    per_minute: int
+    per_day: Optional[int] = None  # None <=> no daily limit
+
+
+# AV plan limits. Premium plans are limited per minute only.
+PRESETS = {
+    'free': RateLimit(per_minute=5, per_day=25),
+    'premium_75': RateLimit(per_minute=75),
+    'premium_150': RateLimit(per_minute=150),
+    'premium_300': RateLimit(per_minute=300),
+    'premium_600': RateLimit(per_minute=600),
+    'premium_1200': RateLimit(per_minute=1200),
+}
+
+
+class TokenBucket:
+    """Thread-safe token bucket.
+
+    Holds at most `capacity` tokens, refilled continuously at `rate`
+    tokens per second. acquire() blocks until a token is available.
+
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def per_minute(cls, requests_per_minute: int) -> 'TokenBucket':
+        return cls(rate=requests_per_minute / 60,
+                   capacity=requests_per_minute)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated) * self.rate
+        )
+        self._updated = now
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+    def try_acquire(self) -> float:
+        """Take a token if available. Returns 0, or seconds to wait."""
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self) -> None:
+        # Sleep outside the lock so other threads can keep refilling &
+        # checking the bucket.
+        while (wait := self.try_acquire()) > 0:
+            time.sleep(wait)
+
+    def drain(self) -> None:
+        """Empty the bucket, e.g. after the server reports throttling."""
+        with self._lock:
+            self._refill()
+            self._tokens = 0.0
+
+
+class Quota:
+    """Thread-safe count of requests made against a daily limit.
+
+    The count resets when the UTC date changes.
+
+    """
+
+    def __init__(self, per_day: Optional[int] = None):
+        self.per_day = per_day
+        self._day = dt.datetime.now(dt.timezone.utc).date()
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def _roll(self) -> None:
+        today = dt.datetime.now(dt.timezone.utc).date()
+        if today != self._day:
+            self._day = today
+            self._used = 0
+
+    @property
+    def used(self) -> int:
+        with self._lock:
+            self._roll()
+            return self._used
+
+    @property
+    def remaining(self) -> Optional[int]:
+        """Requests left today, or None if there is no daily limit."""
+        if self.per_day is None:
+            return None
+        return max(self.per_day - self.used, 0)
+
+    def consume(self) -> None:
+        with self._lock:
+            self._roll()
+            if self.per_day is not None and self._used >= self.per_day:
+                raise QuotaExceededError(
+                    f'Daily limit of {self.per_day} AV requests reached.'
+                )
+            self._used += 1
+
+
+def _throttle_message(result) -> Optional[str]:
+    # AV reports throttling with HTTP 200 & a 'Note' or 'Information'
+    # message instead of data. 'Information' is also used for other
+    # notices (e.g. premium-only endpoints), which are not retried.
+    if not isinstance(result, dict):
+        return None
+    for key in ('Note', 'Information'):
+        message = result.get(key)
+        if message and ('frequency' in message.lower()
+                        or 'rate limit' in message.lower()):
+            return message
+    return None
+
+
+class AVClient:
+    """Keep-alive AV client with rate limiting & throttle retries.
+
+    Every request waits for a token from a per-minute TokenBucket and
+    is counted against the daily Quota. Throttle replies are retried
+    with exponential backoff up to max_retries times.
+
+    base_url defaults to the AV_BASE_URL environment variable, else
+    AV's own, so any process can be pointed at av_server.py.
+
+    """
+
+    BASE_URL = 'https://www.alphavantage.co/query'
+
+    def __init__(self,
+                 rate_limit: Union[str, RateLimit] = 'free',
+                 api_key: Optional[str] = None,
+                 base_url: Optional[str] = None,
+                 max_retries: int = 4,
+                 backoff: float = 2.0,
+                 pool_size: int = 16,
+                 timeout: float = 30.0):
+        if isinstance(rate_limit, str):
+            rate_limit = PRESETS[rate_limit]
+        self.rate_limit = rate_limit
+        self.api_key = api_key
+        self.base_url = (base_url or os.environ.get('AV_BASE_URL')
+                         or AVClient.BASE_URL)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.bucket = TokenBucket.per_minute(rate_limit.per_minute)
+        self.quota = Quota(rate_limit.per_day)
+        self.retries = 0
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @property
+    def api_key(self) -> str:
+        if self._api_key is None:
+            # Deferred so importing/creating the client never touches
+            # the key file.
+            from equity import get_api_key
+            self._api_key = get_api_key('alpha_vantage')
+        return self._api_key
+
+    @api_key.setter
+    def api_key(self, value):
+        self._api_key = value
+
+    def _send(self, params: dict) -> requests.Response:
+        fn = params['function']
+        with metrics.registry.timer('rate_limit_wait_seconds', fn=fn):
+            self.bucket.acquire()
+        self.quota.consume()
+        metrics.registry.inc('quota_consumed_total')
+        if self.quota.per_day is not None:
+            metrics.registry.set('quota_remaining', self.quota.remaining)
+
+        with metrics.registry.timer('http_request_seconds', fn=fn):
+            response = self.session.get(self.base_url, params=params,
+                                        timeout=self.timeout)
+        metrics.registry.inc('http_bytes_total', len(response.content),
+                             fn=fn)
+        response.raise_for_status()
+        return response
+
+    def _get(self, fn: str, symbol: Optional[str], api_key: Optional[str],
+             params: dict) -> tuple:
+        # Return the reply body & its parse if it was small enough to
+        # be checked for throttling (see notice()).
+        params = {'function': fn.upper(), **params}
+        if symbol is not None:
+            params['symbol'] = symbol.upper()
+        params['apikey'] = api_key or self.api_key
+
+        fn = params['function']
+        for attempt in range(self.max_retries + 1):
+            content = self._send(params).content
+            with metrics.registry.timer('json_parse_seconds', fn=fn):
+                small = notice(content)
+            message = _throttle_message(small)
+            if message is None:
+                return content, small
+
+            self.bucket.drain()
+            if attempt < self.max_retries:
+                self.retries += 1
+                metrics.registry.inc('retries_total', fn=fn)
+                with metrics.registry.timer('throttle_sleep_seconds', fn=fn):
+                    time.sleep(self.backoff * 2 ** attempt)
+
+        raise ThrottleError(message)
+
+    def get_bytes(self, fn: str, symbol: Optional[str] = None,
+                  api_key: Optional[str] = None, **params) -> bytes:
+        """Request an AV function & return the raw response body.
+
+        Raises ThrottleError if still throttled after max_retries.
+        """
+        return self._get(fn, symbol, api_key, params)[0]
+
+    def get(self, fn: str, symbol: Optional[str] = None,
+            api_key: Optional[str] = None, **params) -> dict:
+        """Request an AV function & return its parsed json.
+
+        Raises ThrottleError if still throttled after max_retries.
+        """
+        content, result = self._get(fn, symbol, api_key, params)
+        if result is None:
+            with metrics.registry.timer('json_parse_seconds',
+                                        fn=fn.upper()):
+                result = loads(content)
+        return result
+
+    def close(self) -> None:
+        self.session.close()
+
+
+_client: Optional[AVClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> AVClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AVClient()
+        return _client
+
+
+def configure_client(rate_limit: Union[str, RateLimit] = 'free',
+                     **kwargs) -> AVClient:
+    """Replace the process-wide client, e.g. for a premium plan.
+
+    kwargs are passed to AVClient.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+        _client = AVClient(rate_limit, **kwargs)
+        return _client
@@ -0,0 +1,76 @@
+"""Concurrent batch fetching of AV responses.
+
+Requests run on worker threads under an asyncio semaphore, so at most
+`concurrency` are in flight at once while the shared AVClient's token
+bucket keeps the overall rate within the plan's limits. Cached
+responses are served without touching the network.
+
+Functions:
+fetch_as_completed -- async generator of (symbol, result) pairs.
+fetch_many -- fetch a list of symbols & return {symbol: result}.
+
+"""
+import asyncio
+import concurrent.futures
+from typing import AsyncIterator, Iterable, Optional
+
+from equity import AVRequest
+
+
+async def fetch_as_completed(fn: str,
+                             symbols: Iterable[str],
+                             concurrency: int = 8,
+                             output_format: str = 'json',
+                             api_key: Optional[str] = None,
+                             return_exceptions: bool = False
+                             ) -> AsyncIterator[tuple]:
+    """Yield (symbol, result) for each symbol as its request finishes.
+
+    With return_exceptions=True, a failed request yields its exception
+    as the result instead of cancelling the rest of the batch.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(symbol):
+        async with semaphore:
+            request = AVRequest(fn, symbol, api_key=api_key)
+            try:
+                result = await asyncio.to_thread(
+                    request.output, output_format
+                )
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                result = e
+            return symbol, result
+
+    tasks = [asyncio.create_task(fetch(symbol)) for symbol in symbols]
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _collect(fn, symbols, **kwargs) -> dict:
+    return {symbol: result async for symbol, result
+            in fetch_as_completed(fn, symbols, **kwargs)}
+
+
+def fetch_many(fn: str, symbols: Iterable[str], **kwargs) -> dict:
+    """Fetch fn for every symbol concurrently.
+
+    Returns {symbol: result} in order of completion. kwargs are passed
+    to fetch_as_completed().
+    """
+    coro = _collect(fn, list(symbols), **kwargs)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    # Already inside an event loop (e.g. Jupyter): run on a fresh loop
+    # in another thread rather than nesting.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
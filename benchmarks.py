@@ -0,0 +1,350 @@
+"""Benchmarks for stonks.
+
+Fetch benchmarks run against a local av_server.AVServer with an empty,
+temporary response cache, so results need no API key or quota & are
+comparable between versions. Run as a script to print results, &
+write them as json for tracking regressions:
+
+    python benchmarks.py
+    python benchmarks.py --json bench.json --latency 0.05
+    python benchmarks.py --only fetch_single normalize
+
+Functions:
+bench_import_time -- cold import time of project modules.
+bench_fetch_single -- one statement request, uncached, from the
+    response cache & from the frame cache.
+bench_fetch_bulk -- concurrent overview requests for many symbols.
+bench_normalize -- raw response to normalized frame.
+bench_gics_lookup -- GICS index build & lookups.
+bench_vs_peers -- peer overview comparison.
+offline -- context manager pointing the client & cache at a local
+    AV server.
+run -- run benchmarks & return json-ready results.
+
+"""
+import argparse
+import contextlib
+import datetime as dt
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Optional, Sequence
+
+# Modules a worker process typically imports.
+MODULES = ('cache', 'avclient', 'equity', 'industries', 'batch',
+           'fundamentals')
+
+_REPO_DIR = Path(__file__).resolve().parent
+
+
+def _import_seconds(module: str) -> float:
+    # Time the import in a fresh interpreter so nothing is preloaded.
+    code = (
+        'import time; t = time.perf_counter(); '
+        f'import {module}; '
+        'print(time.perf_counter() - t)'
+    )
+    out = subprocess.run(
+        [sys.executable, '-c', code], cwd=_REPO_DIR, check=True,
+        capture_output=True, text=True
+    )
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def _timings(func: Callable, repeat: int,
+             setup: Optional[Callable] = None) -> dict:
+    # Summary of `repeat` timed calls; setup runs untimed before each.
+    seconds = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        seconds.append(time.perf_counter() - start)
+    return {
+        'median_s': statistics.median(seconds),
+        'min_s': min(seconds),
+        'max_s': max(seconds),
+        'repeat': repeat,
+    }
+
+
+@contextlib.contextmanager
+def offline(latency: float = 0.0, per_minute: Optional[int] = None):
+    """Serve AV locally & point the shared client & cache at it.
+
+    Yields the running AVServer. The client is given an unthrottled
+    premium rate limit, so the server's per_minute decides throttling;
+    the response cache lives in a temporary folder & the frame cache
+    starts empty. On exit the cache folder is restored, the frame
+    cache emptied & the client reset to the default.
+    """
+    import avclient
+    import cache
+    from av_server import AVServer
+
+    response_cache = cache.default_cache()
+    old_root = response_cache.root
+    cache.frame_cache().clear()
+    with tempfile.TemporaryDirectory() as root, \
+            AVServer(latency=latency, per_minute=per_minute) as server:
+        response_cache.root = Path(root)
+        avclient.configure_client('premium_1200', api_key='bench',
+                                  base_url=server.url, backoff=0.1)
+        try:
+            yield server
+        finally:
+            avclient.configure_client()
+            response_cache.root = old_root
+            cache.frame_cache().clear()
+
+
+def _clear_frames() -> None:
+    from cache import frame_cache
+    frame_cache().clear()
+
+
+def _clear_cache() -> None:
+    from cache import default_cache
+    default_cache().invalidate()
+    _clear_frames()
+
+
+def _symbols(count: int) -> list:
+    from industries import sp500_constituents
+    symbols = sp500_constituents().index.dropna()
+    return list(symbols[:count])
+
+
+def bench_import_time(modules=MODULES, repeat: int = 5) -> dict:
+    """Return {module: median cold import time in seconds}.
+
+    Importing must not read data or key files, or touch the network,
+    so these times are library import costs only.
+    """
+    return {
+        module: statistics.median(
+            _import_seconds(module) for _ in range(repeat)
+        )
+        for module in modules
+    }
+
+
+def bench_fetch_single(symbol: str = 'ISRG', repeat: int = 20) -> dict:
+    """Time fetching one income statement to a normalized frame, from
+    the server, from the response cache (parsing & normalizing it) &
+    from the in-memory frame cache.
+
+    """
+    from equity import Stock
+
+    def fetch():
+        Stock(symbol, api_key='bench').get_income_statement()
+
+    return {
+        'uncached': _timings(fetch, repeat, setup=_clear_cache),
+        'cached': _timings(fetch, repeat, setup=_clear_frames),
+        'memory': _timings(fetch, repeat),
+    }
+
+
+def bench_fetch_bulk(count: int = 100, concurrency: int = 8,
+                     repeat: int = 3) -> dict:
+    """Time fetching `count` constituents' overviews concurrently."""
+    from batch import fetch_many
+    symbols = _symbols(count)
+
+    def fetch():
+        results = fetch_many('OVERVIEW', symbols, concurrency=concurrency,
+                             output_format='polars',
+                             return_exceptions=True)
+        failed = [s for s, r in results.items() if isinstance(r, Exception)]
+        if failed:
+            raise RuntimeError(f'Bulk fetch failed for {failed}')
+
+    result = _timings(fetch, repeat, setup=_clear_cache)
+    result.update(symbols=count, concurrency=concurrency,
+                  symbols_per_s=count / result['median_s'])
+    return result
+
+
+def bench_normalize(repeat: int = 50) -> dict:
+    """Time normalizing each statement type & a universe of overviews
+    from raw responses, & each statement from response bytes (parse
+    included).
+
+    """
+    import polars as pl
+
+    from av_server import synthetic_payload
+    from avclient import loads
+    from cache import STATEMENT_FUNCTIONS, response_frame, response_frames
+    from statements import normalize
+
+    results = {}
+    for fn in STATEMENT_FUNCTIONS:
+        response = synthetic_payload(fn, 'ISRG')
+        content = json.dumps(response).encode()
+        results[fn] = _timings(
+            lambda: normalize(response_frame(fn, response, 'annual'), fn),
+            repeat
+        )
+        results[f'{fn} bytes'] = _timings(
+            lambda: normalize(
+                response_frames(fn, loads(content))['annual'], fn
+            ),
+            repeat
+        )
+
+    overviews = pl.concat([
+        response_frame('OVERVIEW', synthetic_payload('OVERVIEW', symbol))
+        for symbol in _symbols(500)
+    ])
+    results['OVERVIEW x500'] = _timings(
+        lambda: normalize(overviews, 'OVERVIEW'), repeat
+    )
+    return results
+
+
+def bench_gics_lookup(lookups: int = 10_000, repeat: int = 5) -> dict:
+    """Time building the GICS index & looking up symbols & peers."""
+    import industries
+
+    def build():
+        industries.gics_index.cache_clear()
+        industries.gics_index()
+
+    build_time = _timings(build, repeat)
+    index = industries.gics_index()
+    symbols = _symbols(500)
+
+    def lookup():
+        for n in range(lookups):
+            classification = index.classify(symbols[n % len(symbols)])
+            index.peers('Sub-Industry', classification['Sub-Industry'])
+
+    lookup_time = _timings(lookup, repeat)
+    return {
+        'build': build_time,
+        'lookup': lookup_time,
+        'lookups': lookups,
+        'lookup_us': lookup_time['median_s'] / lookups * 1e6,
+    }
+
+
+def bench_vs_peers(symbol: str = 'XOM', peer_level: str = 'Industry',
+                   ratios: Sequence[str] = ('P/E', 'P/B', 'EV/EBITDA'),
+                   repeat: int = 3) -> dict:
+    """Time a peer comparison, fetching every peer's overview."""
+    from fundamentals import Ratios
+    from industries import gics_index
+
+    classification = gics_index().classify(symbol)
+    stock = Ratios(symbol, classification['Sector'],
+                   classification['Industry'],
+                   classification['Sub-Industry'])
+    result = _timings(lambda: stock.vs_peers(peer_level, *ratios), repeat,
+                      setup=_clear_cache)
+    result.update(symbol=symbol, peer_level=peer_level,
+                  peers=len(stock.peers(peer_level)))
+    return result
+
+
+# Benchmarks needing the local AV server.
+OFFLINE = {
+    'fetch_single': bench_fetch_single,
+    'fetch_bulk': bench_fetch_bulk,
+    'vs_peers': bench_vs_peers,
+}
+LOCAL = {
+    'import_time': bench_import_time,
+    'normalize': bench_normalize,
+    'gics_lookup': bench_gics_lookup,
+}
+BENCHMARKS = {**LOCAL, **OFFLINE}
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                             cwd=_REPO_DIR, capture_output=True, text=True,
+                             check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def run(names: Sequence[str] = tuple(BENCHMARKS), latency: float = 0.0,
+        per_minute: Optional[int] = None) -> dict:
+    """Run the named benchmarks & return their results with the
+    environment they ran in.
+
+    """
+    import polars as pl
+
+    results = {}
+    for name in names:
+        if name in LOCAL:
+            results[name] = BENCHMARKS[name]()
+    offline_names = [name for name in names if name in OFFLINE]
+    if offline_names:
+        with offline(latency, per_minute) as server:
+            for name in offline_names:
+                results[name] = BENCHMARKS[name]()
+            results['server'] = dict(server.stats)
+
+    return {
+        'meta': {
+            'timestamp': dt.datetime.now(dt.timezone.utc).isoformat(),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'polars': pl.__version__,
+            'platform': platform.platform(),
+            'latency_s': latency,
+            'per_minute': per_minute,
+        },
+        'results': results,
+    }
+
+
+def _print(results: dict, prefix: str = '') -> None:
+    for key, value in results.items():
+        if isinstance(value, dict) and 'median_s' in value:
+            print(f'{prefix}{key:<28}{value["median_s"] * 1000:10.2f} ms')
+        elif isinstance(value, dict):
+            print(f'{prefix}{key}')
+            _print(value, prefix + '  ')
+        elif isinstance(value, float) and key in MODULES:
+            print(f'{prefix}import {key:<21}{value * 1000:10.2f} ms')
+        elif isinstance(value, float):
+            print(f'{prefix}{key:<28}{value:10.2f}')
+        else:
+            print(f'{prefix}{key:<28}{value!s:>10}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run stonks benchmarks.')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS,
+                        default=list(BENCHMARKS))
+    parser.add_argument('--json', type=Path, default=None,
+                        help='also write results to this json file')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='mean seconds the local AV server adds')
+    parser.add_argument('--per-minute', type=int, default=None,
+                        help='local AV server throttle limit')
+    args = parser.parse_args()
+
+    report = run(args.only, args.latency, args.per_minute)
+    _print(report['results'])
+    if args.json is not None:
+        args.json.write_text(json.dumps(report, indent=2))
+        print(f'Results written to: {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,493 @@
+"""On-disk cache of Alpha Vantage responses & in-memory cache of
+parsed frames.
+
+Responses are stored as Parquet files keyed by (function, symbol,
+frequency), with fetch & expiry times kept in the file's key-value
+metadata so a lookup never has to parse the payload to decide whether
+it is still fresh.
+
+A long-running process also keeps the frames it has parsed in a
+FrameCache keyed by (symbol, statement, frequency), so hot symbols
+skip the file read & normalization. It holds at most max_bytes of
+frames (by DataFrame.estimated_size()), evicting the least recently
+used, & counts hits, misses & evictions:
+
+    frames = frame_cache()
+    frames.stats()       # {'hits': ..., 'misses': ..., 'bytes': ...}
+
+Set STONKS_FRAME_CACHE_MB in the environment to size the shared one
+(0 keeps nothing).
+
+Classes:
+ResponseCache -- Parquet-backed, TTL-aware store of AV responses.
+FrameCache -- thread-safe, byte-bounded LRU of parsed frames.
+
+Functions:
+response_frame -- one frequency of a raw AV response as a frame.
+response_frames -- every frequency of a raw AV response as frames.
+default_cache -- process-wide ResponseCache used by equity.
+frame_cache -- process-wide FrameCache used by equity & fundamentals.
+
+"""
+import collections
+import datetime as dt
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Hashable, Optional
+
+import polars as pl
+
+import statements
+import storage
+
+STATEMENT_FUNCTIONS = ('INCOME_STATEMENT', 'BALANCE_SHEET', 'CASH_FLOW')
+
+# Keys of statement responses holding each frequency's list of reports.
+REPORT_KEYS = {
+    'annual': 'annualReports',
+    'quarterly': 'quarterlyReports',
+}
+
+# Frequency label for responses that are a single flat record, e.g.
+# OVERVIEW.
+SNAPSHOT = 'snapshot'
+
+# Minimum time an entry is kept, by AV function. Statements are also
+# kept until the company is due to report its next quarter; see
+# ResponseCache._expiry().
+TTL = {
+    'OVERVIEW': dt.timedelta(days=1),
+    'INCOME_STATEMENT': dt.timedelta(days=1),
+    'BALANCE_SHEET': dt.timedelta(days=1),
+    'CASH_FLOW': dt.timedelta(days=1),
+}
+DEFAULT_TTL = dt.timedelta(days=1)
+
+# A quarter plus the SEC's 45-day 10-Q filing window: the latest time a
+# newer quarter than the cached one should appear.
+REPORTING_INTERVAL = dt.timedelta(days=91 + 45)
+
+# FrameCache source of frames parsed from AV responses; other sources
+# (e.g. local dumps) pass their own.
+SOURCE = 'av'
+
+# Default size of the shared FrameCache, in MiB.
+FRAME_CACHE_MB = 256
+
+
+def _now() -> dt.datetime:
+    return dt.datetime.now(dt.timezone.utc)
+
+
+class ResponseCache:
+    """Parquet-backed store of AV responses with per-function TTLs.
+
+    Files live at <root>/<FUNCTION>/<SYMBOL>_<frequency>.parquet. An
+    OVERVIEW is kept for TTL['OVERVIEW']; a statement is kept until a
+    newer LatestQuarter than its latest cached fiscalDateEnding is
+    seen in the symbol's cached overview, or until REPORTING_INTERVAL
+    after that fiscalDateEnding if no overview is cached.
+
+    """
+
+    def __init__(self, root: Optional[Path] = None):
+        self.root = root
+
+    @property
+    def root(self) -> Path:
+        if self._root is None:
+            return Path.cwd() / 'request_cache'
+        return self._root
+
+    @root.setter
+    def root(self, value):
+        self._root = None if value is None else Path(value)
+
+    def path(self, fn: str, symbol: str, frequency: str = SNAPSHOT) -> Path:
+        return (self.root / fn.upper()
+                / f'{symbol.upper()}_{frequency}.parquet')
+
+    def _metadata(self, path: Path) -> Optional[dict]:
+        try:
+            return pl.read_parquet_metadata(path)
+        except (FileNotFoundError, OSError):
+            return None
+
+    def _latest_quarter(self, symbol: str) -> Optional[dt.date]:
+        # LatestQuarter of the symbol's cached overview, if still fresh.
+        path = self.path('OVERVIEW', symbol)
+        meta = self._metadata(path)
+        if meta is None or not self._is_fresh(meta):
+            return None
+        ov = pl.read_parquet(path)
+        if 'LatestQuarter' not in ov.columns or ov.is_empty():
+            return None
+        try:
+            return dt.date.fromisoformat(str(ov['LatestQuarter'][0]))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _is_fresh(meta: dict) -> bool:
+        expires_at = meta.get('expires_at')
+        if expires_at is None:
+            return False
+        return _now() < dt.datetime.fromisoformat(expires_at)
+
+    def is_fresh(self, fn: str, symbol: str,
+                 frequency: str = SNAPSHOT) -> bool:
+        fn = fn.upper()
+        meta = self._metadata(self.path(fn, symbol, frequency))
+        if meta is None or not self._is_fresh(meta):
+            return False
+
+        if fn in STATEMENT_FUNCTIONS and meta.get('latest_quarter'):
+            # Company reported a newer period than the one cached.
+            latest_quarter = self._latest_quarter(symbol)
+            cached_quarter = dt.date.fromisoformat(meta['latest_quarter'])
+            if latest_quarter is not None and latest_quarter > cached_quarter:
+                return False
+        return True
+
+    def get(self, fn: str, symbol: str,
+            frequency: str = SNAPSHOT) -> Optional[pl.DataFrame]:
+        """Return the cached frame, or None if missing or expired."""
+        if not self.is_fresh(fn, symbol, frequency):
+            return None
+        return pl.read_parquet(self.path(fn, symbol, frequency))
+
+    @staticmethod
+    def _expiry(fn: str, fetched_at: dt.datetime,
+                latest_quarter: Optional[dt.date]) -> dt.datetime:
+        expires_at = fetched_at + TTL.get(fn, DEFAULT_TTL)
+        if latest_quarter is not None:
+            next_report = dt.datetime.combine(
+                latest_quarter + REPORTING_INTERVAL, dt.time(),
+                tzinfo=dt.timezone.utc
+            )
+            expires_at = max(expires_at, next_report)
+        return expires_at
+
+    def put(self, fn: str, symbol: str, frame: pl.DataFrame,
+            frequency: str = SNAPSHOT,
+            latest_quarter: Optional[dt.date] = None) -> Path:
+        """Write frame to the cache & return its path.
+
+        latest_quarter is the latest fiscal period the frame covers;
+        statements are kept until a newer one is due or reported.
+        """
+        fn = fn.upper()
+        if latest_quarter is None and 'fiscalDateEnding' in frame.columns:
+            latest_quarter = _max_date(frame['fiscalDateEnding'])
+
+        fetched_at = _now()
+        meta = {
+            'fetched_at': fetched_at.isoformat(),
+            'expires_at': self._expiry(
+                fn, fetched_at, latest_quarter
+            ).isoformat(),
+        }
+        if latest_quarter is not None:
+            meta['latest_quarter'] = latest_quarter.isoformat()
+
+        # Atomic, so a reader never sees a partially written file.
+        return storage.write(frame, self.path(fn, symbol, frequency),
+                             metadata=meta)
+
+    def get_response(self, fn: str, symbol: str) -> Optional[dict]:
+        """Rebuild a raw AV json response from the cache.
+
+        Returns None unless every part of the response is fresh.
+        """
+        fn = fn.upper()
+        if fn not in STATEMENT_FUNCTIONS:
+            frame = self.get(fn, symbol)
+            if frame is None or frame.is_empty():
+                return None
+            return _record(frame.row(0, named=True))
+
+        response = {'symbol': symbol.upper()}
+        for frequency, key in REPORT_KEYS.items():
+            frame = self.get(fn, symbol, frequency)
+            if frame is None:
+                return None
+            response[key] = [_record(row) for row in frame.iter_rows(
+                named=True
+            )]
+        return response
+
+    def put_response(self, fn: str, symbol: str, response: dict) -> bool:
+        """Store a raw AV json response. Returns False if not cacheable.
+
+        Error, throttle & empty responses are never cached, nor are
+        nested responses (e.g. time series) of other shapes.
+        """
+        fn = fn.upper()
+        if not response or _is_error(response):
+            return False
+
+        if fn in STATEMENT_FUNCTIONS:
+            if not all(key in response for key in REPORT_KEYS.values()):
+                return False
+        elif any(isinstance(v, (dict, list)) for v in response.values()):
+            return False
+        return self.put_frames(fn, symbol, response_frames(fn, response))
+
+    def put_frames(self, fn: str, symbol: str, frames: dict) -> bool:
+        """Store a response as {frequency: frame} (see
+        response_frames). Returns False if not cacheable.
+
+        Statements are only cached with both frequencies, so
+        get_response() can rebuild the whole response.
+        """
+        fn = fn.upper()
+        if fn not in STATEMENT_FUNCTIONS:
+            frame = frames.get(SNAPSHOT)
+            if frame is None or frame.is_empty():
+                return False
+            self.put(fn, symbol, frame)
+            return True
+
+        if not all(frequency in frames for frequency in REPORT_KEYS):
+            return False
+        quarterly = frames['quarterly']
+        latest_quarter = None if quarterly.is_empty() \
+            else _max_date(quarterly['fiscalDateEnding'])
+        for frequency in REPORT_KEYS:
+            self.put(fn, symbol, frames[frequency], frequency,
+                     latest_quarter)
+        return True
+
+    def invalidate(self, fn: Optional[str] = None,
+                   symbol: Optional[str] = None) -> int:
+        """Delete cached entries matching fn and/or symbol.
+
+        Returns the number of files removed.
+        """
+        fn_glob = '*' if fn is None else fn.upper()
+        symbol_glob = '*' if symbol is None else symbol.upper()
+        removed = 0
+        for path in self.root.glob(f'{fn_glob}/{symbol_glob}_*.parquet'):
+            path.unlink(missing_ok=True)
+            removed += 1
+        return removed
+
+
+class FrameCache:
+    """Thread-safe LRU of parsed frames keyed by (symbol, statement,
+    frequency, source), holding at most max_bytes of them.
+
+    Entries are kept for TTL[statement] (DEFAULT_TTL if not listed),
+    like ResponseCache's minimum, so a long-running process sees newer
+    data at least as often as the disk cache expires. A version (e.g.
+    a source file's path & mtime) may be stored with a frame; a lookup
+    with a different version is a miss. Frames of one statement from
+    different sources (e.g. AV & a local dump) are kept apart, so they
+    don't evict each other. Frames larger than max_bytes are never
+    kept.
+    """
+
+    def __init__(self, max_bytes: int = FRAME_CACHE_MB * 2 ** 20):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # key -> (frame, size, version, expires_at), oldest use first.
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def __repr__(self) -> str:
+        return (f'FrameCache({len(self._entries)} frames, '
+                f'{self._bytes} of {self.max_bytes} bytes)')
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _key(symbol: str, statement: str, frequency: str,
+             source: str) -> tuple:
+        return symbol.upper(), statement.upper(), frequency, source
+
+    def _drop(self, key: tuple) -> None:
+        # Caller holds the lock.
+        self._bytes -= self._entries.pop(key)[1]
+
+    def get(self, symbol: str, statement: str, frequency: str = SNAPSHOT,
+            version: Hashable = None,
+            source: str = SOURCE) -> Optional[pl.DataFrame]:
+        """Return the cached frame, or None if missing, expired or of
+        another version.
+
+        """
+        key = self._key(symbol, statement, frequency, source)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[2] != version
+                                      or entry[3] <= _now()):
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+        # A clone shares the frame's buffers but not its columns, so a
+        # caller replacing columns in place leaves the cached one be.
+        return entry[0].clone()
+
+    def put(self, symbol: str, statement: str, frame: pl.DataFrame,
+            frequency: str = SNAPSHOT, version: Hashable = None,
+            source: str = SOURCE) -> bool:
+        """Cache frame, evicting the least recently used frames to make
+        room. Returns False if it is larger than max_bytes.
+
+        """
+        key = self._key(symbol, statement, frequency, source)
+        size = frame.estimated_size()
+        expires_at = _now() + TTL.get(key[1], DEFAULT_TTL)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if size > self.max_bytes:
+                return False
+            while self._bytes + size > self.max_bytes:
+                self._bytes -= self._entries.popitem(last=False)[1][1]
+                self._evictions += 1
+            self._entries[key] = (frame.clone(), size, version, expires_at)
+            self._bytes += size
+        return True
+
+    def get_or_load(self, symbol: str, statement: str,
+                    load: Callable[[], pl.DataFrame],
+                    frequency: str = SNAPSHOT,
+                    version: Hashable = None,
+                    source: str = SOURCE) -> pl.DataFrame:
+        """Return the cached frame, calling load() to fill a miss.
+
+        Concurrent misses on one key may each call load(); the last
+        frame loaded is kept.
+        """
+        frame = self.get(symbol, statement, frequency, version, source)
+        if frame is None:
+            frame = load()
+            self.put(symbol, statement, frame, frequency, version, source)
+        return frame
+
+    def invalidate(self, statement: Optional[str] = None,
+                   symbol: Optional[str] = None) -> int:
+        """Drop cached frames matching statement and/or symbol, from
+        every source.
+
+        Returns the number of frames dropped.
+        """
+        statement = None if statement is None else statement.upper()
+        symbol = None if symbol is None else symbol.upper()
+        with self._lock:
+            keys = [
+                key for key in self._entries
+                if (symbol is None or key[0] == symbol)
+                and (statement is None or key[1] == statement)
+            ]
+            for key in keys:
+                self._drop(key)
+        return len(keys)
+
+    def clear(self) -> None:
+        """Drop every frame & reset the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._hits = self._misses = self._evictions = 0
+
+    def stats(self) -> dict:
+        """Return hits, misses, hit_rate, evictions, frames, bytes &
+        max_bytes.
+
+        """
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / lookups if lookups else None,
+                'evictions': self._evictions,
+                'frames': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+def response_frame(fn: str, response: dict,
+                   frequency: str = SNAPSHOT) -> pl.DataFrame:
+    """Return one frequency of a raw AV response as a frame.
+
+    Statements give one row per report; other responses one row.
+    """
+    fn = fn.upper()
+    if fn in STATEMENT_FUNCTIONS:
+        return _records_frame(fn, response[REPORT_KEYS[frequency]])
+    return _records_frame(fn, [response])
+
+
+def response_frames(fn: str, response: dict) -> dict:
+    """Return a raw AV response as {frequency: frame}.
+
+    Statements give every frequency whose reports are in the response,
+    other functions {SNAPSHOT: one row}.
+    """
+    fn = fn.upper()
+    if fn not in STATEMENT_FUNCTIONS:
+        return {SNAPSHOT: _records_frame(fn, [response])}
+    return {
+        frequency: _records_frame(fn, response[key])
+        for frequency, key in REPORT_KEYS.items() if key in response
+    }
+
+
+def _records_frame(fn: str, records: list) -> pl.DataFrame:
+    # AV returns every value as a string; keep them that way so cached
+    # responses round-trip. Functions with a schema get a column for
+    # every field it knows, missing or not, then for any other field
+    # the records hold, so no field is dropped.
+    columns = dict(statements.source_schema(fn)) \
+        if fn in statements.SCHEMAS else {}
+    for record in records:
+        for key in record:
+            columns.setdefault(key, pl.String)
+    return pl.DataFrame(records, schema=columns)
+
+
+def _record(row: dict) -> dict:
+    # A cached row as AV sent it: without the null columns of schema
+    # fields the response lacked (AV sends no json nulls).
+    return {key: value for key, value in row.items() if value is not None}
+
+
+def _max_date(dates: pl.Series) -> Optional[dt.date]:
+    parsed = dates.cast(pl.String).str.to_date('%Y-%m-%d', strict=False)
+    return parsed.max()
+
+
+def _is_error(response: dict) -> bool:
+    # AV signals errors & throttling with HTTP 200 & one of these keys.
+    return any(key in response
+               for key in ('Error Message', 'Note', 'Information'))
+
+
+_default_cache = ResponseCache()
+
+
+def default_cache() -> ResponseCache:
+    return _default_cache
+
+
+_frame_cache = FrameCache(
+    int(float(os.environ.get('STONKS_FRAME_CACHE_MB', FRAME_CACHE_MB))
+        * 2 ** 20)
+)
+
+
+def frame_cache() -> FrameCache:
+    return _frame_cache
@@ -0,0 +1,416 @@
+"""Command-line entry point for batch work over the universe.
+
+    python cli.py refresh --workers 8 --quota 500
+    python cli.py screen 'Health Care, ROE > 15%' -o health_care.csv
+    python cli.py export INCOME_STATEMENT is.parquet --symbols AAPL MSFT
+
+refresh brings the FundamentalsStore up to date symbol by symbol on
+`workers` threads, all sharing the process-wide AVClient & its rate
+limit. Each finished symbol is appended to a checkpoint file in the
+store, so an interrupted run (Ctrl-C, a crash, the quota budget or
+AV's daily limit running out) picks up where it stopped when run
+again; --restart ignores the checkpoint. The checkpoint records the
+run's symbols, statements & --force & the day it started; a run with
+other ones, or one more than CHECKPOINT_MAX_AGE later, discards it &
+starts over. The checkpoint is removed once every symbol is done.
+
+screen runs a screen query (see screen.py) & export writes a stored
+statement, overviews, the long statement panel or ratios. Both print
+the result or write it to a file in the format of its suffix (see
+storage.py).
+
+Classes:
+Checkpoint -- symbols a run has finished, appended as they finish.
+Budget -- AV requests a run may still make.
+Progress -- one-line progress report on stderr.
+
+Functions:
+refresh -- resumable, parallel, quota-bounded universe refresh.
+export -- a stored table as a LazyFrame.
+main -- parse arguments & run a command.
+
+"""
+import argparse
+import collections
+import datetime as dt
+import json
+import os
+import sys
+import threading
+import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Optional, Sequence
+
+import polars as pl
+
+import storage
+from avclient import PRESETS
+from avclient import configure_client
+from avclient import get_client
+from cache import STATEMENT_FUNCTIONS
+from exceptions import QuotaExceededError
+from store import FundamentalsStore
+from store import universe
+
+CHECKPOINT = '_refresh_checkpoint.ndjson'
+# Longest a checkpoint is resumed after its run started.
+CHECKPOINT_MAX_AGE = dt.timedelta(days=7)
+# What export can write, besides the AV functions in the store.
+EXPORTS = ('panel', 'ratios', 'manifest')
+
+
+def _today() -> dt.date:
+    return dt.datetime.now(dt.timezone.utc).date()
+
+
+class Checkpoint:
+    """Symbols a run has finished, one json line each, appended &
+    synced as they finish so a crash loses at most the line being
+    written.
+
+    run -- the run's parameters (json-serializable), written as the
+        first line with the day the run started. A checkpoint of a
+        run with other parameters, or started over CHECKPOINT_MAX_AGE
+        ago, is discarded; `discarded` then says why.
+    """
+
+    def __init__(self, path: Path, run: Optional[dict] = None):
+        self.path = Path(path)
+        self.run = {} if run is None else run
+        self._lock = threading.Lock()
+        self.done = set()
+        self.started = _today()
+        self.discarded = None
+        if self.path.exists():
+            self._read()
+
+    def _read(self) -> None:
+        header, done = None, set()
+        for line in self.path.read_text().splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # a line cut short by a crash
+            if 'run' in entry and header is None:
+                header = entry
+            elif entry.get('status') == 'done':
+                done.add(entry['symbol'])
+
+        if header is None:
+            self.discarded = 'it records no run parameters'
+        elif header['run'] != self.run:
+            changed = sorted(
+                key for key in {*header['run'], *self.run}
+                if header['run'].get(key) != self.run.get(key)
+            )
+            self.discarded = f'its run had other {", ".join(changed)}'
+        elif (self.started - dt.date.fromisoformat(header['started'])
+              > CHECKPOINT_MAX_AGE):
+            self.discarded = f'its run started on {header["started"]}'
+        if self.discarded is not None:
+            self.path.unlink(missing_ok=True)
+            return
+        self.started = dt.date.fromisoformat(header['started'])
+        self.done = done
+
+    def _append(self, entry: dict) -> None:
+        # Caller holds the lock.
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def add(self, symbol: str, status: str, **details) -> None:
+        entry = {
+            'symbol': symbol,
+            'status': status,
+            'at': dt.datetime.now(dt.timezone.utc).isoformat(),
+            **details,
+        }
+        with self._lock:
+            if not self.path.exists():
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._append({'run': self.run,
+                              'started': self.started.isoformat()})
+            self._append(entry)
+            if status == 'done':
+                self.done.add(symbol)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.path.unlink(missing_ok=True)
+            self.done.clear()
+            self.started = _today()
+
+
+class Budget:
+    """AV requests a run may still make.
+
+    A symbol reserves its worst-case cost before it starts & releases
+    it when done; it may start only if the requests made so far plus
+    every reservation stay within the limit, so the run never exceeds
+    it. None is no limit.
+    """
+
+    def __init__(self, limit: Optional[int]):
+        self.limit = limit
+        self._quota = get_client().quota
+        self._start = self._quota.used
+        self._reserved = 0
+        self._lock = threading.Lock()
+
+    @property
+    def spent(self) -> int:
+        return self._quota.used - self._start
+
+    def reserve(self, cost: int) -> bool:
+        with self._lock:
+            if (self.limit is not None
+                    and self.spent + self._reserved + cost > self.limit):
+                return False
+            self._reserved += cost
+            return True
+
+    def release(self, cost: int) -> None:
+        with self._lock:
+            self._reserved -= cost
+
+
+class Progress:
+    """One-line progress report, redrawn in place on a terminal & one
+    line per symbol otherwise.
+
+    """
+
+    def __init__(self, total: int, stream=sys.stderr):
+        self.total = total
+        self.count = 0
+        self.failed = 0
+        self.stream = stream
+        self._tty = stream.isatty()
+        self._start = time.perf_counter()
+
+    def update(self, symbol: str, status: str, requests: int) -> None:
+        self.count += 1
+        self.failed += status != 'done'
+        width = len(str(self.total))
+        line = (f'[{self.count:>{width}}/{self.total}] {symbol:<6} '
+                f'{status:<7} {requests} requests, {self.failed} failed, '
+                f'{time.perf_counter() - self._start:.0f} s')
+        self.stream.write(f'\r{line}\033[K' if self._tty else line + '\n')
+        self.stream.flush()
+
+    def close(self) -> None:
+        if self._tty and self.count:
+            self.stream.write('\n')
+
+
+def refresh(store: Optional[FundamentalsStore] = None,
+            symbols: Optional[Sequence[str]] = None,
+            statements: Sequence[str] = STATEMENT_FUNCTIONS,
+            workers: int = 8,
+            quota: Optional[int] = None,
+            force: bool = False,
+            restart: bool = False,
+            progress: bool = True) -> dict:
+    """Refresh the store symbol by symbol & return a summary.
+
+    symbols defaults to the universe (see store.py). Symbols already
+    in the store's checkpoint are skipped unless restart=True or the
+    checkpoint is of another run (see Checkpoint). At most
+    `quota` AV requests are made; symbols that would exceed it are
+    left for the next run, as are the rest once AV's daily limit is
+    reached.
+    """
+    store = FundamentalsStore() if store is None else store
+    members = universe()
+    if symbols is not None:
+        symbols = [s.upper() for s in symbols]
+        members = members.filter(pl.col('symbol').is_in(symbols))
+    sectors = dict(members.iter_rows())
+
+    checkpoint = Checkpoint(store.root / CHECKPOINT, {
+        'symbols': None if symbols is None else sorted(set(symbols)),
+        'statements': sorted(statements),
+        'force': force,
+    })
+    if restart:
+        checkpoint.clear()
+    elif checkpoint.discarded is not None:
+        warnings.warn(f'Discarded the refresh checkpoint, as '
+                      f'{checkpoint.discarded}; starting over.')
+    pending = [s for s in sectors if s not in checkpoint.done]
+    budget = Budget(quota)
+    cost = 1 + len(statements)
+    report = Progress(len(pending)) if progress else None
+    summary = {'symbols': len(sectors), 'skipped': len(sectors)
+               - len(pending), 'done': [], 'failed': {}, 'rows_added': 0,
+               'stopped': None}
+
+    def run(symbol):
+        try:
+            return store.refresh_symbol(symbol, sectors[symbol],
+                                        statements, force)
+        finally:
+            budget.release(cost)
+
+    queue = collections.deque(pending)
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        try:
+            while True:
+                # Keep `workers` symbols in flight, within the budget.
+                # Requests of running symbols count twice, as spent &
+                # reserved, so the budget is only final once they end.
+                while (queue and summary['stopped'] is None
+                       and len(running) < workers):
+                    if not budget.reserve(cost):
+                        if not running:
+                            summary['stopped'] = 'quota budget'
+                        break
+                    symbol = queue.popleft()
+                    running[pool.submit(run, symbol)] = symbol
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    symbol = running.pop(future)
+                    try:
+                        result = future.result()
+                    except QuotaExceededError as e:
+                        summary['stopped'] = 'daily limit'
+                        status, details = 'failed', {'error': str(e)}
+                    except Exception as e:
+                        status = 'failed'
+                        details = {'error': f'{type(e).__name__}: {e}'}
+                    else:
+                        status, details = 'done', result
+                    checkpoint.add(symbol, status, **details)
+                    if status == 'done':
+                        summary['done'].append(symbol)
+                        summary['rows_added'] += result['rows_added']
+                    else:
+                        summary['failed'][symbol] = details['error']
+                    if report is not None:
+                        report.update(symbol, status, budget.spent)
+        except KeyboardInterrupt:
+            for future in running:
+                future.cancel()
+            summary['stopped'] = 'interrupted'
+            raise
+        finally:
+            if report is not None:
+                report.close()
+
+    summary['requests'] = budget.spent
+    summary['remaining'] = sum(s not in checkpoint.done for s in sectors)
+    if not summary['remaining']:
+        checkpoint.clear()
+    return summary
+
+
+def export(what: str, store: Optional[FundamentalsStore] = None,
+           symbols: Optional[Sequence[str]] = None,
+           frequency: Optional[str] = 'annual') -> pl.LazyFrame:
+    """Return a stored table as a LazyFrame: an AV function's stored
+    frames, or 'panel', 'ratios' or 'manifest' (see EXPORTS).
+
+    """
+    store = FundamentalsStore() if store is None else store
+    symbols = None if symbols is None else [s.upper() for s in symbols]
+    if what == 'panel':
+        from panel import Panel
+        lf = Panel.from_store(store).select(symbols, frequency=frequency)
+        return lf.with_columns(pl.col('symbol').cast(pl.String))
+    if what == 'ratios':
+        from ratios import store_ratios
+        lf = store_ratios(store, frequency=frequency, lazy=True)
+    elif what == 'manifest':
+        lf = store.manifest().lazy()
+    else:
+        lf = store.scan(what)
+        if what.upper() in STATEMENT_FUNCTIONS and frequency is not None:
+            lf = lf.filter(pl.col('frequency') == frequency)
+    if symbols is not None:
+        lf = lf.filter(pl.col('symbol').is_in(symbols))
+    return lf
+
+
+def _output(frame, path: Optional[Path]) -> None:
+    # Write to path in its format, or print.
+    if path is not None:
+        storage.write(frame, path)
+        print(f'Wrote {path}', file=sys.stderr)
+        return
+    frame = frame.collect() if isinstance(frame, pl.LazyFrame) else frame
+    with pl.Config(tbl_rows=50):
+        print(frame)
+
+
+def main(argv: Optional[Sequence[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--store', type=Path, default=None,
+                        help='store root (default ./fundamentals_db)')
+    parser.add_argument('--plan', choices=sorted(PRESETS), default=None,
+                        help='AV plan whose rate limits to keep to')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('refresh', help='bring the store up to date')
+    p.add_argument('--symbols', nargs='+', default=None)
+    p.add_argument('--statements', nargs='+', default=STATEMENT_FUNCTIONS,
+                   choices=STATEMENT_FUNCTIONS)
+    p.add_argument('--workers', type=int, default=8)
+    p.add_argument('--quota', type=int, default=None,
+                   help='most AV requests to make this run')
+    p.add_argument('--force', action='store_true',
+                   help='refetch statements even if no new quarter')
+    p.add_argument('--restart', action='store_true',
+                   help='ignore the checkpoint of an unfinished run')
+    p.add_argument('--quiet', action='store_true')
+
+    p = commands.add_parser('screen', help='run a screen query')
+    p.add_argument('query')
+    p.add_argument('-o', '--output', type=Path, default=None)
+
+    p = commands.add_parser('export', help='write a stored table')
+    p.add_argument('what', choices=[*STATEMENT_FUNCTIONS, 'OVERVIEW',
+                                    *EXPORTS])
+    p.add_argument('output', type=Path, nargs='?', default=None)
+    p.add_argument('--symbols', nargs='+', default=None)
+    p.add_argument('--frequency', choices=['annual', 'quarterly'],
+                   default='annual')
+    args = parser.parse_args(argv)
+
+    if args.plan is not None:
+        configure_client(args.plan)
+    store = FundamentalsStore(args.store)
+
+    if args.command == 'refresh':
+        try:
+            summary = refresh(store, args.symbols, args.statements,
+                              args.workers, args.quota, args.force,
+                              args.restart, progress=not args.quiet)
+        except KeyboardInterrupt:
+            print('Interrupted; run again to continue.', file=sys.stderr)
+            sys.exit(130)
+        print(f'{len(summary["done"])} symbols refreshed, '
+              f'{len(summary["failed"])} failed, {summary["skipped"]} '
+              f'already done; {summary["rows_added"]} rows added with '
+              f'{summary["requests"]} requests.')
+        if summary['remaining']:
+            print(f'{summary["remaining"]} symbols left'
+                  + (f' ({summary["stopped"]} reached)'
+                     if summary['stopped'] else '')
+                  + '; run again to continue.')
+    elif args.command == 'screen':
+        from screen import parse
+        _output(parse(args.query).plan(store), args.output)
+    else:
+        _output(export(args.what, store, args.symbols, args.frequency),
+                args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""Recorded AV response files.
+
+A dump holds one AV response for one symbol & function, in a file
+named `SYMBOL_kind_DATE.json` (e.g. ISRG_is_2025-04-11.json), kind
+being ov, is, bs or scf & DATE the day it was recorded. av_server
+replays dumps, importer loads archives of them into the store &
+equity.DemoStock reads them in place of AV.
+
+Functions:
+load_dump -- read a dump as the AV response it records.
+
+"""
+import re
+from pathlib import Path
+
+from avclient import loads
+
+# Dump kinds, as used in file names, & the AV function of each.
+KINDS = {
+    'ov': 'OVERVIEW',
+    'is': 'INCOME_STATEMENT',
+    'bs': 'BALANCE_SHEET',
+    'scf': 'CASH_FLOW',
+}
+FILENAME = re.compile(
+    r'^(?P<symbol>[A-Za-z0-9.\-]+)_(?P<kind>ov|is|bs|scf)_'
+    r'(?P<date>\d{4}-\d{2}-\d{2})\.json$'
+)
+
+
+def load_dump(path: Path, fn: str, symbol: str) -> dict:
+    """Return a dump file as the AV response it records.
+
+    A statement dumped as a list of report records is taken as annual
+    reports; an overview as a list, its first record.
+    """
+    payload = loads(Path(path).read_bytes())
+    if isinstance(payload, list):
+        if fn == 'OVERVIEW':
+            return payload[0]
+        return {'symbol': symbol, 'annualReports': payload,
+                'quarterlyReports': []}
+    return payload
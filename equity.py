@@ -1,14 +1,24 @@
+import functools
 import json
-import requests
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Sequence
 
-import numpy as np
-import pandas as pd
 import polars as pl
-import matplotlib.pyplot as plt
-from alpha_vantage.timeseries import TimeSeries
-from alpha_vantage.fundamentaldata import FundamentalData
+
+import metrics
+import storage
+from avclient import get_client
+from cache import SNAPSHOT
+from cache import STATEMENT_FUNCTIONS
+from cache import default_cache
+from cache import frame_cache
+from cache import response_frames
+from dumps import KINDS
+from dumps import load_dump
+from exceptions import AVResponseError
+from statements import normalize
 
 # from fundamentals import IncomeStatement
 
@@ -19,19 +29,30 @@ from alpha_vantage.fundamentaldata import FundamentalData
 # import industries
 
 
+@functools.lru_cache(maxsize=None)
+def _load_api_keys(key_file: Path) -> dict:
+    # Read once per file; every Stock would otherwise re-read it.
+    with open(key_file, 'r') as f:
+        return json.load(f)
+
+
 def get_api_key(api: str, key_file: Path = None) -> str:
     if key_file is None:
         key_file = Path.cwd() / 'apikeys.json'
 
     try:
-        with open(key_file, 'r') as f:
-            keys = json.load(f)
-            key = keys[api]
-            return key
+        keys = _load_api_keys(Path(key_file).resolve())
+        key = keys[api]
+        return key
     except FileNotFoundError:
         print(f'File "{key_file}" was not found')
 
 
+def _count_lookup(fn: str, layer: str, hit: bool) -> None:
+    name = 'cache_hits_total' if hit else 'cache_misses_total'
+    metrics.registry.inc(name, fn=fn, layer=layer)
+
+
 class AVRequest:
     API = 'alpha_vantage'
 
@@ -44,16 +65,137 @@ class AVRequest:
     def url(self):
        return f'https://www.alphavantage.co/query?function={self.fn}&symbol={self.symbol}&apikey={self.api_key}'
 
-    def output(self, output_format: str = 'json'):
-        result = requests.get(self.url).json()
+    def _response(self, use_cache: bool = True) -> dict:
+        result = None
+        if use_cache:
+            result = default_cache().get_response(self.fn, self.symbol)
+            _count_lookup(self.fn, 'response', result is not None)
+
+        if result is None:
+            result = get_client().get(self.fn, self.symbol, self.api_key)
+            if use_cache:
+                default_cache().put_response(self.fn, self.symbol, result)
+        return result
+
+    def output(self, output_format: str = 'json',
+               frequency: str = 'annual', use_cache: bool = True):
+        """Return the AV response as json, pandas or polars.
+
+        For output_format='polars', statements are returned as one row
+        per report of the given frequency ('annual' or 'quarterly');
+        other functions as a single row.
+        """
+        with metrics.registry.timer('output_seconds', fn=self.fn,
+                                    format=output_format):
+            if output_format == 'polars':
+                return self._frame(frequency, use_cache)
+
+            result = self._response(use_cache)
+
+            if output_format == 'json':
+                return result
+            elif output_format == 'pandas':
+                # pandas is only needed for this format; importing it
+                # costs more than the rest of this module.
+                import pandas as pd
+                return pd.Series(result)
+
+    def _frame(self, frequency: str, use_cache: bool) -> pl.DataFrame:
+        if self.fn not in STATEMENT_FUNCTIONS:
+            frequency = SNAPSHOT
+
+        if use_cache:
+            frame = default_cache().get(self.fn, self.symbol, frequency)
+            _count_lookup(self.fn, 'frame', frame is not None)
+            if frame is not None:
+                return frame
+
+        # Parse & build the frames once, for the cache & the caller.
+        result = get_client().get(self.fn, self.symbol, self.api_key)
+        message = result.get('Error Message') or result.get('Information')
+        if message or not result:
+            raise AVResponseError(
+                message or f'No {self.fn} data for {self.symbol}.'
+            )
+        frames = response_frames(self.fn, result)
+        if use_cache:
+            default_cache().put_frames(self.fn, self.symbol, frames)
+        if frequency not in frames:
+            raise AVResponseError(f'No {self.fn} data for {self.symbol}.')
+        return frames[frequency]
+
+
+def normalized_frame(fn: str, symbol: str, frequency: str = 'annual',
+                     api_key: Optional[str] = None) -> pl.DataFrame:
+    """Return AV function fn's normalized frame for symbol, from the
+    process's frame cache (see cache.frame_cache()) if there, else
+    through AVRequest & its response cache.
+
+    """
+    fn = fn.upper()
+    if fn not in STATEMENT_FUNCTIONS:
+        frequency = SNAPSHOT
+    frame = frame_cache().get(symbol, fn, frequency)
+    _count_lookup(fn, 'memory', frame is not None)
+    if frame is None:
+        frame = normalize(
+            AVRequest(fn, symbol, api_key).output('polars', frequency), fn
+        )
+        frame_cache().put(symbol, fn, frame, frequency)
+    return frame
+
 
-        if output_format == 'json':
-            return result
-        elif output_format == 'pandas':
-            return pd.Series(result)
+class _Statement:
+    """Statement attribute loaded by the owner's get_* method on first
+    access & cached on the instance.
+
+    Assigning None or deleting the attribute drops the cached value so
+    the next access loads it again.
+
+    """
+
+    def __init__(self, getter: str):
+        self.getter = getter
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.attr = f'_{name}'
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        try:
+            return obj.__dict__[self.attr]
+        except KeyError:
+            value = obj.__dict__[self.attr] = getattr(obj, self.getter)()
+            return value
+
+    def __set__(self, obj, value):
+        if value is None:
+            obj.__dict__.pop(self.attr, None)
+        else:
+            obj.__dict__[self.attr] = value
+
+    def __delete__(self, obj):
+        obj.__dict__.pop(self.attr, None)
+
+    def is_loaded(self, obj) -> bool:
+        return self.attr in obj.__dict__
+
+    def load(self, obj):
+        return getattr(obj, self.getter)()
 
 
 class Stock:
+    # Names of the lazily loaded statement attributes.
+    STATEMENTS = ('overview', 'income_statement', 'balance_sheet',
+                  'cash_flow_statement')
+
+    overview = _Statement('get_overview')
+    income_statement = _Statement('get_income_statement')
+    balance_sheet = _Statement('get_balance_sheet')
+    cash_flow_statement = _Statement('get_cash_flow_statement')
+
     def __init__(self, symbol: str,  api_key: Optional[str] = None):
         self.symbol = symbol.upper()
         self.api_key = api_key
@@ -73,11 +215,40 @@ class Stock:
     #     gics = industries.GICS(sector, industry, subindustry)
     #     return gics
 
+    @classmethod
+    def _statement(cls, name: str) -> _Statement:
+        if name not in cls.STATEMENTS:
+            raise ValueError(f"'{name}' is not one of {cls.STATEMENTS}.")
+        return getattr(cls, name)
+
+    def is_loaded(self, name: str) -> bool:
+        return self._statement(name).is_loaded(self)
+
+    def invalidate(self, *names: str) -> None:
+        """Drop cached statements (all of them if no names are given)
+        so they are loaded again on next access.
+
+        """
+        for name in names or self.STATEMENTS:
+            delattr(self, self._statement(name).name)
+
+    def prefetch(self, names: Sequence[str] = STATEMENTS) -> 'Stock':
+        """Load the named statements not yet loaded, concurrently."""
+        missing = [self._statement(name) for name in names
+                   if not self.is_loaded(name)]
+        if missing:
+            with ThreadPoolExecutor(max_workers=len(missing)) as pool:
+                loaded = pool.map(lambda s: s.load(self), missing)
+                for statement, value in zip(missing, loaded):
+                    setattr(self, statement.name, value)
+        return self
+
+    def _request(self, fn: str) -> AVRequest:
+        return AVRequest(fn=fn, symbol=self.symbol, api_key=self.api_key)
+
+    @metrics.timed('stock_get_seconds', statement='overview')
     def get_overview(self) -> pl.DataFrame:
-        # Make Series with all (raw) output from alpha_vantage json.
-        ov = FundamentalData(
-            key=self.api_key, output_format='json'
-        ).get_company_overview(self.symbol)[0].iloc[0]
+        # Single row with all output from alpha_vantage json, normalized.
 
         # Trim raw into only rows wanted as metadata.
         # trimmed = ov[[
@@ -92,184 +263,111 @@ class Stock:
         # ]
         # trimmed.name = f'{self.symbol} Metadata'
 
-        return pl.DataFrame(ov)
+        return normalized_frame('OVERVIEW', self.symbol,
+                                api_key=self.api_key)
 
-    def get_income_statement(self):
-        inc_stmt = (
-            FundamentalData(key=self.api_key, output_format='json')
-            .get_income_statement_annual(self.symbol)[0]
-        )
+    @metrics.timed('stock_get_seconds', statement='income_statement')
+    def get_income_statement(self, frequency: str = 'annual'):
+        return normalized_frame('INCOME_STATEMENT', self.symbol, frequency,
+                                self.api_key)
 
-        return pl.from_pandas(inc_stmt)
+    @metrics.timed('stock_get_seconds', statement='balance_sheet')
+    def get_balance_sheet(self, frequency: str = 'annual'):
+        return normalized_frame('BALANCE_SHEET', self.symbol, frequency,
+                                self.api_key)
 
-    def get_balance_sheet(self):
-        bs = (
-            FundamentalData(key=self.api_key, output_format='json')
-            .get_balance_sheet_annual(self.symbol)[0]
-        )
-
-        return pl.from_pandas(bs)
-
-    def get_cash_flow_statement(self):
-        scf = (
-            FundamentalData(key=self.api_key, output_format='json')
-            .get_cash_flow_annual(self.symbol)
-        )
-
-        return scf
+    @metrics.timed('stock_get_seconds', statement='cash_flow_statement')
+    def get_cash_flow_statement(self, frequency: str = 'annual'):
+        return normalized_frame('CASH_FLOW', self.symbol, frequency,
+                                self.api_key)
 
 
 class DemoStock(Stock):
-    def __init__(self):
-        self._json_folder_path = Path.cwd() / 'request_db'
-        super().__init__(symbol='ISRG',  # IBM used for online API
+    """Stock read from saved dumps rather than AV.
+
+    Each statement is read from the latest `SYMBOL_kind_DATE` file in
+    folder (default cwd/request_db), kind being ov, is, bs or scf, in
+    any format storage.py reads: a raw AV response or report records
+    as .json, or a frame of raw or normalized reports as Parquet, Arrow
+    IPC or NDJSON.
+    """
+
+    def __init__(self, folder: Optional[Path] = None, symbol: str = 'ISRG'):
+        self.folder = Path.cwd() / 'request_db' if folder is None \
+            else Path(folder)
+        super().__init__(symbol=symbol,  # IBM used for online API
                          api_key='Demo')
-        self.overview = None
-        self.income_statement = None
-        self.balance_sheet = None
-        self.cash_flow_statement = None
-
-    @property
-    def overview(self):
-        return self._overview
 
-    @overview.setter
-    def overview(self, value):
-        if value is None:
-            self._overview = self.get_overview()
+    def _load(self, fn: str, frequency: str = 'annual') -> pl.DataFrame:
+        kind = next(k for k, kind_fn in KINDS.items() if kind_fn == fn)
+        path = storage.latest(self.folder, f'{self.symbol}_{kind}_*')
+        if path is None:
+            raise FileNotFoundError(
+                f'No {self.symbol} {fn} dump in {self.folder}.'
+            )
+        if fn not in STATEMENT_FUNCTIONS:
+            frequency = SNAPSHOT
+
+        # Served from the frame cache until a newer dump is written.
+        version = (str(path), path.stat().st_mtime_ns)
+        frame = frame_cache().get(self.symbol, fn, frequency, version,
+                                  source='dump')
+        _count_lookup(fn, 'memory', frame is not None)
+        if frame is not None:
+            return frame
+
+        if storage.format_of(path) == 'json':
+            frames = response_frames(fn, load_dump(path, fn, self.symbol))
+            if frequency not in frames:
+                raise AVResponseError(f'No {frequency} reports in {path}.')
+            frame = frames[frequency]
         else:
-            self._overview = value
-
+            frame = storage.read(path)
+            if 'frequency' in frame.columns:
+                frame = frame.filter(pl.col('frequency') == frequency)
+        frame = normalize(frame, fn)
+        frame_cache().put(self.symbol, fn, frame, frequency, version,
+                          source='dump')
+        return frame
+
+    @metrics.timed('stock_get_seconds', statement='overview')
     def get_overview(self):
-        # Use AV's demo result
-        # ov = AVRequest(fn='OVERVIEW', symbol='IBM', api_key='Demo').output()
-
-        # Load from saved json
-        ov = pl.read_json(self._json_folder_path / 'ISRG_ov_2025-03-22.json')
-        return pl.DataFrame(ov)
-
-    @property
-    def income_statement(self):
-        return self._income_statement
-
-    @income_statement.setter
-    def income_statement(self, value):
-        if value is None:
-            self._income_statement = self.get_income_statement()
-        else:
-            self._income_statement = value
-
-    def get_income_statement(self):
-        # inc = (
-        #     AVRequest(fn='INCOME_STATEMENT', symbol='IBM', api_key='Demo')
-        #     .output()
-        # )
-        inc = pl.read_json(self._json_folder_path / 'ISRG_is_2025-04-11.json')
-
-        non_int_cols = ['fiscalDateEnding', 'reportedCurrency']
-
-        inc = (
-            inc
-            .with_columns([
-                pl.col(col).replace("None", None)
-                for col in inc.columns
-            ])
-            .with_columns([
-                pl.col('fiscalDateEnding')
-                .str.strptime(pl.Date, '%Y-%m-%d')
-            ])
-            .with_columns([
-                pl.col(col).cast(pl.Int64).fill_null(0) for col in inc.columns
-                if col not in non_int_cols
-            ])
+        return self._load('OVERVIEW')
 
-        )
+    @metrics.timed('stock_get_seconds', statement='income_statement')
+    def get_income_statement(self, frequency: str = 'annual'):
+        return self._load('INCOME_STATEMENT', frequency)
 
-        return inc
+    @metrics.timed('stock_get_seconds', statement='balance_sheet')
+    def get_balance_sheet(self, frequency: str = 'annual'):
+        return self._load('BALANCE_SHEET', frequency)
 
-    @property
-    def balance_sheet(self):
-        return self._balance_sheet
-
-    @balance_sheet.setter
-    def balance_sheet(self, value):
-        if value is None:
-            self._balance_sheet = self.get_balance_sheet()
-        else:
-            self._balance_sheet = value
-
-    def get_balance_sheet(self):
-        non_int_cols = ['fiscalDateEnding', 'reportedCurrency']
-
-        bs = pl.read_json(self._json_folder_path / 'ISRG_bs_2025-04-14.json')
-
-        bs = (
-            bs
-            .with_columns([
-                pl.col(col).replace("None", None)
-                for col in bs.columns
-            ])
-            .with_columns([
-                pl.col('fiscalDateEnding')
-                .str.strptime(pl.Date, '%Y-%m-%d')
-            ])
-            .with_columns([
-                pl.col(col).cast(pl.Int64).fill_null(0) for col in bs.columns
-                if col not in non_int_cols
-            ])
-
-        )
-
-        return bs
-
-    @property
-    def cash_flow_statement(self):
-        return self._cash_flow_statement
-
-    @cash_flow_statement.setter
-    def cash_flow_statement(self, value):
-        if value is None:
-            self._cash_flow_statement = self.get_cash_flow_statement()
-        else:
-            self._cash_flow_statement = value
-
-    def get_cash_flow_statement(self):
-        scf = pl.read_json(self._json_folder_path / 'ISRG_scf_2025-05-18.json')
-
-        non_int_cols = ['fiscalDateEnding', 'reportedCurrency']
-
-        scf = (
-            scf
-            .with_columns([
-                pl.col(col).replace("None", None)
-                for col in scf.columns
-            ])
-            .with_columns([
-                pl.col('fiscalDateEnding')
-                .str.strptime(pl.Date, '%Y-%m-%d')
-            ])
-            .with_columns([
-                pl.col(col).cast(pl.Int64).fill_null(0) for col in scf.columns
-                if col not in non_int_cols
-            ])
-
-        )
-
-        return scf
+    @metrics.timed('stock_get_seconds', statement='cash_flow_statement')
+    def get_cash_flow_statement(self, frequency: str = 'annual'):
+        return self._load('CASH_FLOW', frequency)
 
 
 def dump_to_json(df: pl.DataFrame, path: Path, indent: int = 2) -> None:
-    with open(path, 'w') as f:
-        json.dump(json.loads(df.write_json()), f, indent=indent)
-    print(f'File written to: {path.parent}')
+    """Deprecated: use storage.write(), which also writes Parquet,
+    Arrow IPC & NDJSON. indent is ignored.
+
+    """
+    warnings.warn('dump_to_json() is deprecated; use storage.write().',
+                  DeprecationWarning, stacklevel=2)
+    storage.write(df, path, 'json')
+    print(f'File written to: {Path(path).parent}')
 
 
 def main():
     global isrg_demo, is_xpose, bs_xpose, cfs_xpose
+    from panel import Panel
+
     isrg_demo = DemoStock()
-    is_xpose = isrg_demo.income_statement.transpose(include_header=True)
-    bs_xpose = isrg_demo.balance_sheet.transpose(include_header=True)
-    cfs_xpose = isrg_demo.cash_flow_statement.transpose(include_header=True)
+    # Line items x periods, typed, rather than transposed statements.
+    panel = Panel.from_stock(isrg_demo)
+    is_xpose = panel.items_by_period(isrg_demo.symbol, 'INCOME_STATEMENT')
+    bs_xpose = panel.items_by_period(isrg_demo.symbol, 'BALANCE_SHEET')
+    cfs_xpose = panel.items_by_period(isrg_demo.symbol, 'CASH_FLOW')
     # global ibm
     # ibm = DemoStock()
 
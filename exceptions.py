@@ -2,6 +2,9 @@
 
 Classes:
 EquityTypeMismatchError -- equity_type does not match Equity subclass.
+AVResponseError -- AV returned an error instead of data.
+ThrottleError -- AV kept throttling requests after all retries.
+QuotaExceededError -- daily AV request quota is used up.
 
 """
 
@@ -33,3 +36,24 @@ class EquityTypeMismatchError(ValueError):
 
 class SectorError(ValueError):
     pass
+
+
+class AVResponseError(ValueError):
+    """Exception raised when an Alpha Vantage response holds an error
+    message (e.g. an unknown symbol) instead of data.
+
+    """
+
+
+class ThrottleError(RuntimeError):
+    """Exception raised when Alpha Vantage still reports throttling
+    after all retries.
+
+    """
+
+
+class QuotaExceededError(RuntimeError):
+    """Exception raised when a request would exceed the daily Alpha
+    Vantage quota.
+
+    """
@@ -1,10 +1,16 @@
-import numpy as np
+import functools
+import warnings
+
 import pandas as pd
-import matplotlib.pyplot as plt
-from alpha_vantage.timeseries import TimeSeries
-from alpha_vantage.fundamentaldata import FundamentalData
+import polars as pl
 
 import industries
+import metrics
+import statements
+from batch import fetch_many
+from cache import frame_cache
+from equity import AVRequest
+from equity import normalized_frame
 from industries import PeerComparison
 
 
@@ -19,56 +25,57 @@ def read_api_keys(file):
         print(f'File "{file}" was not found')
 
 
+@functools.lru_cache(maxsize=None)
+def _read_api_key(file, api):
+    api_keys = read_api_keys(file)
+    return None if api_keys is None else api_keys.get(api)
+
+
+class _ApiKey:
+    """Class attribute whose key is read from file on first access &
+    cached, so importing this module never touches the key file.
+
+    """
+
+    def __init__(self, api, file='apikeys.txt'):
+        self.api = api
+        self.file = file
+
+    def __get__(self, obj, owner=None):
+        return _read_api_key(self.file, self.api)
+
+
 class Overview:
-    AV_API_KEY = read_api_keys('apikeys.txt')['alpha_vantage']
+    AV_API_KEY = _ApiKey('alpha_vantage')
+
+    # OVERVIEW metric fields & their display labels.
+    LABELS = {
+        field.source: field.name for field in statements.OVERVIEW_METRICS
+    }
+    # Source fields of the numeric metrics; see overviews.OverviewMatrix
+    # for all symbols' metrics at once.
+    NUMERIC = tuple(
+        field.source for field in statements.OVERVIEW_METRICS
+        if field.dtype in (pl.Int64, pl.Float64)
+    )
 
     def __init__(self, symbol):
         self.symbol = symbol
 
-    @property
+    @functools.cached_property
     def overview(self):
-        ov_data_series = pd.Series(
-            FundamentalData(
-                key=Overview.AV_API_KEY, output_format='json'
-            ).get_company_overview(self.symbol)[0]
-        )
+        """Numeric overview metrics as a float64 Series named by the
+        symbol, loaded on first access from the process's frame cache
+        or AV.
 
-        ov_data_series = ov_data_series.drop(labels=[
-            'Symbol',
-            'Name',
-            'Description',
-            'Address',
-            'AssetType',
-            'Currency',
-            'Country',
-            'Exchange',
-            'Sector',
-            'Industry',
-            'FullTimeEmployees',
-            'FiscalYearEnd',
-            'LatestQuarter'
-        ])
-        ov_data_series.index = [
-            'Market Cap', 'EBITDA', 'P/E', 'PEG', 'BV', 'DPS',
-            'Div Yield', 'EPS', 'TTM RPS', 'Net Prof Margin',
-            'TTM Op Margin', 'TTM ROA', 'TTM ROE', 'TTM Rev',
-            'TTM Gross Prof', 'TTM Diluted EPS',
-            'YOY Q Earnings Growth', 'YOY Q Rev Growth',
-            'Analyst Target Price', 'Trailing P/E', 'Forward P/E',
-            'TTM P/S', 'P/B', 'EV/Rev', 'EV/EBITDA', 'Beta',
-            '52 Wk High', '52 Wk Low', 'SMA50', 'SMA200',
-            'Shares Outstanding', 'Shares Float', 'Shares Short',
-            'Shares Short Prior Month', 'Short Ratio',
-            'Short % Outstanding', 'Short % Float', '% Insiders',
-            '% Institutions', 'Fwd Ann Div Rate',
-            'Fwd Annual Div Yield', 'Payout Ratio', 'Div Date',
-            'Ex-Div Date', 'Last Split Factor', 'Last Split Date'
-        ]
-        ov_data_series.name = self.symbol
-        ov_data_series[ov_data_series == 'None'] = np.nan
-        ov_data_series.astype('float64')
-
-        return ov_data_series
+        """
+        ov = normalized_frame('OVERVIEW', self.symbol,
+                              api_key=Overview.AV_API_KEY)
+        labels = [Overview.LABELS[f] for f in Overview.NUMERIC]
+        return pd.Series(
+            ov.select(pl.col(labels).cast(pl.Float64)).row(0),
+            index=labels, name=self.symbol, dtype='float64'
+        )
 
 
 class IncomeStatement:
@@ -77,7 +84,7 @@ class IncomeStatement:
 
 
 class BalanceSheet:
-    AV_API_KEY = read_api_keys('apikeys.txt')['alpha_vantage']
+    AV_API_KEY = _ApiKey('alpha_vantage')
 
     def __init__(self,
                  symbol: str,
@@ -89,84 +96,24 @@ class BalanceSheet:
 
     def balance_sheet(self):
         if self.freq == 'quarterly':
-            b_sheet = pd.DataFrame(
-                FundamentalData(
-                    key=BalanceSheet.AV_API_KEY, output_format='json'
-                ).get_balance_sheet_quarterly(self.symbol)[0]
-            )
-        elif self.freq == ('annual' or 'yearly'):
-            b_sheet = pd.DataFrame(
-                FundamentalData(
-                    key=BalanceSheet.AV_API_KEY, output_format='json'
-                ).get_balance_sheet_annual(self.symbol)[0]
-            )
+            freq = 'quarterly'
+        elif self.freq in ('annual', 'yearly'):
+            freq = 'annual'
         else:
             raise ValueError("'freq' attribute must be 'quarterly' "
                              "or 'annual'")
 
-        b_sheet = b_sheet.iloc[:self.periods]
-        b_sheet = b_sheet.rename(
-            columns={
-                'fiscalDateEnding': 'fy_end',
-                'reportedCurrency': 'report_currency',
-                # ST Assets:
-                'shortTermInvestments': 'st_invest',
-                'cashAndShortTermInvestments': 'cash_st_invest',
-                'netReceivables': 'ar_net',
-                'otherCurrentAssets': 'oth_curr_asset',
-                'totalCurrentAssets': 'tot_curr_asset',
-                # LT Assets:
-                'accumulatedDepreciation': 'accum_deprec',
-                'propertyPlantEquipment': 'ppe',
-                'goodwill': 'gw',
-                'accumulatedAmortization': 'accum_amort',
-                'intangibleAssets': 'intang_asset',
-                'longTermInvestments': 'lt_invest',
-                'otherNonCurrrentAssets': 'oth_noncurr_asset',
-                'totalNonCurrentAssets': 'oth_noncurr_asset',
-                'totalAssets': 'tot_asset',
-                # ST Lblts:
-                'accountsPayable': 'ap',
-                'shortTermDebt': 'st_debt',
-                'currentLongTermDebt': 'curr_lt_debt',
-                'otherCurrentLiabilities': 'oth_curr_lblt',
-                'totalCurrentLiabilities': 'tot_curr_lblt',
-                # LT Lblts
-                'longTermDebt': 'lt_debt',
-                'totalLongTermDebt': 'tot_lt_debt',
-                'deferredLongTermLiabilities': 'def_lt_lblt',
-                'otherNonCurrentLiabilities': 'oth_noncurr_lblt',
-                'totalNonCurrentLiabilities': 'tot_noncurr_lblt',
-                'otherLiabilities': 'oth_blt',
-                'totalLiabilities': 'tot_lblt',
-                # SH Equity:
-                'commonStock': 'comm_stock',
-                'additionalPaidInCapital': 'apic',
-                'commonStockTotalEquity': 'comm_stock_tot_eq',
-                'retainedEarnings': 'ret_earn',
-                'treasuryStock': 'treasury_stock',
-                'otherShareholderEquity': 'oth_SH_eq',
-                'totalShareholderEquity': 'tot_SH_eq',
-                'liabilitiesAndShareholderEquity': 'lblt_SH_eq',
-                'commonStockSharesOutstanding': 'comm_shares_out',
-                # Not yet organized:
-                'earningAssets': 'earning_asset',
-                'otherAssets': 'oth_asset',
-                'netTangibleAssets': 'net_tang_asset',
-                'totalPermanentEquity': 'tot_perm_eq',
-                'preferredStockTotalEquity': 'pref_stock_tot_eq',
-                'retainedEarningsTotalEquity': 'ret_earn_tot_eq',
-                'deferredLongTermAssetCharges': 'def_LT_asset_charge',
-                'capitalLeaseObligations': 'cap_lease_obligation',
-                'negativeGoodwill': 'neg_gw',
-                'preferredStockRedeemable': 'pref_stock_redeemable',
-                'capitalSurplus': 'cap_surplus',
-            }
+        b_sheet = statements.normalize(
+            AVRequest(
+                'BALANCE_SHEET', self.symbol, api_key=BalanceSheet.AV_API_KEY
+            ).output('polars', freq),
+            'BALANCE_SHEET'
         )
-        b_sheet = b_sheet.set_index('Fisc Period End',
-                          drop=True,
-                          append=False)
-        b_sheet = b_sheet.drop(columns=['Reported Currency'])
+
+        b_sheet = b_sheet.head(self.periods).drop('report_currency')
+        b_sheet = b_sheet.to_pandas().set_index('fy_end',
+                                                drop=True,
+                                                append=False)
 
         return b_sheet
 
@@ -176,37 +123,147 @@ class Ratios(PeerComparison):
     def __init__(self, symbol, sector, industry=None, subindustry=None):
         super().__init__(symbol, sector, industry, subindustry)
 
-    def vs_peers(self, peer_level, *ratios):
-        if peer_level == 'Sector':
-            peer_list = self.sector_peers
-        elif peer_level == 'Industry':
-            peer_list = self.industry_peers
-        elif peer_level == 'Sub-Industry':
-            peer_list = self.subindustry_peers
+    def vs_peers(self, peer_level, *ratios, concurrency=8, indicators=None):
+        """Return a Symbol x ratio table for every peer at peer_level.
 
-        peer_df = pd.DataFrame(
-            columns=ratios
-        )
+        ratios are Overview labels, e.g. 'P/E'. Peers whose overview
+        could not be fetched are left out. With indicators (an
+        indicators.Indicators), indicators.LABELS may be given too &
+        come from local prices: 'SMA50', 'SMA200' & the 52-week range
+        stand in for the overview's, while 'Beta 1Y' & 'Volatility 1Y'
+        are price-only (the overview's 'Beta' is still fetched).
+        Overviews are only fetched for the other ratios.
+        """
+        with metrics.registry.timer('vs_peers_seconds',
+                                    peer_level=peer_level):
+            if indicators is None:
+                return self._vs_peers(peer_level, ratios, concurrency)
+            from indicators import LABELS
+            local = [ratio for ratio in ratios if ratio in LABELS]
+            remote = [ratio for ratio in ratios if ratio not in LABELS]
+            prices = indicators.table(self.peers(peer_level), local)
+            if not remote:
+                return prices
+            return self._vs_peers(peer_level, remote, concurrency).join(
+                prices, on='Symbol', how='left'
+            ).select('Symbol', *ratios)
 
+    def _vs_peers(self, peer_level, ratios, concurrency):
+        peer_list = list(self.peers(peer_level))
+        frames = {}
         for peer in peer_list:
-            ov = Overview(peer).overview
-            ratio_dict = {}
+            ov = frame_cache().get(peer, 'OVERVIEW')
+            metrics.registry.inc(
+                'cache_hits_total' if ov is not None
+                else 'cache_misses_total', fn='OVERVIEW', layer='memory'
+            )
+            if ov is not None:
+                frames[peer] = ov.with_columns(Symbol=pl.lit(peer))
+        missing = [peer for peer in peer_list if peer not in frames]
 
-            for ratio in ratios:
-                ratio_dict[ratio] = ov[ratio]
+        # Fetch the other peers' overviews concurrently; the shared
+        # client keeps the batch within the AV rate limit.
+        raw_overviews = fetch_many(
+            'OVERVIEW', missing, concurrency=concurrency,
+            output_format='polars', api_key=Overview.AV_API_KEY,
+            return_exceptions=True
+        ) if missing else {}
+
+        raw = []
+        for peer in missing:
+            raw_ov = raw_overviews[peer]
+            if isinstance(raw_ov, Exception):
+                warnings.warn(f'No overview for {peer}: {raw_ov}')
+                continue
+            raw.append(raw_ov.with_columns(Symbol=pl.lit(peer)))
+
+        if raw:
+            # Stack the fetched peers once & parse them in a single
+            # columnar pass, then cache each peer's overview.
+            fetched = statements.normalize(
+                pl.concat(raw, how='diagonal_relaxed'), 'OVERVIEW'
+            )
+            for (peer,), ov in fetched.partition_by(
+                    'Symbol', as_dict=True).items():
+                frame_cache().put(peer, 'OVERVIEW', ov)
+                frames[peer] = ov
+
+        if not frames:
+            return pl.DataFrame(
+                schema={'Symbol': pl.String,
+                        **{ratio: pl.Float64 for ratio in ratios}}
+            )
+
+        return pl.concat(
+            [frames[peer] for peer in peer_list if peer in frames]
+        ).select(
+            pl.col('Symbol'),
+            *[pl.col(ratio).cast(pl.Float64) for ratio in ratios]
+        )
+
+    def peer_ranks(self, peer_df):
+        """Return percentile rank & z-score of every peer for each ratio
+        in a vs_peers() table.
+
+        Percentile ranks are in (0, 1]; peers missing a ratio get null.
+        """
+        ratios = [col for col in peer_df.columns if col != 'Symbol']
+        return peer_df.select(
+            pl.col('Symbol'),
+            *[
+                (pl.col(ratio).rank('average') / pl.col(ratio).count())
+                .alias(f'{ratio} pctl')
+                for ratio in ratios
+            ],
+            *[
+                ((pl.col(ratio) - pl.col(ratio).mean())
+                 / pl.col(ratio).std())
+                .alias(f'{ratio} z')
+                for ratio in ratios
+            ]
+        )
+
+    def peer_summary(self, peer_df):
+        """Return peer statistics & self.symbol's standing for each
+        ratio in a vs_peers() table, one row per ratio.
+
+        """
+        value = pl.col('Value')
+        is_self = pl.col('Symbol') == self.symbol
+        return (
+            peer_df.lazy()
+            .unpivot(index='Symbol', variable_name='Ratio',
+                     value_name='Value')
+            .group_by('Ratio', maintain_order=True)
+            .agg(
+                value.count().alias('Peers'),
+                value.median().alias('Median'),
+                value.mean().alias('Mean'),
+                value.std().alias('Std'),
+                value.filter(is_self).first().alias(self.symbol),
+                (value.rank('average') / value.count())
+                .filter(is_self).first().alias('Pctl'),
+                ((value - value.mean()) / value.std())
+                .filter(is_self).first().alias('Z'),
+            )
+            .collect()
+        )
+
+    def rank_vs_peers(self, peer_level, *ratios, concurrency=8,
+                      indicators=None):
+        """Fetch peers & return peer_summary() for ratios in one call."""
+        return self.peer_summary(
+            self.vs_peers(peer_level, *ratios, concurrency=concurrency,
+                          indicators=indicators)
+        )
 
-            peer_series = pd.Series(ratio_dict, name=peer)
-            peer_df = peer_df.append(peer_series)
-            print(peer_series)
 
-        # print(peer_df)
-        # ratio_series = pd.Series(
-        #     [peer_df[ratio].mean() for ratio in ratios],
-        #     name=f"{self.symbol} Peers"
-        # )
-        return peer_df
+def main():
+    global xom_ratios, op
+    xom_ratios = Ratios('XOM', 'Energy', 'Oil, Gas & Consumable Fuels',
+                        'Integrated Oil & Gas')
+    op = xom_ratios.vs_peers('Sub-Industry', 'P/E', 'P/B', 'TTM ROE')
 
 
-xom_ratios = Ratios('XOM', 'Energy', 'Oil, Gas & Consumable Fuels',
-                    'Integrated Oil & Gas')
-op = xom_ratios.vs_peers('Sub-Industry', 'P/E', 'P/B', 'TTM ROE')
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""Bulk import of archived AV response dumps into the store.
+
+Archived responses are dumps (see dumps.py) named
+`SYMBOL_kind_DATE.json` (e.g. ISRG_is_2025-04-11.json, kind being ov,
+is, bs or scf), anywhere under a folder. import_dumps() finds them all,
+parses & normalizes them in parallel across a process pool, keeps the
+latest snapshot of each report & merges the result into a
+FundamentalsStore:
+
+    import_dumps('archive/request_db')
+
+or from the shell:
+
+    python importer.py archive/request_db --workers 8
+
+Functions:
+discover -- every dump file under a folder.
+latest_reports -- keep each report's latest snapshot.
+import_dumps -- parse dumps in parallel & merge them into the store.
+
+"""
+import argparse
+import collections
+import datetime as dt
+import multiprocessing
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import polars as pl
+
+from cache import STATEMENT_FUNCTIONS
+from cache import response_frames
+from dumps import FILENAME
+from dumps import KINDS
+from dumps import load_dump
+from statements import normalize
+from store import FundamentalsStore
+
+DUMP_SCHEMA = {
+    'path': pl.String,
+    'fn': pl.String,
+    'symbol': pl.String,
+    'snapshot': pl.Date,
+}
+
+# Keys AV uses for errors & notices instead of data.
+_ERROR_KEYS = ('Error Message', 'Note', 'Information')
+
+
+def discover(root: Path) -> pl.DataFrame:
+    """Return a frame of every dump under root: path, fn (AV
+    function), symbol & snapshot (the date in the file name), oldest
+    snapshot first.
+
+    """
+    rows = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            match = FILENAME.match(name)
+            if match:
+                rows.append((
+                    os.path.join(dirpath, name),
+                    KINDS[match['kind']],
+                    match['symbol'].upper(),
+                    dt.date.fromisoformat(match['date']),
+                ))
+    return pl.DataFrame(rows, schema=DUMP_SCHEMA, orient='row').sort(
+        'snapshot', 'path'
+    )
+
+
+def _dump_frame(path: str, fn: str, symbol: str,
+                snapshot: dt.date) -> pl.DataFrame:
+    # One dump's raw reports, tagged with symbol, snapshot & frequency.
+    response = load_dump(Path(path), fn, symbol)
+    if not isinstance(response, dict) or not response:
+        raise ValueError('not an AV response')
+    for key in _ERROR_KEYS:
+        if key in response:
+            raise ValueError(response[key])
+
+    frames = [
+        frame.with_columns(symbol=pl.lit(symbol),
+                           snapshot=pl.lit(snapshot),
+                           frequency=pl.lit(frequency))
+        for frequency, frame in response_frames(fn, response).items()
+    ]
+    if not frames:
+        raise ValueError('no reports')
+    return pl.concat(frames)
+
+
+def _parse_chunk(dumps: list) -> tuple:
+    # Worker: parse a chunk of (path, fn, symbol, snapshot) rows &
+    # normalize each function's reports in one pass, which costs far
+    # less than one pass per file. Returns ({fn: frame},
+    # [(path, error)]) so one bad file doesn't stop the import.
+    raw = collections.defaultdict(list)
+    errors = []
+    for path, fn, symbol, snapshot in dumps:
+        try:
+            raw[fn].append(_dump_frame(path, fn, symbol, snapshot))
+        except (OSError, ValueError, KeyError, TypeError, IndexError,
+                pl.exceptions.PolarsError) as e:
+            errors.append((path, f'{type(e).__name__}: {e}'))
+
+    frames = {}
+    for fn, parts in raw.items():
+        keep = ('symbol', 'snapshot')
+        if fn in STATEMENT_FUNCTIONS:
+            keep += ('frequency',)
+        frames[fn] = normalize(pl.concat(parts), fn, keep=keep)
+    return frames, errors
+
+
+def latest_reports(frame: pl.DataFrame, fn: str) -> pl.DataFrame:
+    """Keep the latest snapshot of each report, (symbol, frequency,
+    fy_end) for statements & symbol for overviews.
+
+    The snapshot column is kept, so the store replaces its reports
+    only with newer ones.
+    """
+    key = ['symbol', 'frequency', 'fy_end'] \
+        if fn in STATEMENT_FUNCTIONS else ['symbol']
+    return (
+        frame.sort('snapshot', maintain_order=True)
+        .unique(key, keep='last', maintain_order=True)
+    )
+
+
+def import_dumps(root: Path,
+                 store: Optional[FundamentalsStore] = None,
+                 workers: Optional[int] = None,
+                 chunk_size: int = 64,
+                 sectors: Optional[dict] = None) -> dict:
+    """Import every dump under root into store & return a summary.
+
+    Files are parsed in chunks of chunk_size across `workers`
+    processes (default: one per core). Reports are deduplicated by
+    (symbol, statement, frequency, fiscal date ending), the latest
+    snapshot winning, then merged with FundamentalsStore.ingest(),
+    which is passed sectors & workers & replaces stored reports of an
+    older snapshot, so a later import of newer dumps wins too. Files
+    that fail to parse are skipped with a warning & listed in the
+    summary.
+    """
+    store = FundamentalsStore() if store is None else store
+    start = time.perf_counter()
+    dumps = discover(root)
+    rows = dumps.rows()
+    chunks = [rows[i:i + chunk_size]
+              for i in range(0, len(rows), chunk_size)]
+
+    parts = collections.defaultdict(list)
+    failed = []
+    if chunks:
+        # Spawned, not forked: a forked child of a process whose
+        # polars thread pool is running can deadlock.
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            for frames, errors in pool.map(_parse_chunk, chunks):
+                for fn, frame in frames.items():
+                    parts[fn].append(frame)
+                failed.extend(errors)
+    for path, error in failed:
+        warnings.warn(f'Could not import {path}: {error}')
+
+    frames = {
+        fn: latest_reports(pl.concat(chunk, how='diagonal_relaxed'), fn)
+        for fn, chunk in parts.items()
+    }
+    rows_added = store.ingest(frames, sectors, workers) if frames else 0
+    return {
+        'files': dumps.height,
+        'symbols': dumps['symbol'].n_unique(),
+        'reports': {fn: frame.height for fn, frame in frames.items()},
+        'rows_added': rows_added,
+        'failed': [path for path, _ in failed],
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('root', type=Path, help='folder of dumps')
+    parser.add_argument('--store', type=Path, default=None,
+                        help='store root (default ./fundamentals_db)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-size', type=int, default=64)
+    args = parser.parse_args()
+
+    summary = import_dumps(args.root, FundamentalsStore(args.store),
+                           args.workers, args.chunk_size)
+    print(f'Imported {summary["files"]} files for {summary["symbols"]} '
+          f'symbols in {summary["seconds"]:.1f} s: '
+          f'{summary["rows_added"]} rows added, '
+          f'{len(summary["failed"])} files failed.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,407 @@
+"""Technical indicators over the whole price matrix.
+
+Indicators are computed from a prices.PriceStore for every symbol at
+once, never one overview call per ticker. Those the overview also
+has, with the same definition, take its label, so tables line up with
+fundamentals.Ratios peer tables; the others have labels of their own:
+
+    SMA50, SMA200 -- mean close of the last 50 & 200 bars.
+    52 Wk High, 52 Wk Low -- highest high & lowest low of the last
+        WEEK52 bars.
+    Volatility 1Y -- annualized standard deviation of the last WEEK52
+        daily log returns.
+    Beta 1Y -- of the last WEEK52 daily log returns against the
+        benchmark's; not the overview's Beta, which AV takes over a
+        longer span of monthly returns.
+
+An indicator is NaN until a symbol has a full window of bars.
+
+history() returns an indicator's whole dates x symbols history, with
+window sums taken as differences of cumulative sums & window extremes
+over strided window views. Indicators keeps only the latest values &
+the running window sums behind them, so each new bar updates it in
+O(symbols) rather than recomputing history:
+
+    latest = Indicators.from_prices(prices)
+    prices.update()
+    latest.update(prices)
+    latest.table(['AAPL', 'MSFT'])       # Symbol x indicator
+
+Classes:
+Indicators -- latest indicators of every symbol, updated bar by bar.
+
+Functions:
+log_returns -- daily log returns of a dates x symbols close array.
+rolling_mean -- window means via cumulative sums.
+rolling_max -- window maxima via strided views.
+rolling_min -- window minima via strided views.
+rolling_std -- window standard deviations via cumulative sums.
+rolling_beta -- window betas against a benchmark via cumulative sums.
+history -- an indicator's dates x symbols history.
+
+"""
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+import polars as pl
+
+from prices import PriceStore
+
+# Bars in 52 weeks.
+WEEK52 = 252
+SMA_WINDOWS = {'SMA50': 50, 'SMA200': 200}
+LABELS = (*SMA_WINDOWS, '52 Wk High', '52 Wk Low', 'Volatility 1Y',
+          'Beta 1Y')
+BENCHMARK = 'SPY'
+
+
+def _window_sums(x: np.ndarray, window: int) -> tuple:
+    # Sums & counts of the finite values in each trailing window, by
+    # row; rows before the first full window are 0.
+    finite = np.isfinite(x)
+    sums = np.zeros((len(x) + 1, *x.shape[1:]))
+    np.cumsum(np.where(finite, x, 0.0), axis=0, out=sums[1:])
+    counts = np.zeros((len(x) + 1, *x.shape[1:]), dtype=np.int64)
+    np.cumsum(finite, axis=0, out=counts[1:])
+    window_sums = np.zeros(x.shape)
+    window_counts = np.zeros(x.shape, dtype=np.int64)
+    window_sums[window - 1:] = sums[window:] - sums[:-window]
+    window_counts[window - 1:] = counts[window:] - counts[:-window]
+    return window_sums, window_counts
+
+
+def log_returns(close: np.ndarray) -> np.ndarray:
+    """Return daily log returns, row 0 & rows after a missing close
+    NaN.
+
+    """
+    returns = np.full(close.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[1:] = np.log(close[1:] / close[:-1])
+    return returns
+
+
+def rolling_mean(x: np.ndarray, window: int) -> np.ndarray:
+    """Return trailing window means by row; NaN unless the window is
+    all finite.
+
+    """
+    sums, counts = _window_sums(x, window)
+    return np.where(counts == window, sums / window, np.nan)
+
+
+def _rolling_extreme(x: np.ndarray, window: int, fn, fill: float
+                     ) -> np.ndarray:
+    out = np.full(x.shape, np.nan)
+    if len(x) < window:
+        return out
+    # (rows - window + 1) x symbols x window view; no copy.
+    windows = np.lib.stride_tricks.sliding_window_view(
+        np.where(np.isfinite(x), x, fill), window, axis=0
+    )
+    _, counts = _window_sums(x, window)
+    extreme = fn(windows, axis=-1)
+    out[window - 1:] = np.where(counts[window - 1:] == window, extreme,
+                                np.nan)
+    return out
+
+
+def rolling_max(x: np.ndarray, window: int) -> np.ndarray:
+    """Return trailing window maxima by row; NaN unless the window is
+    all finite.
+
+    """
+    return _rolling_extreme(x, window, np.max, -np.inf)
+
+
+def rolling_min(x: np.ndarray, window: int) -> np.ndarray:
+    """Return trailing window minima by row; NaN unless the window is
+    all finite.
+
+    """
+    return _rolling_extreme(x, window, np.min, np.inf)
+
+
+def _std(s1, s2, n):
+    # Sample standard deviation from sums of x & x**2 over n values.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(np.maximum(s2 - s1 * s1 / n, 0.0) / (n - 1))
+
+
+def _beta(sx, sy, sxy, syy, n):
+    # Slope of x on y from their sums over n pairs.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (sxy - sx * sy / n) / (syy - sy * sy / n)
+
+
+def rolling_std(x: np.ndarray, window: int) -> np.ndarray:
+    """Return trailing window sample standard deviations by row; NaN
+    unless the window is all finite.
+
+    """
+    s1, n = _window_sums(x, window)
+    s2, _ = _window_sums(x * x, window)
+    return np.where(n == window, _std(s1, s2, n), np.nan)
+
+
+def rolling_beta(x: np.ndarray, benchmark: np.ndarray,
+                 window: int) -> np.ndarray:
+    """Return trailing window betas of each column of x against the
+    benchmark column, by row; NaN unless the window is all finite.
+
+    """
+    y = np.broadcast_to(benchmark.reshape(-1, 1), x.shape)
+    paired = np.isfinite(x) & np.isfinite(y)
+    x, y = np.where(paired, x, np.nan), np.where(paired, y, np.nan)
+    sx, n = _window_sums(x, window)
+    sy, _ = _window_sums(y, window)
+    sxy, _ = _window_sums(x * y, window)
+    syy, _ = _window_sums(y * y, window)
+    return np.where(n == window, _beta(sx, sy, sxy, syy, n), np.nan)
+
+
+def _benchmark_returns(prices: PriceStore, benchmark: str) -> np.ndarray:
+    if benchmark not in prices.symbol_index:
+        raise ValueError(
+            f"Benchmark '{benchmark}' is not in the price store; add it "
+            f"with prices.update(['{benchmark}'])."
+        )
+    return log_returns(prices.array('close')[:, [prices.symbol_index[
+        benchmark]]])[:, 0]
+
+
+def history(prices: PriceStore, label: str,
+            benchmark: str = BENCHMARK) -> np.ndarray:
+    """Return indicator label's dates x symbols history, rows & columns
+    as prices.dates & prices.symbols.
+
+    """
+    if label in SMA_WINDOWS:
+        return rolling_mean(prices.array('close'), SMA_WINDOWS[label])
+    if label == '52 Wk High':
+        return rolling_max(prices.array('high'), WEEK52)
+    if label == '52 Wk Low':
+        return rolling_min(prices.array('low'), WEEK52)
+    returns = log_returns(prices.array('close'))
+    if label == 'Volatility 1Y':
+        return rolling_std(returns, WEEK52) * np.sqrt(WEEK52)
+    if label == 'Beta 1Y':
+        return rolling_beta(returns, _benchmark_returns(prices, benchmark),
+                            WEEK52)
+    raise ValueError(f"Unknown indicator '{label}'; use one of "
+                     f"{', '.join(LABELS)}.")
+
+
+class Indicators:
+    """Latest indicators of every symbol in a PriceStore, with the
+    running window sums behind them.
+
+    from_prices() sums the last window of bars; update() then moves
+    every window forward one bar at a time, adding the new bar &
+    subtracting the one leaving, so each bar costs O(symbols). A 52-week
+    extreme is only recomputed, from its window, for symbols whose
+    extreme left the window.
+
+    symbols -- column order of every state array, as prices.symbols.
+    rows -- bars consumed; the latest values are as of
+        prices.dates[rows - 1].
+    benchmark -- symbol betas are taken against; None skips Beta 1Y.
+    """
+
+    def __init__(self, symbols: Sequence[str], benchmark: Optional[str]):
+        self.symbols = list(symbols)
+        self.symbol_index = {s: j for j, s in enumerate(self.symbols)}
+        self.benchmark = benchmark
+        self.rows = 0
+        self.as_of = None
+        self.state = {}
+
+    def __repr__(self) -> str:
+        return (f'Indicators({len(self.symbols)} symbols as of '
+                f'{self.as_of})')
+
+    @classmethod
+    def from_prices(cls, prices: PriceStore,
+                    benchmark: Optional[str] = BENCHMARK) -> 'Indicators':
+        """Compute the latest indicators from the last window of every
+        symbol's bars.
+
+        """
+        indicators = cls(prices.symbols, benchmark)
+        indicators._start(prices)
+        return indicators
+
+    def _start(self, prices: PriceStore) -> None:
+        rows = prices.rows
+        close, high, low = (prices.array(f) for f in ('close', 'high', 'low'))
+
+        def last(x, window):
+            # Sums & counts of the finite values of x's last window.
+            x = x[-window:]
+            return np.nansum(x, axis=0), np.isfinite(x).sum(axis=0)
+
+        state = {}
+        for label, window in SMA_WINDOWS.items():
+            state[label] = last(close, window)
+        state['52 Wk High'] = self._extreme(high[-WEEK52:], np.max,
+                                            -np.inf)
+        state['52 Wk Low'] = self._extreme(low[-WEEK52:], np.min, np.inf)
+
+        # One bar more than WEEK52 returns need.
+        returns = log_returns(close[max(rows - WEEK52 - 1, 0):])
+        state['Volatility 1Y'] = (*last(returns, WEEK52),
+                                  np.nansum(returns[-WEEK52:] ** 2, axis=0))
+        if self.benchmark is not None:
+            y = _benchmark_returns(prices, self.benchmark)[
+                max(rows - WEEK52 - 1, 0):
+            ]
+            state['Beta 1Y'] = self._beta_sums(returns[-WEEK52:],
+                                               y[-WEEK52:].reshape(-1, 1))
+        self.symbols = list(prices.symbols)
+        self.symbol_index = dict(prices.symbol_index)
+        self.state = state
+        self.rows = rows
+        self.as_of = prices.dates[-1] if rows else None
+
+    @staticmethod
+    def _extreme(window: np.ndarray, fn, fill: float) -> tuple:
+        # Extreme & count of the finite values of a window of rows.
+        finite = np.isfinite(window)
+        values = fn(np.where(finite, window, fill), axis=0,
+                    initial=fill)
+        return values, finite.sum(axis=0)
+
+    @staticmethod
+    def _beta_sums(x: np.ndarray, y: np.ndarray) -> tuple:
+        # Sums of x, y, x*y & y*y over rows where both are finite, &
+        # their count.
+        paired = np.isfinite(x) & np.isfinite(y)
+        x = np.where(paired, x, 0.0)
+        y = np.where(paired, y, 0.0)
+        return (x.sum(axis=0), y.sum(axis=0), (x * y).sum(axis=0),
+                (y * y).sum(axis=0), paired.sum(axis=0))
+
+    def update(self, prices: PriceStore) -> int:
+        """Consume the bars prices gained since the last update &
+        return how many.
+
+        If prices was rebuilt around the consumed bars (new symbols or
+        earlier dates), everything is recomputed from prices instead.
+        """
+        if (prices.symbols != self.symbols or prices.rows < self.rows
+                or (self.rows and prices.dates[self.rows - 1]
+                    != self.as_of)):
+            self._start(prices)
+            return prices.rows
+        added = prices.rows - self.rows
+        for row in range(self.rows, prices.rows):
+            self._step(prices, row)
+        self.rows = prices.rows
+        if added:
+            self.as_of = prices.dates[-1]
+        return added
+
+    def _step(self, prices: PriceStore, t: int) -> None:
+        # Move every window forward to end at row t. Each row is a
+        # memory-mapped read of one bar of every symbol.
+        state = self.state
+        close = prices.array('close')
+
+        def slide(sums, new, old):
+            # Add row new, subtract row old (None before the window
+            # fills).
+            finite = np.isfinite(new)
+            out = [sums[0] + np.where(finite, new, 0.0),
+                   sums[1] + finite]
+            if old is not None:
+                finite = np.isfinite(old)
+                out[0] -= np.where(finite, old, 0.0)
+                out[1] -= finite
+            return tuple(out)
+
+        for label, window in SMA_WINDOWS.items():
+            state[label] = slide(state[label], close[t],
+                                 close[t - window] if t >= window else None)
+
+        for label, field, fn, fill in (
+                ('52 Wk High', 'high', np.fmax, -np.inf),
+                ('52 Wk Low', 'low', np.fmin, np.inf)):
+            array = prices.array(field)
+            values, counts = state[label]
+            new = array[t]
+            counts = counts + np.isfinite(new)
+            values = fn(values, new)
+            if t >= WEEK52:
+                old = array[t - WEEK52]
+                counts -= np.isfinite(old)
+                # Only a leaving extreme needs its window rescanned.
+                stale = np.flatnonzero(np.isfinite(old) & (old == values))
+                if len(stale):
+                    values[stale] = self._extreme(
+                        array[t + 1 - WEEK52:t + 1, stale],
+                        np.max if fill < 0 else np.min, fill
+                    )[0]
+            state[label] = (values, counts)
+
+        returns = log_returns(close[max(t - 1, 0):t + 1])[-1]
+        old = None
+        if t >= WEEK52 + 1:
+            old = log_returns(close[t - WEEK52 - 1:t - WEEK52 + 1])[-1]
+        s1, n, s2 = state['Volatility 1Y']
+        s1, n = slide((s1, n), returns, old)
+        s2 = s2 + np.where(np.isfinite(returns), returns ** 2, 0.0)
+        if old is not None:
+            s2 -= np.where(np.isfinite(old), old ** 2, 0.0)
+        state['Volatility 1Y'] = (s1, n, s2)
+
+        if self.benchmark is not None:
+            j = self.symbol_index[self.benchmark]
+            # One-row windows, so the sums are per symbol.
+            sums = [a + b for a, b in zip(state['Beta 1Y'], self._beta_sums(
+                returns[None], returns[None, [j]]
+            ))]
+            if old is not None:
+                sums = [a - b for a, b in zip(sums, self._beta_sums(
+                    old[None], old[None, [j]]
+                ))]
+            state['Beta 1Y'] = tuple(sums)
+
+    def values(self, label: str) -> np.ndarray:
+        """Return every symbol's latest value of indicator label."""
+        state = self.state
+        if label in SMA_WINDOWS:
+            sums, counts = state[label]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.where(counts == SMA_WINDOWS[label],
+                                sums / counts, np.nan)
+        if label in ('52 Wk High', '52 Wk Low'):
+            values, counts = state[label]
+            return np.where(counts == WEEK52, values, np.nan)
+        if label == 'Volatility 1Y':
+            s1, n, s2 = state[label]
+            return np.where(n == WEEK52, _std(s1, s2, n), np.nan) \
+                * np.sqrt(WEEK52)
+        if label == 'Beta 1Y':
+            if self.benchmark is None:
+                return np.full(len(self.symbols), np.nan)
+            *sums, n = state[label]
+            return np.where(n == WEEK52, _beta(*sums, n), np.nan)
+        raise ValueError(f"Unknown indicator '{label}'; use one of "
+                         f"{', '.join(LABELS)}.")
+
+    def table(self, symbols: Optional[Iterable[str]] = None,
+              labels: Sequence[str] = LABELS) -> pl.DataFrame:
+        """Return a Symbol x indicator table like Ratios.vs_peers(), so
+        Ratios.peer_ranks() & peer_summary() apply. Symbols not in the
+        price store are left out.
+
+        """
+        if symbols is None:
+            symbols = self.symbols
+        symbols = [s for s in symbols if s in self.symbol_index]
+        columns = np.fromiter((self.symbol_index[s] for s in symbols),
+                              dtype=np.intp)
+        return pl.DataFrame({
+            'Symbol': pl.Series(symbols, dtype=pl.String),
+            **{label: self.values(label)[columns] for label in labels},
+        })
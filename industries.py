@@ -1,30 +1,50 @@
+import functools
+from pathlib import Path
+
 import pandas as pd
-import numpy as np
 
-_sp500_sectors = pd.read_csv(
-    # from .csv, read in a Series where index is the symbols of all
-    # constituents of S&P 500 index.
-    'sp500_constituents.csv',
-    header=0,
-    names=['Symbol', 'Sector', 'Industry Group', 'Industry',
-           'Sub-Industry'],
-    index_col='Symbol',
-    squeeze=True  # Return Series <=> 1 data column (o/w returns df).
-)
+# Data files ship beside this module; resolve them from here so the
+# module works from any working directory (e.g. pool workers).
+_DATA_DIR = Path(__file__).resolve().parent
+
+
+@functools.lru_cache(maxsize=None)
+def sp500_constituents():
+    """Return S&P 500 constituents' GICS classification, read on first
+    use.
+
+    DataFrame indexed by constituent Symbol, one column per GICS level.
+    """
+    return pd.read_csv(
+        _DATA_DIR / 'sp500_constituents.csv',
+        header=0,
+        names=['Symbol', 'Sector', 'Industry Group', 'Industry',
+               'Sub-Industry'],
+        index_col='Symbol',
+    )
 
 
 # .csv columns are nested data (Each Sector has unique set of
 # Industries, which has unique set of Sub-Industries), but higher-level
 # columns do not repeat their data in every applicable row. This leaves
 # many rows with NaN data, & unusable as column or a MultiIndex.
-_gics_struc = pd.read_csv(
-    # Nested data structure formatted poorly in source file, giving many
-    # blank/NaN cells; more info in _fill_nested_df() docstring.
-    'gics_struc.csv',
-    header=0,
-    names=['Sector', 'Industry Group', 'Industry', 'Sub-Industry'],
-    index_col=None,
-)
+@functools.lru_cache(maxsize=None)
+def gics_structure():
+    """Return the raw nested GICS structure, read on first use.
+
+    Nested data structure formatted poorly in source file, giving many
+    blank/NaN cells; more info in _fill_nested_df() docstring.
+    """
+    return pd.read_csv(
+        _DATA_DIR / 'gics_struc.csv',
+        header=0,
+        names=['Sector', 'Industry Group', 'Industry', 'Sub-Industry'],
+        index_col=None,
+    )
+
+
+# GICS levels, from broadest to narrowest.
+LEVELS = ('Sector', 'Industry Group', 'Industry', 'Sub-Industry')
 
 
 def _fill_nested_df(df):
@@ -46,19 +66,94 @@ def _fill_nested_df(df):
     occurs within the 'Health Care' Sector,  while the
     IT Sector has its own unique set of Industries.
     """
-    for row in np.arange(1, df.index.size):
-        for column in df.columns:
-            if df.isna().iloc[row][column]:
-                df.iloc[row][column] = df.iloc[row - 1][column]
-    return df
+    # A blank cell always belongs to the nearest filled cell above it,
+    # so a column-wise forward fill rebuilds the whole tree at once.
+    return df.ffill()
 
 
-class GICS:
+class GICSIndex:
+    """Precomputed lookups over the GICS hierarchy & its constituents.
+
+    Built once from the nested GICS structure & a symbol-indexed
+    constituent table. Every lookup is a dict or set access:
+
+    tree -- forward-filled hierarchy, one row per Sub-Industry, with
+        categorical columns.
+    codes -- {level: {code: name}}, codes being each level's
+        categorical codes in tree.
+    parents -- {level: {name: parent name}} for every level below
+        Sector.
+    members -- {level: {name: Index of constituent symbols}}.
+    classification -- {symbol: {level: name}}.
+
+    """
+
+    def __init__(self, struc: pd.DataFrame, constituents: pd.DataFrame):
+        # Fill all struc rows with appropriate column data.
+        self.tree = _fill_nested_df(struc).astype('category')
+
+        self.codes = {
+            level: dict(enumerate(self.tree[level].cat.categories))
+            for level in LEVELS
+        }
+        self._names = {
+            level: frozenset(self.tree[level].cat.categories)
+            for level in LEVELS
+        }
+        self.parents = {
+            child: dict(zip(self.tree[child], self.tree[parent]))
+            for parent, child in zip(LEVELS, LEVELS[1:])
+        }
+
+        constituents = constituents.loc[constituents.index.notna()]
+        constituents = constituents.astype('category')
+        self.members = {
+            level: {
+                name: symbols for name, symbols
+                in constituents.groupby(level, observed=True).groups.items()
+            }
+            for level in LEVELS
+        }
+        self.classification = constituents.to_dict(orient='index')
+        self._empty = constituents.index[:0]
 
-    # Fill all _gics_struc rows with appropriate column data.
-    _industry_struc = _fill_nested_df(_gics_struc)
+    def names(self, level):
+        return self._names[level]
 
-    _sp500_stock_list = _sp500_sectors.index.values
+    def is_valid(self, level, name):
+        return name in self._names[level]
+
+    def parent(self, level, name):
+        """Return the name of the level above `name`, or None."""
+        if level == LEVELS[0]:
+            return None
+        return self.parents[level].get(name)
+
+    def ancestors(self, level, name):
+        """Return {level: name} for `name` & every level above it."""
+        lineage = {level: name}
+        while level != LEVELS[0] and name is not None:
+            name = self.parent(level, name)
+            level = LEVELS[LEVELS.index(level) - 1]
+            lineage[level] = name
+        return lineage
+
+    def peers(self, level, name):
+        """Return Index of constituent symbols classified under name."""
+        return self.members[level].get(name, self._empty)
+
+    def classify(self, symbol):
+        """Return {level: name} for a constituent symbol, or None."""
+        return self.classification.get(symbol)
+
+
+@functools.lru_cache(maxsize=None)
+def gics_index():
+    """Return the shared GICSIndex, built on first use."""
+    return GICSIndex(gics_structure(), sp500_constituents())
+
+
+class GICS:
 
     def __init__(self, sector, industry=None, subindustry=None):
         self.sector = sector
@@ -71,7 +166,7 @@ class GICS:
 
     @sector.setter
     def sector(self, value):
-        if not (GICS._industry_struc['Sector'] == value).any():
+        if not gics_index().is_valid('Sector', value):
             raise ValueError("'sector' must be valid GICS Sector.")
         else:
             self._sector = value
@@ -84,7 +179,7 @@ class GICS:
     def industry(self, value):
         if not value:
             self._industry = None
-        elif not (GICS._industry_struc['Industry'] == value).any():
+        elif not gics_index().is_valid('Industry', value):
             raise ValueError("'industry' must be valid GICS Industry.")
         else:
             self._industry = value
@@ -97,20 +192,18 @@ class GICS:
     def subindustry(self, value):
         if not value:
             self._subindustry = None
-        elif not (GICS._industry_struc['Sub-Industry'] == value).any():
+        elif not gics_index().is_valid('Sub-Industry', value):
             raise ValueError("'subindustry' must be valid GICS"
                              "Sub-Industry.")
         else:
             self._subindustry = value
 
-        if not self.industry:
+        if self.subindustry and not self.industry:
             # If subindustry but not industry argument is specified,
             # find & set proper industry attribute value.
-            self.industry = GICS._industry_struc.loc[
-                GICS._industry_struc[
-                    'Sub-Industry'
-                ] == self.subindustry, 'Industry'
-            ].iloc[0]
+            self.industry = gics_index().parent(
+                'Sub-Industry', self.subindustry
+            )
 
 
 class PeerComparison(GICS):
@@ -118,26 +211,54 @@ class PeerComparison(GICS):
         super().__init__(sector, industry, subindustry)
         self.symbol = symbol
 
+    def peers(self, peer_level, as_of=None):
+        """Return peer symbols at 'Sector', 'Industry' or 'Sub-Industry'
+        level.
+
+        With as_of (a date), the peers are the members on that date
+        (see membership.py) rather than the constituents snapshot's.
+        """
+        if as_of is not None:
+            return self._peers_as_of(peer_level, as_of)
+        if peer_level == 'Sector':
+            return self.sector_peers
+        elif peer_level == 'Industry':
+            return self.industry_peers
+        elif peer_level == 'Sub-Industry':
+            return self.subindustry_peers
+        else:
+            raise ValueError("'peer_level' must be 'Sector', 'Industry' "
+                             "or 'Sub-Industry'.")
+
+    def _peers_as_of(self, peer_level, as_of):
+        names = {'Sector': self.sector, 'Industry': self.industry,
+                 'Sub-Industry': self.subindustry}
+        if peer_level not in names:
+            raise ValueError("'peer_level' must be 'Sector', 'Industry' "
+                             "or 'Sub-Industry'.")
+        if not names[peer_level]:
+            return None
+        # Deferred: membership imports this module.
+        from membership import membership
+        return pd.Index(
+            membership().members(as_of, peer_level, names[peer_level]),
+            name='Symbol'
+        )
+
     @property
     def sector_peers(self):
-        return _sp500_sectors.loc[
-            _sp500_sectors['Sector'] == self.sector
-        ].index
+        return gics_index().peers('Sector', self.sector)
 
     @property
     def industry_peers(self):
         if not self.industry:
             return None
         else:
-            return _sp500_sectors.loc[
-                _sp500_sectors['Industry'] == self.industry
-            ].index
+            return gics_index().peers('Industry', self.industry)
 
     @property
     def subindustry_peers(self):
         if not self.subindustry:
             return None
         else:
-            return _sp500_sectors.loc[
-                _sp500_sectors['Sub-Industry'] == self.subindustry
-            ].index
+            return gics_index().peers('Sub-Industry', self.subindustry)
@@ -0,0 +1,320 @@
+"""Point-in-time index membership & GICS classification.
+
+sp500_constituents.csv is one snapshot, so peer groups & backtests
+built on it see today's members (& yesterday's leftovers, like DISCA)
+on every date. Membership keeps membership as intervals instead, one
+row per symbol & classification:
+
+    symbol, Sector, Industry Group, Industry, Sub-Industry, start, end
+
+start is inclusive & end exclusive; a null start is membership since
+before the first snapshot recorded, a null end current membership.
+Each newer snapshot (e.g. a constituent list as published on a date)
+is added with record(), which closes the intervals of symbols removed
+or reclassified & opens intervals for the new ones.
+
+Lookups are as of a date & need no scan of the intervals:
+
+    m = membership()
+    m.members('2015-06-30', 'Sub-Industry', 'Broadcasting')
+    m.classify('DISCA', '2019-01-02')          # {level: name} or None
+    m.classify_many(symbols, dates)            # every pair at once
+
+Between two recorded dates the membership is constant, so members()
+finds a date's segment by binary search & slices the segment's
+members, kept sorted by GICS names so every group at every level is a
+contiguous run. classify_many() binary searches (symbol, start) keys
+for all pairs in one call, fast enough for every date of a
+multi-decade backtest.
+
+Classes:
+Membership -- membership intervals & their as-of indexes.
+
+Functions:
+membership -- the shared Membership, built on first use.
+
+"""
+import datetime as dt
+import functools
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+import numpy as np
+import polars as pl
+
+import storage
+from industries import LEVELS
+
+SCHEMA = {
+    'symbol': pl.String,
+    **{level: pl.String for level in LEVELS},
+    'start': pl.Date,
+    'end': pl.Date,
+}
+
+# Day numbers standing for open interval ends; symbol keys pack a day
+# offset by _OFFSET into the low 32 bits.
+_OPEN_START = -2 ** 31
+_OPEN_END = 2 ** 31 - 1
+_OFFSET = 2 ** 31
+
+_INTERVALS = 'intervals.parquet'
+
+Date = Union[str, dt.date, np.datetime64]
+
+
+def _days(dates) -> np.ndarray:
+    # Day numbers (since 1970-01-01) of a date or dates.
+    return np.asarray(dates, dtype='datetime64[D]').astype(np.int64)
+
+
+def _snapshot_frame(constituents) -> pl.DataFrame:
+    # `symbol` & LEVELS from a symbol-indexed pandas frame (as
+    # industries.sp500_constituents()) or a polars frame.
+    if not isinstance(constituents, pl.DataFrame):
+        constituents = constituents.loc[constituents.index.notna()]
+        constituents = pl.DataFrame({
+            'symbol': constituents.index.to_list(),
+            **{level: constituents[level].to_list() for level in LEVELS},
+        })
+    return constituents.select(
+        pl.col('symbol').cast(pl.String),
+        *[pl.col(level).cast(pl.String) for level in LEVELS],
+    ).unique('symbol', keep='last', maintain_order=True)
+
+
+class Membership:
+    """Membership intervals (see the module docstring) & as-of
+    indexes over them.
+
+    intervals -- frame with SCHEMA, sorted by GICS names then symbol;
+        its row numbers are the ids the indexes hold.
+    """
+
+    def __init__(self, intervals: pl.DataFrame):
+        self.intervals = intervals.select(
+            pl.col(name).cast(dtype) for name, dtype in SCHEMA.items()
+        ).sort(*LEVELS, 'symbol', 'start', nulls_last=False)
+        self._index()
+
+    def __repr__(self) -> str:
+        return (f'Membership({self.intervals["symbol"].n_unique()} '
+                f'symbols, {self.intervals.height} intervals)')
+
+    def _index(self) -> None:
+        frame = self.intervals
+        n = frame.height
+        starts = frame['start'].cast(pl.Int64).fill_null(_OPEN_START) \
+            .to_numpy()
+        ends = frame['end'].cast(pl.Int64).fill_null(_OPEN_END).to_numpy()
+        self._symbols = frame['symbol'].to_numpy()
+        self._levels = {level: frame[level].to_numpy() for level in LEVELS}
+
+        # Group codes: rows are sorted by names, so each level's code
+        # (a count of changes in the names down to that level) rises
+        # through every segment's rows too.
+        self._codes, self._groups = {}, {}
+        changed = np.zeros(n, dtype=bool)
+        for level in LEVELS:
+            names = self._levels[level]
+            if n:
+                changed[1:] |= names[1:] != names[:-1]
+            codes = np.cumsum(changed)
+            self._codes[level] = codes
+            groups = {}
+            for code, name in zip(codes, names):
+                groups.setdefault(name, set()).add(code)
+            self._groups[level] = {
+                name: np.array(sorted(codes)) for name, codes in groups.items()
+            }
+
+        # Segments between recorded dates: segment k starts at
+        # boundaries[k - 1] (segment 0 at the open start). Each row is
+        # listed under every segment it spans, in row order.
+        self._boundaries = np.unique(np.concatenate([
+            starts[starts != _OPEN_START], ends[ends != _OPEN_END]
+        ]))
+        first = np.searchsorted(self._boundaries, starts, 'right')
+        last = np.where(ends == _OPEN_END, len(self._boundaries) + 1,
+                        np.searchsorted(self._boundaries, ends, 'right'))
+        spans = np.maximum(last - first, 0)
+        rows = np.repeat(np.arange(n), spans)
+        segments = np.repeat(first, spans) + (
+            np.arange(spans.sum()) - np.repeat(np.cumsum(spans) - spans,
+                                               spans)
+        )
+        order = np.lexsort((rows, segments))
+        self._segment_rows = rows[order]
+        self._segment_offsets = np.searchsorted(
+            segments[order], np.arange(len(self._boundaries) + 2)
+        )
+
+        # (symbol, start) keys for as-of lookups by symbol.
+        self._symbol_codes = {
+            s: i for i, s in enumerate(np.unique(self._symbols))
+        }
+        symbol_codes = np.fromiter(
+            (self._symbol_codes[s] for s in self._symbols), dtype=np.int64,
+            count=n
+        )
+        keys = (symbol_codes << 32) + (starts + _OFFSET)
+        self._key_order = np.argsort(keys, kind='stable')
+        self._keys = keys[self._key_order]
+        self._ends = ends
+
+    @classmethod
+    def from_snapshot(cls, constituents=None,
+                      since: Optional[Date] = None) -> 'Membership':
+        """Build from one constituent snapshot (default
+        industries.sp500_constituents()), members since `since` (or
+        since before records if None).
+
+        """
+        if constituents is None:
+            from industries import sp500_constituents
+            constituents = sp500_constituents()
+        start = None if since is None \
+            else np.datetime64(since, 'D').astype(dt.date)
+        return cls(_snapshot_frame(constituents).with_columns(
+            start=pl.lit(start, dtype=pl.Date),
+            end=pl.lit(None, dtype=pl.Date),
+        ))
+
+    @classmethod
+    def from_snapshots(cls, snapshots: dict) -> 'Membership':
+        """Build from {date: constituents}, the oldest snapshot's
+        members taken as members since before records.
+
+        """
+        dates = sorted(snapshots)
+        membership = cls.from_snapshot(snapshots[dates[0]])
+        for date in dates[1:]:
+            membership.record(snapshots[date], date)
+        return membership
+
+    def record(self, constituents, date: Date) -> dict:
+        """Add a snapshot of the constituents as of date & return the
+        symbols added, removed & reclassified.
+
+        date must not precede any date already recorded.
+        """
+        day = np.datetime64(date, 'D')
+        if len(self._boundaries) and _days(day) < self._boundaries[-1]:
+            raise ValueError(
+                f'{day} precedes the last recorded date '
+                f'{self._boundaries[-1].astype("datetime64[D]")}.'
+            )
+        date = day.astype(dt.date)
+        snapshot = _snapshot_frame(constituents)
+        key = ['symbol', *LEVELS]
+        current = self.intervals.filter(pl.col('end').is_null())
+        closing = current.join(snapshot, on=key, how='anti', nulls_equal=True)
+        opening = snapshot.join(current, on=key, how='anti', nulls_equal=True)
+
+        self.intervals = pl.concat([
+            self.intervals.join(closing.select(*key, 'start'),
+                                on=[*key, 'start'], how='anti',
+                                nulls_equal=True),
+            closing.with_columns(end=pl.lit(date, dtype=pl.Date)),
+            opening.with_columns(start=pl.lit(date, dtype=pl.Date),
+                                 end=pl.lit(None, dtype=pl.Date)),
+        ]).sort(*LEVELS, 'symbol', 'start', nulls_last=False)
+        self._index()
+
+        closed, opened = set(closing['symbol']), set(opening['symbol'])
+        return {
+            'added': sorted(opened - closed),
+            'removed': sorted(closed - opened),
+            'reclassified': sorted(opened & closed),
+        }
+
+    def save(self, root: Optional[Path] = None) -> Path:
+        """Write to root (default cwd/membership_db) & return it."""
+        root = Path.cwd() / 'membership_db' if root is None else Path(root)
+        storage.write(self.intervals, root / _INTERVALS)
+        return root
+
+    @classmethod
+    def load(cls, root: Optional[Path] = None) -> 'Membership':
+        root = Path.cwd() / 'membership_db' if root is None else Path(root)
+        return cls(storage.read(root / _INTERVALS))
+
+    def _segment(self, date: Date) -> np.ndarray:
+        # Row ids of the members on date, in row order.
+        k = int(np.searchsorted(self._boundaries, _days(date), 'right'))
+        return self._segment_rows[
+            self._segment_offsets[k]:self._segment_offsets[k + 1]
+        ]
+
+    def members(self, date: Date, level: Optional[str] = None,
+                name: Optional[str] = None) -> list:
+        """Return the symbols that were members on date, all or those
+        classified under name at GICS level, in GICS order.
+
+        """
+        rows = self._segment(date)
+        if level is not None:
+            codes = self._codes[level][rows]
+            rows = np.concatenate([rows[
+                np.searchsorted(codes, code, 'left'):
+                np.searchsorted(codes, code, 'right')
+            ] for code in self._groups[level].get(name, [])] or [rows[:0]])
+        return self._symbols[rows].tolist()
+
+    def _rows_at(self, symbols: Iterable[str], dates) -> np.ndarray:
+        # Interval row id of each (symbol, date) pair, -1 where the
+        # symbol was not a member.
+        symbols = np.asarray(list(symbols), dtype=object)
+        days = np.broadcast_to(_days(dates), symbols.shape)
+        codes = np.fromiter(
+            (self._symbol_codes.get(s, -1) for s in symbols),
+            dtype=np.int64, count=len(symbols)
+        )
+        keys = (codes << 32) + (days + _OFFSET)
+        found = np.searchsorted(self._keys, keys, 'right') - 1
+        rows = self._key_order[np.maximum(found, 0)]
+        valid = ((codes >= 0) & (found >= 0)
+                 & ((self._keys[np.maximum(found, 0)] >> 32) == codes)
+                 & (self._ends[rows] > days)) if len(self._keys) \
+            else np.zeros(len(symbols), dtype=bool)
+        return np.where(valid, rows, -1)
+
+    def classify(self, symbol: str, date: Date) -> Optional[dict]:
+        """Return {level: name} for symbol on date, or None if it was
+        not a member.
+
+        """
+        row = self._rows_at([symbol], date)[0]
+        if row < 0:
+            return None
+        return {level: self._levels[level][row] for level in LEVELS}
+
+    def classify_many(self, symbols: Iterable[str], dates) -> pl.DataFrame:
+        """Return `symbol`, `date` & LEVELS for each (symbol, date)
+        pair, levels null where the symbol was not a member.
+
+        dates is one date for every symbol or one per symbol.
+        """
+        symbols = list(symbols)
+        rows = self._rows_at(symbols, dates)
+        member = rows >= 0
+        days = np.broadcast_to(_days(dates), rows.shape)
+        return pl.DataFrame({
+            'symbol': pl.Series(symbols, dtype=pl.String),
+            'date': days.astype('datetime64[D]'),
+            **{level: pl.Series(
+                np.where(member, self._levels[level][rows], None),
+                dtype=pl.String
+            ) for level in LEVELS},
+        })
+
+
+@functools.lru_cache(maxsize=None)
+def membership() -> Membership:
+    """Return the shared Membership: the saved one in cwd/membership_db
+    if any, else the constituents snapshot.
+
+    """
+    if (Path.cwd() / 'membership_db' / _INTERVALS).exists():
+        return Membership.load()
+    return Membership.from_snapshot()
@@ -0,0 +1,236 @@
+"""In-process instrumentation of stonks' hot paths.
+
+Fetching, caching, parsing, normalization & peer comparison record into
+one process-wide Registry of counters, gauges & timers, each labelled
+(e.g. by AV function), so a slow refresh can be broken down into
+network, throttling, json parsing & normalization time:
+
+    import metrics
+    with metrics.profile() as prof:
+        store.refresh()
+    print(prof.report())
+
+    print(metrics.registry.prometheus())
+
+Recorded metrics (timers in seconds):
+http_request_seconds{fn} -- AV HTTP round trips.
+http_bytes_total{fn} -- AV response bytes received.
+rate_limit_wait_seconds{fn} -- waiting on the client's token bucket.
+throttle_sleep_seconds{fn} -- backing off after throttle replies.
+retries_total{fn} -- requests retried after throttle replies.
+quota_consumed_total -- requests counted against the daily quota.
+quota_remaining -- gauge; requests left today, if limited.
+json_parse_seconds{fn} -- parsing AV responses.
+cache_hits_total{fn,layer}, cache_misses_total{fn,layer} -- response
+    cache lookups; layer is 'memory', 'frame' or 'response'.
+output_seconds{fn,format} -- AVRequest.output() calls.
+stock_get_seconds{statement} -- Stock.get_* calls.
+normalize_seconds{fn}, normalize_rows_total{fn} -- statements.normalize.
+vs_peers_seconds{peer_level} -- fundamentals.Ratios.vs_peers.
+
+Set STONKS_METRICS=0 in the environment, or registry.enabled = False,
+to record nothing.
+
+Classes:
+Registry -- thread-safe store of counters, gauges & timers.
+Profile -- metrics recorded during a profile() block.
+
+Functions:
+timed -- decorator timing every call of a function.
+profile -- context manager collecting metrics recorded in a block.
+
+"""
+import contextlib
+import functools
+import os
+import threading
+import time
+from typing import Optional
+
+PREFIX = 'stonks_'
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def _series(key: tuple, suffix: str = '') -> str:
+    # Prometheus series name, e.g. stonks_x_seconds_sum{fn="OVERVIEW"}
+    name, labels = key
+    text = ','.join(f'{k}="{v}"' for k, v in labels)
+    return f'{PREFIX}{name}{suffix}' + (f'{{{text}}}' if text else '')
+
+
+class Registry:
+    """Thread-safe store of labelled counters, gauges & timers.
+
+    Timers keep each series' call count, total, min & max seconds.
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._timers = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                self._timers[key] = [1, seconds, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = min(timer[2], seconds)
+                timer[3] = max(timer[3], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        """Time the enclosed block into timer `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._timers.clear()
+
+    def snapshot(self) -> dict:
+        """Return {'counters', 'gauges', 'timers'}, each keyed by
+        series name.
+
+        """
+        with self._lock:
+            return {
+                'counters': {_series(k): v
+                             for k, v in self._counters.items()},
+                'gauges': {_series(k): v for k, v in self._gauges.items()},
+                'timers': {
+                    _series(k): {'count': t[0], 'sum': t[1], 'min': t[2],
+                                 'max': t[3]}
+                    for k, t in self._timers.items()
+                },
+            }
+
+    def prometheus(self) -> str:
+        """Return every metric in Prometheus text exposition format;
+        timers are exposed as summaries (_count & _sum).
+
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            gauges = sorted(self._gauges.items())
+            timers = sorted((k, list(t)) for k, t in self._timers.items())
+
+        lines, typed = [], set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f'# TYPE {PREFIX}{name} {kind}')
+
+        for key, value in counters:
+            declare(key[0], 'counter')
+            lines.append(f'{_series(key)} {value}')
+        for key, value in gauges:
+            declare(key[0], 'gauge')
+            lines.append(f'{_series(key)} {value}')
+        for key, (count, total, _, _) in timers:
+            declare(key[0], 'summary')
+            lines.append(f'{_series(key, "_count")} {count}')
+            lines.append(f'{_series(key, "_sum")} {total}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry(enabled=os.environ.get('STONKS_METRICS', '1') != '0')
+
+
+def timed(name: str, registry: Optional[Registry] = None, **labels):
+    """Decorator timing each call of the function into timer `name`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with (registry or _default()).timer(name, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _default() -> Registry:
+    return registry
+
+
+class Profile:
+    """Metrics recorded during a profile() block.
+
+    counters & timers hold the change in each series over the block;
+    timers as {'count', 'sum'}.
+    """
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.counters = {}
+        self.timers = {}
+
+    def report(self) -> str:
+        """Return a text table of timers (slowest total first) then
+        counters.
+
+        """
+        lines = [f'{"elapsed":<60}{self.seconds:12.4f} s']
+        for series, timer in sorted(self.timers.items(),
+                                    key=lambda item: -item[1]['sum']):
+            lines.append(f'{series:<60}{timer["sum"]:12.4f} s'
+                         f'{timer["count"]:8d} calls')
+        for series, value in sorted(self.counters.items()):
+            lines.append(f'{series:<60}{value:12g}')
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def profile(registry: Optional[Registry] = None):
+    """Yield a Profile filled with the metrics recorded in the block.
+
+    Other threads' recordings during the block are included too.
+    """
+    registry = registry or _default()
+    result = Profile()
+    before = registry.snapshot()
+    start = time.perf_counter()
+    try:
+        yield result
+    finally:
+        result.seconds = time.perf_counter() - start
+        after = registry.snapshot()
+        for series, value in after['counters'].items():
+            delta = value - before['counters'].get(series, 0)
+            if delta:
+                result.counters[series] = delta
+        for series, timer in after['timers'].items():
+            old = before['timers'].get(series, {'count': 0, 'sum': 0.0})
+            if timer['count'] > old['count']:
+                result.timers[series] = {
+                    'count': timer['count'] - old['count'],
+                    'sum': timer['sum'] - old['sum'],
+                }
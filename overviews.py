@@ -0,0 +1,201 @@
+"""Dense universe-wide overview matrix.
+
+OverviewMatrix holds the latest OVERVIEW of every symbol as one
+contiguous float64 matrix, symbols x numeric fields, with a symbol &
+a metric index, beside a polars frame of the text & date fields with
+text as categoricals. Cross-sectional work over any overview field is
+plain NumPy slicing:
+
+    matrix = OverviewMatrix.load()
+    pe = matrix.column('P/E')               # every symbol's P/E
+    matrix.loc(['AAPL', 'MSFT'], ['P/E', 'Beta'])
+
+The matrix is saved as a Fortran-ordered .npy, so each metric's column
+is contiguous on disk, & load() memory-maps it.
+
+Classes:
+OverviewMatrix -- symbols x metrics float64 matrix & text fields.
+
+"""
+import datetime as dt
+import json
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+import polars as pl
+
+import statements
+import storage
+
+# Numeric overview fields, metadata (e.g. FullTimeEmployees) & metrics,
+# the matrix columns, in schema order.
+METRICS = tuple(f.name for f in statements.OVERVIEW
+                if f.dtype in (pl.Int64, pl.Float64))
+# Text & date fields, kept as frame columns.
+TEXT = tuple(f.name for f in statements.OVERVIEW
+             if f.dtype not in (pl.Int64, pl.Float64) and f.name != 'Symbol')
+DATES = frozenset(f.name for f in statements.OVERVIEW if f.dtype == pl.Date)
+
+_VALUES = 'values.npy'
+_TEXT = 'text.parquet'
+_INDEX = 'index.json'
+
+
+class OverviewMatrix:
+    """Symbols x metrics float64 matrix of overview metrics, plus text
+    & date fields.
+
+    values -- float64 array, one row per symbol, one column per metric;
+        missing values are NaN.
+    symbols, metrics -- row & column labels.
+    text -- frame of `symbol` & the TEXT fields, one row per symbol in
+        values' row order; text fields are Categorical.
+
+    """
+
+    def __init__(self, values: np.ndarray, symbols: Sequence[str],
+                 metrics: Sequence[str], text: pl.DataFrame):
+        if values.shape != (len(symbols), len(metrics)):
+            raise ValueError(
+                f'values shape {values.shape} does not match '
+                f'{len(symbols)} symbols x {len(metrics)} metrics.'
+            )
+        self.values = values
+        self.symbols = list(symbols)
+        self.metrics = list(metrics)
+        self.text = text
+        self.symbol_index = {s: i for i, s in enumerate(self.symbols)}
+        self.metric_index = {m: j for j, m in enumerate(self.metrics)}
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def __repr__(self) -> str:
+        return (f'OverviewMatrix({len(self.symbols)} symbols x '
+                f'{len(self.metrics)} metrics)')
+
+    @classmethod
+    def from_frame(cls, overviews: pl.DataFrame) -> 'OverviewMatrix':
+        """Build from normalized overviews (see statements.normalize),
+        one row per symbol with a `Symbol` column.
+
+        """
+        overviews = overviews.unique('Symbol', keep='last',
+                                     maintain_order=True)
+        values = np.asfortranarray(
+            overviews.select(
+                pl.col(m).cast(pl.Float64) for m in METRICS
+            ).to_numpy(),
+            dtype=np.float64
+        )
+        text = overviews.select(
+            pl.col('Symbol').alias('symbol'),
+            *[pl.col(c) if c in DATES else pl.col(c).cast(pl.Categorical)
+              for c in TEXT],
+        )
+        return cls(values, overviews['Symbol'].to_list(), METRICS, text)
+
+    @classmethod
+    def fetch(cls, symbols: Iterable[str],
+              concurrency: int = 8) -> 'OverviewMatrix':
+        """Fetch (or read from the response cache) every symbol's
+        overview & build the matrix. Symbols that fail are left out.
+
+        """
+        from batch import fetch_many
+        symbols = list(symbols)
+        raw = fetch_many('OVERVIEW', symbols, concurrency=concurrency,
+                         output_format='polars', return_exceptions=True)
+        # Rows in the order symbols were given, not completion order.
+        frames = [raw[s] for s in symbols
+                  if not isinstance(raw[s], Exception)]
+        if not frames:
+            raise ValueError('No overviews could be fetched.')
+        return cls.from_frame(statements.normalize(
+            pl.concat(frames, how='diagonal_relaxed'), 'OVERVIEW'
+        ))
+
+    @classmethod
+    def from_store(cls, store=None) -> 'OverviewMatrix':
+        """Build from the overview snapshots in a FundamentalsStore."""
+        if store is None:
+            from store import FundamentalsStore
+            store = FundamentalsStore()
+        return cls.from_frame(
+            store.scan('OVERVIEW').drop('symbol', 'sector').collect()
+        )
+
+    def save(self, root: Optional[Path] = None) -> Path:
+        """Write to root (default cwd/overview_db) & return it."""
+        root = Path.cwd() / 'overview_db' if root is None else Path(root)
+        storage.write(self.text, root / _TEXT)
+        with storage.replacing(root / _VALUES) as tmp:
+            self._save_values(tmp)
+        index = {
+            'symbols': self.symbols,
+            'metrics': self.metrics,
+            'saved_at': dt.datetime.now(dt.timezone.utc).isoformat(),
+        }
+        with storage.replacing(root / _INDEX) as tmp:
+            tmp.write_text(json.dumps(index))
+        return root
+
+    def _save_values(self, path: Path) -> None:
+        # Via a file object, as np.save would append .npy to the path.
+        # The .npy header records Fortran order.
+        with open(path, 'wb') as f:
+            np.save(f, np.asfortranarray(self.values))
+
+    @classmethod
+    def load(cls, root: Optional[Path] = None,
+             mmap: bool = True) -> 'OverviewMatrix':
+        """Read a saved matrix, memory-mapping values unless
+        mmap=False.
+
+        """
+        root = Path.cwd() / 'overview_db' if root is None else Path(root)
+        index = json.loads((root / _INDEX).read_text())
+        values = np.load(root / _VALUES, mmap_mode='r' if mmap else None)
+        return cls(values, index['symbols'], index['metrics'],
+                   pl.read_parquet(root / _TEXT))
+
+    def rows(self, symbols: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.symbol_index[s] for s in symbols),
+                           dtype=np.intp)
+
+    def columns(self, metrics: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.metric_index[m] for m in metrics),
+                           dtype=np.intp)
+
+    def column(self, metric: str) -> np.ndarray:
+        """Return every symbol's value of metric (a view)."""
+        return self.values[:, self.metric_index[metric]]
+
+    def row(self, symbol: str) -> np.ndarray:
+        """Return every metric of symbol."""
+        return self.values[self.symbol_index[symbol]]
+
+    def loc(self, symbols: Optional[Iterable[str]] = None,
+            metrics: Optional[Iterable[str]] = None) -> np.ndarray:
+        """Return the symbols x metrics sub-matrix (all if None)."""
+        rows = slice(None) if symbols is None else self.rows(symbols)
+        cols = slice(None) if metrics is None else self.columns(metrics)
+        if isinstance(rows, slice) or isinstance(cols, slice):
+            return self.values[rows, cols]
+        return self.values[np.ix_(rows, cols)]
+
+    def where(self, mask: np.ndarray) -> list:
+        """Return the symbols of the rows where a boolean mask (e.g.
+        `matrix.column('P/E') < 15`) is true.
+
+        """
+        return [self.symbols[i] for i in np.flatnonzero(mask)]
+
+    def frame(self, metrics: Optional[Sequence[str]] = None
+              ) -> pl.DataFrame:
+        """Return text fields & metrics as one polars frame."""
+        metrics = self.metrics if metrics is None else list(metrics)
+        return self.text.hstack(pl.DataFrame(
+            self.loc(None, metrics), schema=metrics, orient='row'
+        ))
@@ -0,0 +1,244 @@
+"""Long (tidy) statement panel with pivot-on-demand views.
+
+Every reported value of every symbol's statements is one row:
+
+    symbol, statement, frequency, fy_end, item, value
+
+with statement, frequency & item dictionary-encoded (pl.Enum) & value
+kept as the statements' Int64. Null line items are left out. Views
+filter the long frame first & pivot only what they return, so
+comparing many companies over many periods never builds a wide,
+transposed frame per symbol:
+
+    panel = Panel.from_store()
+    panel.items_by_period('ISRG')                 # items x periods
+    panel.symbols_by_item(2024, ['tot_rev', 'net_inc'])
+    panel.history(['AAPL', 'MSFT'], ['op_inc'])   # (symbol, fy_end) x items
+
+Classes:
+Panel -- long statement panel & its pivoted views.
+
+Functions:
+melt -- normalized statement frame to long rows.
+
+"""
+import datetime as dt
+from pathlib import Path
+from typing import Iterable, Optional, Sequence, Union
+
+import polars as pl
+
+import storage
+from cache import REPORT_KEYS
+from cache import STATEMENT_FUNCTIONS
+from statements import SCHEMAS
+
+# Line items of every statement, in schema order; fy_end &
+# report_currency lead each schema & are not line items.
+ITEMS = tuple(dict.fromkeys(
+    field.name for fn in STATEMENT_FUNCTIONS for field in SCHEMAS[fn][2:]
+))
+
+STATEMENT = pl.Enum(STATEMENT_FUNCTIONS)
+FREQUENCY = pl.Enum(tuple(REPORT_KEYS))
+ITEM = pl.Enum(ITEMS)
+
+SCHEMA = {
+    'symbol': pl.Categorical,
+    'statement': STATEMENT,
+    'frequency': FREQUENCY,
+    'fy_end': pl.Date,
+    'item': ITEM,
+    'value': pl.Int64,
+}
+
+Period = Union[int, dt.date]
+
+
+def melt(frame: Union[pl.DataFrame, pl.LazyFrame], fn: str,
+         symbol: Optional[str] = None,
+         frequency: Optional[str] = None) -> pl.LazyFrame:
+    """Return a normalized statement (see statements.normalize) as
+    long rows with the panel SCHEMA.
+
+    symbol & frequency fill those columns when frame lacks them.
+    """
+    fn = fn.upper()
+    lf = frame.lazy()
+    columns = lf.collect_schema().names()
+    if 'symbol' not in columns:
+        lf = lf.with_columns(symbol=pl.lit(symbol, dtype=pl.String))
+    if 'frequency' not in columns:
+        lf = lf.with_columns(frequency=pl.lit(frequency, dtype=pl.String))
+    items = [f.name for f in SCHEMAS[fn][2:] if f.name in columns]
+    return (
+        lf.unpivot(on=items, index=['symbol', 'frequency', 'fy_end'],
+                   variable_name='item', value_name='value')
+        .drop_nulls('value')
+        .select(
+            pl.col('symbol').cast(SCHEMA['symbol']),
+            pl.lit(fn, dtype=STATEMENT).alias('statement'),
+            pl.col('frequency').cast(FREQUENCY),
+            pl.col('fy_end'),
+            pl.col('item').cast(ITEM),
+            pl.col('value').cast(pl.Int64),
+        )
+    )
+
+
+def _period_filter(period: Period) -> pl.Expr:
+    # A fiscal year matches the report ending in it.
+    if isinstance(period, int):
+        return pl.col('fy_end').dt.year() == period
+    return pl.col('fy_end') == period
+
+
+def _column_names(frame: pl.DataFrame) -> pl.DataFrame:
+    # Pivoted Date & Enum headers as plain strings.
+    return frame.rename({c: str(c) for c in frame.columns})
+
+
+class Panel:
+    """Long statement panel; see the module docstring.
+
+    frame -- DataFrame or LazyFrame with the panel SCHEMA. Views stay
+        lazy until they pivot, so a scanned panel only reads the rows
+        a view needs.
+    """
+
+    def __init__(self, frame: Union[pl.DataFrame, pl.LazyFrame]):
+        self.frame = frame.lazy()
+
+    def __repr__(self) -> str:
+        return f'Panel({self.frame.collect_schema()})'
+
+    @classmethod
+    def from_frames(cls, frames: dict, symbol: Optional[str] = None,
+                    frequency: Optional[str] = None) -> 'Panel':
+        """Build from {AV function: normalized statement}."""
+        return cls(pl.concat([
+            melt(frame, fn, symbol, frequency)
+            for fn, frame in frames.items()
+        ]))
+
+    @classmethod
+    def from_stock(cls, stock, frequency: str = 'annual') -> 'Panel':
+        """Build from an equity.Stock's statements of one frequency."""
+        return cls.from_frames({
+            'INCOME_STATEMENT': stock.get_income_statement(frequency),
+            'BALANCE_SHEET': stock.get_balance_sheet(frequency),
+            'CASH_FLOW': stock.get_cash_flow_statement(frequency),
+        }, stock.symbol, frequency)
+
+    @classmethod
+    def from_store(cls, store=None,
+                   statements: Sequence[str] = STATEMENT_FUNCTIONS
+                   ) -> 'Panel':
+        """Lazily melt a FundamentalsStore's statements."""
+        if store is None:
+            from store import FundamentalsStore
+            store = FundamentalsStore()
+        return cls(pl.concat([
+            melt(store.scan(fn).drop('sector'), fn) for fn in statements
+        ]))
+
+    def save(self, path: Union[str, Path]) -> Path:
+        """Write the panel (collected) in path's storage format."""
+        return storage.write(self.frame, path)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> 'Panel':
+        """Lazily scan a saved panel."""
+        return cls(storage.scan(path).cast(SCHEMA))
+
+    def collect(self) -> pl.DataFrame:
+        return self.frame.collect()
+
+    def select(self, symbols: Optional[Iterable[str]] = None,
+               items: Optional[Iterable[str]] = None,
+               statement: Optional[str] = None,
+               frequency: Optional[str] = 'annual',
+               period: Optional[Period] = None) -> pl.LazyFrame:
+        """Return the long rows matching every filter given."""
+        lf = self.frame
+        if symbols is not None:
+            lf = lf.filter(
+                pl.col('symbol').cast(pl.String).is_in(list(symbols))
+            )
+        if items is not None:
+            lf = lf.filter(pl.col('item').is_in(
+                pl.Series(list(items), dtype=ITEM)
+            ))
+        if statement is not None:
+            lf = lf.filter(pl.col('statement') == statement.upper())
+        if frequency is not None:
+            lf = lf.filter(pl.col('frequency') == frequency)
+        if period is not None:
+            lf = lf.filter(_period_filter(period))
+        return lf
+
+    def items_by_period(self, symbol: str,
+                        statement: Optional[str] = None,
+                        frequency: str = 'annual',
+                        items: Optional[Iterable[str]] = None
+                        ) -> pl.DataFrame:
+        """Return one symbol's line items x periods, newest period
+        first, items in schema order; replaces transposing a
+        statement.
+
+        """
+        rows = (
+            self.select([symbol], items, statement, frequency)
+            .sort('fy_end', 'statement', 'item',
+                  descending=[True, False, False])
+            .collect()
+        )
+        return _column_names(
+            rows.pivot(on='fy_end', index=['statement', 'item'],
+                       values='value', aggregate_function='first',
+                       maintain_order=True)
+            .sort('statement', 'item')
+        )
+
+    def symbols_by_item(self, period: Period,
+                        items: Optional[Iterable[str]] = None,
+                        statement: Optional[str] = None,
+                        frequency: str = 'annual',
+                        symbols: Optional[Iterable[str]] = None
+                        ) -> pl.DataFrame:
+        """Return symbols x line items for one period: a fiscal year
+        (int) or an exact fy_end date.
+
+        Items reported on two statements (e.g. net_inc) take the
+        first statement's value unless statement is given.
+        """
+        rows = (
+            self.select(symbols, items, statement, frequency, period)
+            .sort('symbol', 'statement', 'item')
+            .collect()
+        )
+        return _column_names(
+            rows.pivot(on='item', index=['symbol', 'fy_end'],
+                       values='value', aggregate_function='first',
+                       maintain_order=True)
+        )
+
+    def history(self, symbols: Optional[Iterable[str]] = None,
+                items: Optional[Iterable[str]] = None,
+                statement: Optional[str] = None,
+                frequency: str = 'annual') -> pl.DataFrame:
+        """Return (symbol, fy_end) x line items, each symbol's periods
+        newest first, for multi-company, multi-period comparisons.
+
+        """
+        rows = (
+            self.select(symbols, items, statement, frequency)
+            .sort(['symbol', 'fy_end', 'statement', 'item'],
+                  descending=[False, True, False, False])
+            .collect()
+        )
+        return _column_names(
+            rows.pivot(on='item', index=['symbol', 'fy_end'],
+                       values='value', aggregate_function='first',
+                       maintain_order=True)
+        )
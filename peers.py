@@ -0,0 +1,260 @@
+"""Peer-relative metrics across fiscal history.
+
+For every symbol & fiscal year, each metric's percentile among its
+GICS sector, industry & sub-industry peers that year, & the peers'
+median that year & over rolling 3- & 5-year windows. The whole
+universe's history is computed in grouped passes over one long frame,
+rather than a peer comparison per symbol & period:
+
+    history = PeerHistory.from_store(metrics=['roic', 'op_margin'])
+    history.frame(symbols=['ISRG'], levels=['Industry'])
+
+Aggregates are materialized, & update() recomputes only the groups &
+years that newly arrived periods touch.
+
+Rows are long: symbol, level, group (the GICS name at that level),
+metric, fiscal_year & value, with the percentile & peer aggregates
+beside them. percentile is 0 for the lowest value in the group & year
+& 1 for the highest; null when a symbol has no peers.
+
+Classes:
+PeerHistory -- materialized peer aggregates with incremental updates.
+
+"""
+import json
+from pathlib import Path
+from typing import Iterable, Optional, Sequence, Union
+
+import polars as pl
+
+import storage
+
+# GICS levels peers are grouped by.
+LEVELS = ('Sector', 'Industry', 'Sub-Industry')
+# Years in each rolling peer median.
+WINDOWS = (3, 5)
+
+LEVEL = pl.Enum(LEVELS)
+# Columns identifying one peer group in one year.
+KEY = ('level', 'group', 'metric', 'fiscal_year')
+
+Frame = Union[pl.DataFrame, pl.LazyFrame]
+
+_VALUES = 'values.parquet'
+_AGGREGATES = 'aggregates.parquet'
+_INDEX = 'index.json'
+
+
+def _long(metrics: Frame, gics: pl.DataFrame,
+          names: Sequence[str]) -> pl.DataFrame:
+    # One row per symbol, fiscal year, metric & GICS level, each
+    # symbol's latest report in a year standing for that year.
+    return (
+        metrics.lazy()
+        .with_columns(fiscal_year=pl.col('fy_end').dt.year())
+        .sort('fy_end')
+        .unique(['symbol', 'fiscal_year'], keep='last')
+        .unpivot(on=list(names), index=['symbol', 'fiscal_year'],
+                 variable_name='metric', value_name='value')
+        .with_columns(pl.col('value').cast(pl.Float64))
+        .drop_nulls('value')
+        .filter(pl.col('value').is_finite())
+        .join(
+            gics.lazy()
+            # Each level has its own Enum; unpivot needs one dtype.
+            .select('symbol', *[pl.col(level).cast(pl.String)
+                                for level in LEVELS])
+            .unpivot(on=list(LEVELS), index='symbol',
+                     variable_name='level', value_name='group')
+            .with_columns(pl.col('level').cast(LEVEL))
+            .drop_nulls('group'),
+            on='symbol'
+        )
+        .select('symbol', *KEY, 'value')
+        .collect()
+    )
+
+
+def _percentiles(values: pl.DataFrame) -> pl.DataFrame:
+    group = list(KEY)
+    peers = pl.len().over(group)
+    return values.with_columns(
+        percentile=pl.when(peers > 1).then(
+            (pl.col('value').rank('average').over(group) - 1)
+            / (peers - 1)
+        )
+    )
+
+
+def _aggregates(values: pl.DataFrame) -> pl.DataFrame:
+    # Yearly peer count & median, & pooled rolling medians: a value of
+    # year t counts towards every window ending in t .. t + n - 1.
+    aggregates = values.group_by(KEY).agg(
+        peers=pl.len(), median=pl.col('value').median()
+    )
+    for window in WINDOWS:
+        rolling = (
+            values.select(
+                'level', 'group', 'metric', 'value',
+                fiscal_year=pl.int_ranges(
+                    pl.col('fiscal_year'), pl.col('fiscal_year') + window,
+                    dtype=pl.Int32
+                ),
+            )
+            .explode('fiscal_year')
+            .group_by(KEY)
+            .agg(pl.col('value').median().alias(f'median_{window}y'))
+        )
+        aggregates = aggregates.join(rolling, on=KEY, how='left')
+    return aggregates.sort(KEY)
+
+
+class PeerHistory:
+    """Peer percentiles & medians for a universe's fiscal history.
+
+    values -- long rows (see the module docstring) with percentile.
+    aggregates -- one row per KEY: peers, median & median_<n>y for
+        each of WINDOWS.
+    metrics -- names of the metric columns.
+    """
+
+    def __init__(self, values: pl.DataFrame, aggregates: pl.DataFrame,
+                 metrics: Sequence[str]):
+        self.values = values
+        self.aggregates = aggregates
+        self.metrics = list(metrics)
+
+    def __repr__(self) -> str:
+        return (f'PeerHistory({self.values["symbol"].n_unique()} symbols, '
+                f'{len(self.metrics)} metrics)')
+
+    @classmethod
+    def build(cls, metrics: Frame,
+              names: Optional[Sequence[str]] = None,
+              gics: Optional[pl.DataFrame] = None) -> 'PeerHistory':
+        """Compute from a frame of `symbol`, `fy_end` & metric columns,
+        e.g. ratios.compute_ratios() output.
+
+        names -- metric columns to use; default every numeric column.
+        gics -- `symbol` & LEVELS columns; default the constituents'
+            (screen.gics_frame()).
+        """
+        if gics is None:
+            from screen import gics_frame
+            gics = gics_frame()
+        if names is None:
+            names = [
+                name for name, dtype in metrics.collect_schema().items()
+                if dtype.is_numeric() and name not in ('symbol', 'fy_end')
+            ]
+        values = _long(metrics, gics, names)
+        return cls(_percentiles(values), _aggregates(values), names)
+
+    @classmethod
+    def from_store(cls, store=None, metrics: Optional[Sequence[str]] = None,
+                   frequency: str = 'annual') -> 'PeerHistory':
+        """Compute from ratios (see ratios.RATIOS; default all) over a
+        FundamentalsStore's history.
+
+        """
+        from ratios import RATIOS, store_ratios
+        if store is None:
+            from store import FundamentalsStore
+            store = FundamentalsStore()
+        names = list(RATIOS) if metrics is None else list(metrics)
+        return cls.build(store_ratios(store, names, frequency, lazy=True),
+                         names)
+
+    def update(self, metrics: Frame,
+               gics: Optional[pl.DataFrame] = None) -> pl.DataFrame:
+        """Add or replace periods & return the peer-group years
+        recomputed.
+
+        metrics has build()'s layout; its (symbol, fiscal year)
+        rows replace stored ones. Only groups & years holding a new
+        value are recomputed, plus the rolling windows covering them.
+        """
+        if gics is None:
+            from screen import gics_frame
+            gics = gics_frame()
+        new = _long(metrics, gics, [
+            name for name in self.metrics
+            if name in metrics.collect_schema().names()
+        ])
+        rows = ['symbol', 'fiscal_year', 'metric']
+        replaced = self.values.join(new.select(rows).unique(), on=rows,
+                                    how='semi')
+        # Groups gaining a value, & any a replaced value leaves (e.g.
+        # after a reclassification).
+        touched = pl.concat([new.select(KEY),
+                             replaced.select(KEY)]).unique()
+
+        values = pl.concat([
+            self.values.drop('percentile').join(new.select(rows).unique(),
+                                                on=rows, how='anti'),
+            new,
+        ])
+
+        # Percentiles change only within the touched groups & years.
+        recomputed = _percentiles(values.join(touched, on=KEY, how='semi'))
+        self.values = pl.concat([
+            self.values.join(touched, on=KEY, how='anti'),
+            recomputed,
+        ])
+
+        # Aggregates of every year a touched year's windows end in,
+        # from those groups' values.
+        groups = ['level', 'group', 'metric']
+        affected = touched.select(
+            *groups,
+            fiscal_year=pl.int_ranges(
+                pl.col('fiscal_year'),
+                pl.col('fiscal_year') + max(WINDOWS), dtype=pl.Int32
+            ),
+        ).explode('fiscal_year').unique()
+        aggregates = _aggregates(
+            values.join(touched.select(groups).unique(), on=groups,
+                        how='semi')
+        ).join(affected, on=KEY, how='semi')
+        self.aggregates = pl.concat([
+            self.aggregates.join(affected, on=KEY, how='anti'),
+            aggregates.select(self.aggregates.columns),
+        ]).sort(KEY)
+        return touched.sort(KEY)
+
+    def frame(self, symbols: Optional[Iterable[str]] = None,
+              metrics: Optional[Iterable[str]] = None,
+              levels: Optional[Iterable[str]] = None) -> pl.DataFrame:
+        """Return values with percentile & peer aggregates, filtered to
+        the symbols, metrics & levels given.
+
+        """
+        lf = self.values.lazy()
+        if symbols is not None:
+            lf = lf.filter(pl.col('symbol').is_in(list(symbols)))
+        if metrics is not None:
+            lf = lf.filter(pl.col('metric').is_in(list(metrics)))
+        if levels is not None:
+            lf = lf.filter(pl.col('level').is_in(
+                pl.Series(list(levels), dtype=LEVEL)
+            ))
+        return (
+            lf.join(self.aggregates.lazy(), on=KEY, how='left')
+            .sort('symbol', 'metric', 'level', 'fiscal_year')
+            .collect()
+        )
+
+    def save(self, root: Optional[Path] = None) -> Path:
+        """Write to root (default cwd/peers_db) & return it."""
+        root = Path.cwd() / 'peers_db' if root is None else Path(root)
+        storage.write(self.values, root / _VALUES)
+        storage.write(self.aggregates, root / _AGGREGATES)
+        (root / _INDEX).write_text(json.dumps({'metrics': self.metrics}))
+        return root
+
+    @classmethod
+    def load(cls, root: Optional[Path] = None) -> 'PeerHistory':
+        root = Path.cwd() / 'peers_db' if root is None else Path(root)
+        return cls(storage.read(root / _VALUES),
+                   storage.read(root / _AGGREGATES),
+                   json.loads((root / _INDEX).read_text())['metrics'])
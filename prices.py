@@ -0,0 +1,371 @@
+"""Daily price history of the universe as memory-mapped arrays.
+
+PriceStore keeps each bar field (open, high, low, close & volume) as
+one dates x symbols float64 array in a raw binary file, rows in date
+order, beside the date axis & a json index of symbols. Arrays are
+memory-mapped, so any date range of any symbols is a slice of the
+file rather than a load of every symbol's history:
+
+    prices = PriceStore()
+    prices.update()                           # new bars since last run
+    prices.loc('2024-01-02', '2024-12-31', ['AAPL', 'MSFT'])
+    prices.frame(['ISRG'], start='2020-01-01')
+
+update() fetches TIME_SERIES_DAILY through the shared AVClient & only
+adds bars after each symbol's last stored date. AV's compact reply
+(the last COMPACT_BARS bars) is requested when that covers the gap,
+the full history otherwise. Bars after the last stored date are
+appended to the files in place; a new symbol or an earlier date
+writes a new generation of them. Either way the index is written last
+& is what makes the change count, so an interrupted update leaves the
+store as it was.
+
+Missing bars (before a symbol listed, after it was dropped, or days
+it did not trade) are NaN.
+
+Classes:
+PriceStore -- memory-mapped dates x symbols price arrays.
+
+Functions:
+parse_daily -- TIME_SERIES_DAILY response to a frame of bars.
+fetch_daily -- fetch a symbol's bars since a date.
+
+"""
+import datetime as dt
+import json
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional, Sequence, Union
+
+import numpy as np
+import polars as pl
+
+import storage
+from avclient import get_client
+from exceptions import AVResponseError
+
+FUNCTION = 'TIME_SERIES_DAILY'
+SERIES_KEY = 'Time Series (Daily)'
+# Bar fields & their keys in AV's reply.
+FIELDS = {
+    'open': '1. open',
+    'high': '2. high',
+    'low': '3. low',
+    'close': '4. close',
+    'volume': '5. volume',
+}
+BAR_SCHEMA = {'date': pl.Date, **{field: pl.Float64 for field in FIELDS}}
+# Bars in AV's compact reply; older gaps need the full history.
+COMPACT_BARS = 100
+
+_INDEX = 'index.json'
+_DATE = np.dtype('datetime64[D]')
+_VALUE = np.dtype(np.float64)
+
+Date = Union[str, dt.date, np.datetime64]
+
+
+def parse_daily(response: dict) -> pl.DataFrame:
+    """Return a TIME_SERIES_DAILY response as a BAR_SCHEMA frame,
+    oldest bar first.
+
+    Raises AVResponseError for error & notice replies.
+    """
+    series = response.get(SERIES_KEY)
+    if not series:
+        message = response.get('Error Message') \
+            or response.get('Information') or response.get('Note')
+        raise AVResponseError(message or f'No {FUNCTION} data.')
+    bars = list(series.values())
+    return pl.DataFrame({
+        'date': pl.Series(list(series), dtype=pl.String)
+        .str.to_date('%Y-%m-%d'),
+        **{field: pl.Series([bar[key] for bar in bars], dtype=pl.String)
+           .cast(pl.Float64) for field, key in FIELDS.items()},
+    }, schema=BAR_SCHEMA).sort('date')
+
+
+def fetch_daily(symbol: str, since: Optional[dt.date] = None,
+                today: Optional[dt.date] = None) -> pl.DataFrame:
+    """Fetch symbol's bars after since (all if None), with the compact
+    reply when it reaches back far enough.
+
+    """
+    today = dt.date.today() if today is None else today
+    compact = since is not None \
+        and np.busday_count(since, today) < COMPACT_BARS
+    bars = parse_daily(get_client().get(
+        FUNCTION, symbol, outputsize='compact' if compact else 'full'
+    ))
+    if since is not None:
+        bars = bars.filter(pl.col('date') > since)
+    return bars
+
+
+def _as_date(date: Date) -> np.datetime64:
+    return np.datetime64(date, 'D')
+
+
+class PriceStore:
+    """Dates x symbols arrays of daily bars; see the module docstring.
+
+    Files live in root (default cwd/price_db): dates.bin (the date
+    axis, datetime64[D]), <field>.bin per FIELDS & index.json (symbols,
+    row count, generation & each symbol's last stored date). Rebuilt
+    files are numbered by generation, e.g. close.3.bin; generation 0's
+    have no number.
+    """
+
+    def __init__(self, root: Optional[Path] = None):
+        self.root = Path.cwd() / 'price_db' if root is None else Path(root)
+        self._arrays = {}
+        path = self.root / _INDEX
+        index = json.loads(path.read_text()) if path.exists() else {}
+        self.symbols = index.get('symbols', [])
+        self.rows = index.get('rows', 0)
+        self.generation = index.get('generation', 0)
+        self.last = {symbol: dt.date.fromisoformat(date)
+                     for symbol, date in index.get('last', {}).items()}
+        self.symbol_index = {s: j for j, s in enumerate(self.symbols)}
+
+    def __repr__(self) -> str:
+        return f'PriceStore({self.rows} dates x {len(self.symbols)} symbols)'
+
+    def path(self, field: str, generation: Optional[int] = None) -> Path:
+        """Return field's file, of the current generation by default."""
+        generation = self.generation if generation is None else generation
+        stem = 'dates' if field == 'date' else field
+        return self.root / (f'{stem}.{generation}.bin' if generation
+                            else f'{stem}.bin')
+
+    def _map(self, field: str) -> np.ndarray:
+        # Read-only map of the first `rows` rows; files may be longer
+        # after an interrupted append.
+        if field not in self._arrays:
+            dtype = _DATE if field == 'date' else _VALUE
+            shape = (self.rows,) if field == 'date' \
+                else (self.rows, len(self.symbols))
+            if self.rows == 0:
+                self._arrays[field] = np.empty(shape, dtype)
+            else:
+                path = self.path(field)
+                row_bytes = dtype.itemsize * int(np.prod(shape[1:]))
+                size = path.stat().st_size
+                if size < self.rows * row_bytes or size % row_bytes:
+                    raise ValueError(
+                        f'{path} holds {size} bytes, not {self.rows} rows '
+                        f'of {row_bytes}; it does not match {_INDEX}.'
+                    )
+                self._arrays[field] = np.memmap(path, dtype, 'r',
+                                                shape=shape)
+        return self._arrays[field]
+
+    @property
+    def dates(self) -> np.ndarray:
+        """The date axis, datetime64[D], oldest first."""
+        return self._map('date')
+
+    def array(self, field: str = 'close') -> np.ndarray:
+        """Return field's whole dates x symbols array (memory-mapped)."""
+        if field not in FIELDS:
+            raise ValueError(f"Unknown field '{field}'; use one of "
+                             f"{', '.join(FIELDS)}.")
+        return self._map(field)
+
+    def rows_between(self, start: Optional[Date] = None,
+                     end: Optional[Date] = None) -> slice:
+        """Return the row slice of dates from start to end, inclusive."""
+        dates = self.dates
+        first = 0 if start is None \
+            else int(np.searchsorted(dates, _as_date(start), 'left'))
+        last = len(dates) if end is None \
+            else int(np.searchsorted(dates, _as_date(end), 'right'))
+        return slice(first, last)
+
+    def columns(self, symbols: Iterable[str]) -> np.ndarray:
+        return np.fromiter((self.symbol_index[s] for s in symbols),
+                           dtype=np.intp)
+
+    def loc(self, start: Optional[Date] = None, end: Optional[Date] = None,
+            symbols: Optional[Iterable[str]] = None,
+            field: str = 'close') -> np.ndarray:
+        """Return field's dates x symbols sub-array, start to end
+        inclusive (all dates & symbols if None); a view when symbols
+        is None.
+
+        """
+        array = self.array(field)[self.rows_between(start, end)]
+        return array if symbols is None else array[:, self.columns(symbols)]
+
+    def frame(self, symbols: Optional[Sequence[str]] = None,
+              start: Optional[Date] = None, end: Optional[Date] = None,
+              field: str = 'close') -> pl.DataFrame:
+        """Return `date` & one column per symbol for field."""
+        symbols = self.symbols if symbols is None else list(symbols)
+        rows = self.rows_between(start, end)
+        return pl.DataFrame({'date': self.dates[rows]}).hstack(
+            pl.DataFrame(self.loc(start, end, symbols, field),
+                         schema=symbols, orient='row')
+        )
+
+    def bars(self, symbol: str, start: Optional[Date] = None,
+             end: Optional[Date] = None) -> pl.DataFrame:
+        """Return one symbol's bars as a BAR_SCHEMA frame, dropping
+        dates it has no close for.
+
+        """
+        rows = self.rows_between(start, end)
+        column = self.symbol_index[symbol]
+        return pl.DataFrame({
+            'date': self.dates[rows],
+            **{field: self.array(field)[rows, column] for field in FIELDS},
+        }, schema=BAR_SCHEMA).filter(pl.col('close').is_not_nan())
+
+    def append(self, bars: dict) -> int:
+        """Store {symbol: BAR_SCHEMA frame} & return the bars added.
+
+        Bars on or before a symbol's last stored date are ignored.
+        """
+        bars = {
+            symbol: frame.filter(pl.col('date') > self.last[symbol])
+            if symbol in self.last else frame
+            for symbol, frame in bars.items()
+        }
+        bars = {s: frame for s, frame in bars.items() if frame.height}
+        if not bars:
+            return 0
+
+        new_dates = np.unique(np.concatenate([
+            frame['date'].to_numpy().astype(_DATE)
+            for frame in bars.values()
+        ]))
+        new_symbols = [s for s in bars if s not in self.symbol_index]
+        dates = self.dates
+        if new_symbols or (len(dates) and new_dates[0] <= dates[-1]
+                           and not np.isin(new_dates[new_dates <= dates[-1]],
+                                           dates).all()):
+            dates = self._rebuild(np.union1d(dates, new_dates),
+                                  self.symbols + new_symbols)
+        else:
+            dates = self._extend(new_dates[new_dates > dates[-1]]
+                                 if len(dates) else new_dates)
+
+        added = 0
+        for field in FIELDS:
+            array = np.memmap(self.path(field), _VALUE, 'r+',
+                              shape=(self.rows, len(self.symbols)))
+            for symbol, frame in bars.items():
+                rows = np.searchsorted(
+                    dates, frame['date'].to_numpy().astype(_DATE)
+                )
+                array[rows, self.symbol_index[symbol]] = \
+                    frame[field].to_numpy()
+            array.flush()
+            del array
+        for symbol, frame in bars.items():
+            self.last[symbol] = frame['date'].max()
+            added += frame.height
+        self._write_index()
+        return added
+
+    def _extend(self, dates: np.ndarray) -> np.ndarray:
+        # Append NaN rows for dates after the last, in place. Files are
+        # first cut back to the index's row count, dropping rows of an
+        # interrupted append.
+        row_bytes = len(self.symbols) * _VALUE.itemsize
+        self._arrays = {}
+        for field in ('date', *FIELDS):
+            size = self.rows * (_DATE.itemsize if field == 'date'
+                                else row_bytes)
+            with open(self.path(field), 'r+b') as f:
+                f.truncate(size)
+                f.seek(size)
+                if field == 'date':
+                    dates.astype(_DATE).tofile(f)
+                else:
+                    np.full((len(dates), len(self.symbols)),
+                            np.nan).tofile(f)
+        self.rows += len(dates)
+        return self.dates
+
+    def _rebuild(self, dates: np.ndarray, symbols: list) -> np.ndarray:
+        # Write every file for a new date axis & symbols, keeping the
+        # stored values, as the next generation. The index still names
+        # the current one, so an interruption before _write_index()
+        # leaves the store as it was.
+        self.root.mkdir(parents=True, exist_ok=True)
+        generation = self.generation + 1
+        positions = np.searchsorted(dates, self.dates)
+        for field in FIELDS:
+            array = np.full((len(dates), len(symbols)), np.nan)
+            array[positions, :len(self.symbols)] = self.array(field)
+            self._arrays.pop(field)
+            with storage.replacing(self.path(field, generation)) as tmp:
+                array.tofile(tmp)
+        with storage.replacing(self.path('date', generation)) as tmp:
+            dates.astype(_DATE).tofile(tmp)
+        self._arrays = {}
+        self.generation = generation
+        self.symbols = list(symbols)
+        self.symbol_index = {s: j for j, s in enumerate(self.symbols)}
+        self.rows = len(dates)
+        return self.dates
+
+    def _write_index(self) -> None:
+        # Written last, as the commit point: rows _extend() appended &
+        # a generation _rebuild() wrote count only once it lands.
+        # Values written into existing rows count at once, but only at
+        # dates after their symbol's stored last, so the next append
+        # writes them again.
+        self._arrays = {}
+        index = {
+            'symbols': self.symbols,
+            'rows': self.rows,
+            'generation': self.generation,
+            'last': {s: d.isoformat() for s, d in sorted(self.last.items())},
+            'updated_at': dt.datetime.now(dt.timezone.utc).isoformat(),
+        }
+        with storage.replacing(self.root / _INDEX) as tmp:
+            tmp.write_text(json.dumps(index))
+
+        # Earlier generations, & any of an interrupted rebuild, are no
+        # longer named by the index.
+        current = {self.path(field) for field in ('date', *FIELDS)}
+        for stem in ('dates', *FIELDS):
+            for path in self.root.glob(f'{stem}.*bin'):
+                if path not in current:
+                    path.unlink(missing_ok=True)
+
+    def update(self, symbols: Optional[Iterable[str]] = None,
+               concurrency: int = 8,
+               today: Optional[dt.date] = None) -> dict:
+        """Fetch & store every symbol's new bars & return a summary.
+
+        symbols defaults to the constituents. Symbols that fail are
+        skipped with a warning & listed in the summary.
+        """
+        if symbols is None:
+            from industries import sp500_constituents
+            constituents = sp500_constituents()
+            symbols = constituents.index[constituents.index.notna()]
+        symbols = [s.upper() for s in symbols]
+
+        bars, failed = {}, []
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = {
+                symbol: pool.submit(fetch_daily, symbol,
+                                    self.last.get(symbol), today)
+                for symbol in symbols
+            }
+            for symbol, future in futures.items():
+                try:
+                    bars[symbol] = future.result()
+                except Exception as e:
+                    warnings.warn(f'No prices for {symbol}: {e}')
+                    failed.append(symbol)
+        return {
+            'symbols': len(symbols),
+            'bars_added': self.append(bars),
+            'failed': failed,
+        }
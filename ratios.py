@@ -0,0 +1,281 @@
+"""Financial ratios computed from normalized statements.
+
+Ratios are polars expressions over a statement panel: the normalized
+income statement, balance sheet & cash-flow statement joined on
+(symbol, frequency, fy_end). compute_ratios() evaluates any set of them
+for every symbol & every fiscal period in one pass, so historical
+ratios for a whole universe cost no API calls once the statements are
+stored.
+
+Classes:
+Ratio -- a named ratio expression & the panel columns it reads.
+
+Functions:
+safe_div -- division that is null rather than inf for a 0 denominator.
+prior -- a column's value one year earlier, per symbol.
+latest -- keep each symbol's latest report.
+statement_panel -- join normalized statements into one panel.
+compute_ratios -- evaluate ratios over a panel.
+store_ratios -- evaluate ratios over a FundamentalsStore.
+
+"""
+from dataclasses import dataclass
+from typing import Iterable, Optional, Sequence, Union
+
+import polars as pl
+
+# Columns identifying one report in a panel.
+KEYS = ('symbol', 'frequency', 'fy_end')
+# Columns identifying one series of reports.
+GROUP = ('symbol', 'frequency')
+
+# Most days a report's fy_end may differ from exactly a year after the
+# one it is compared with, e.g. between 52- & 53-week fiscal years.
+PRIOR_TOLERANCE = 15
+
+Frame = Union[pl.DataFrame, pl.LazyFrame]
+
+
+@dataclass(frozen=True)
+class Ratio:
+    """A named ratio & the statement panel columns it reads.
+
+    columns lets callers read only what a set of ratios needs.
+    """
+    name: str
+    expr: pl.Expr
+    columns: tuple
+
+
+def safe_div(num: pl.Expr, den: pl.Expr) -> pl.Expr:
+    """Return num / den as Float64, null where den is 0 or missing."""
+    return (pl.when(den != 0)
+            .then(num.cast(pl.Float64) / den.cast(pl.Float64))
+            .otherwise(None))
+
+
+def prior(col: str) -> pl.Expr:
+    """Return col for the same period one year earlier: the report of
+    the same symbol & frequency ending a year (within PRIOR_TOLERANCE
+    days) before this one, null if there is none.
+
+    Reports are matched by fy_end, not position, so a missing quarter
+    or year gives null rather than another period's value.
+    """
+    target = pl.col('fy_end').dt.offset_by('-1y')
+    # A year back is 1 report back for annual ones & at most 4 for
+    # quarterly ones (fewer when quarters are missing).
+    return pl.coalesce([
+        pl.when((pl.col('fy_end').shift(lag) - target).dt.total_days().abs()
+                <= PRIOR_TOLERANCE)
+        .then(pl.col(col).shift(lag))
+        for lag in range(1, 5)
+    ]).over(GROUP, order_by='fy_end')
+
+
+def _average(col: str) -> pl.Expr:
+    # Average of opening & closing balance, or closing if no opening.
+    return ((pl.col(col) + prior(col).fill_null(pl.col(col))) / 2)
+
+
+def _growth(col: str) -> pl.Expr:
+    return safe_div(pl.col(col), prior(col)) - 1
+
+
+def _fcf() -> pl.Expr:
+    # AV reports capitalExpenditures as a positive outflow.
+    return pl.col('op_cf') - pl.col('capex').fill_null(0)
+
+
+def _tax_rate() -> pl.Expr:
+    return safe_div(pl.col('inc_tax_exp'), pl.col('pretax_inc')).clip(0, 1)
+
+
+_RATIOS = (
+    # Margins:
+    Ratio('gross_margin', safe_div(pl.col('gross_profit'), pl.col('tot_rev')),
+          ('gross_profit', 'tot_rev')),
+    Ratio('op_margin', safe_div(pl.col('op_inc'), pl.col('tot_rev')),
+          ('op_inc', 'tot_rev')),
+    Ratio('ebitda_margin', safe_div(pl.col('ebitda'), pl.col('tot_rev')),
+          ('ebitda', 'tot_rev')),
+    Ratio('net_margin', safe_div(pl.col('net_inc'), pl.col('tot_rev')),
+          ('net_inc', 'tot_rev')),
+    # Returns, on average balances:
+    Ratio('roe', safe_div(pl.col('net_inc'), _average('tot_SH_eq')),
+          ('net_inc', 'tot_SH_eq')),
+    Ratio('roa', safe_div(pl.col('net_inc'), _average('tot_asset')),
+          ('net_inc', 'tot_asset')),
+    Ratio('roic',
+          safe_div(pl.col('ebit') * (1 - _tax_rate().fill_null(0)),
+               pl.col('tot_debt').fill_null(0) + pl.col('tot_SH_eq')
+               - pl.col('cash').fill_null(0)),
+          ('ebit', 'inc_tax_exp', 'pretax_inc', 'tot_debt', 'tot_SH_eq',
+           'cash')),
+    # Leverage:
+    Ratio('debt_to_equity', safe_div(pl.col('tot_debt'), pl.col('tot_SH_eq')),
+          ('tot_debt', 'tot_SH_eq')),
+    Ratio('debt_to_assets', safe_div(pl.col('tot_debt'), pl.col('tot_asset')),
+          ('tot_debt', 'tot_asset')),
+    Ratio('equity_multiplier',
+          safe_div(pl.col('tot_asset'), pl.col('tot_SH_eq')),
+          ('tot_asset', 'tot_SH_eq')),
+    Ratio('net_debt_to_ebitda',
+          safe_div(pl.col('tot_debt') - pl.col('cash').fill_null(0),
+               pl.col('ebitda')),
+          ('tot_debt', 'cash', 'ebitda')),
+    Ratio('interest_coverage', safe_div(pl.col('ebit'), pl.col('int_exp')),
+          ('ebit', 'int_exp')),
+    # Liquidity:
+    Ratio('current_ratio',
+          safe_div(pl.col('tot_curr_asset'), pl.col('tot_curr_lblt')),
+          ('tot_curr_asset', 'tot_curr_lblt')),
+    Ratio('quick_ratio',
+          safe_div(pl.col('tot_curr_asset') - pl.col('inventory').fill_null(0),
+               pl.col('tot_curr_lblt')),
+          ('tot_curr_asset', 'inventory', 'tot_curr_lblt')),
+    Ratio('cash_ratio', safe_div(pl.col('cash'), pl.col('tot_curr_lblt')),
+          ('cash', 'tot_curr_lblt')),
+    # Cash flow:
+    Ratio('fcf', _fcf().cast(pl.Float64), ('op_cf', 'capex')),
+    Ratio('fcf_margin', safe_div(_fcf(), pl.col('tot_rev')),
+          ('op_cf', 'capex', 'tot_rev')),
+    # Market cap is the latest overview's, so only the latest period
+    # has a yield.
+    Ratio('fcf_yield',
+          pl.when(pl.col('fy_end') == pl.col('fy_end').max().over(GROUP))
+          .then(safe_div(_fcf(), pl.col('market_cap'))),
+          ('op_cf', 'capex', 'market_cap')),
+    # Year-over-year growth:
+    Ratio('rev_growth', _growth('tot_rev'), ('tot_rev',)),
+    Ratio('net_inc_growth', _growth('net_inc'), ('net_inc',)),
+    Ratio('ebitda_growth', _growth('ebitda'), ('ebitda',)),
+    Ratio('fcf_growth',
+          safe_div(_fcf(), prior('op_cf') - prior('capex').fill_null(0)) - 1,
+          ('op_cf', 'capex')),
+)
+
+RATIOS = {ratio.name: ratio for ratio in _RATIOS}
+
+
+def latest(frame: Frame) -> Frame:
+    """Keep each symbol's latest report of each frequency."""
+    return frame.filter(
+        pl.col('fy_end') == pl.col('fy_end').max().over(GROUP)
+    )
+
+
+def required_columns(names: Iterable[str]) -> list:
+    """Return the panel columns (beyond KEYS) the named ratios read."""
+    columns = []
+    for name in names:
+        for col in RATIOS[name].columns:
+            if col not in columns:
+                columns.append(col)
+    return columns
+
+
+def statement_panel(income: Frame, balance: Frame, cash_flow: Frame,
+                    overview: Optional[Frame] = None) -> pl.LazyFrame:
+    """Join normalized statements into one lazy panel on KEYS.
+
+    Frames from a single Stock (no symbol/frequency columns) are
+    treated as one symbol's annual reports. If overview is given, its
+    'Market Cap' is joined on symbol as market_cap; being the latest
+    snapshot, yields use it for the latest period only.
+    """
+    frames = []
+    for frame in (income, balance, cash_flow):
+        lf = with_keys(frame.lazy())
+        if frames:
+            # Keep each shared line item (e.g. net_inc) from the first
+            # statement that has it.
+            seen = set(frames[0].collect_schema().names())
+            for other in frames[1:]:
+                seen |= set(other.collect_schema().names())
+            lf = lf.select([
+                c for c in lf.collect_schema().names()
+                if c in KEYS or c not in seen
+            ])
+        frames.append(lf)
+
+    panel = frames[0]
+    for lf in frames[1:]:
+        panel = panel.join(lf, on=list(KEYS), how='full', coalesce=True)
+
+    if overview is not None:
+        panel = panel.join(
+            overview.lazy().select(
+                pl.col('symbol'),
+                pl.col('Market Cap').alias('market_cap'),
+            ),
+            on='symbol', how='left'
+        )
+    return panel
+
+
+def with_keys(lf: pl.LazyFrame) -> pl.LazyFrame:
+    """Add missing KEYS columns, as for a single Stock's annual
+    statements.
+
+    """
+    columns = lf.collect_schema().names()
+    defaults = {'symbol': pl.lit(None, dtype=pl.String),
+                'frequency': pl.lit('annual')}
+    return lf.with_columns(**{
+        key: value for key, value in defaults.items() if key not in columns
+    })
+
+
+def compute_ratios(panel: Frame,
+                   names: Optional[Sequence[str]] = None,
+                   keep: Sequence[str] = (),
+                   lazy: bool = False) -> Frame:
+    """Evaluate ratios for every row of a statement panel.
+
+    names defaults to every ratio whose columns the panel has. Returns
+    KEYS, any `keep` columns, then one Float64 column per ratio.
+    """
+    lf = with_keys(panel.lazy())
+    columns = set(lf.collect_schema().names())
+    if names is None:
+        names = [name for name, ratio in RATIOS.items()
+                 if columns.issuperset(ratio.columns)]
+
+    missing = set(required_columns(names)) - columns
+    if missing:
+        raise ValueError(f'Panel lacks columns {sorted(missing)} needed '
+                         f'for ratios {list(names)}.')
+
+    lf = lf.select(
+        *KEYS, *keep,
+        *[RATIOS[name].expr.cast(pl.Float64).alias(name) for name in names]
+    ).sort(KEYS)
+    return lf if lazy else lf.collect()
+
+
+def store_ratios(store, names: Optional[Sequence[str]] = None,
+                 frequency: Optional[str] = 'annual',
+                 lazy: bool = False) -> Frame:
+    """Evaluate ratios for every symbol & period in a FundamentalsStore.
+
+    Only the columns the ratios need are read from the store.
+    """
+    names = list(RATIOS) if names is None else list(names)
+    needed = set(required_columns(names))
+
+    def scan(fn):
+        lf = store.scan(fn)
+        if frequency is not None:
+            lf = lf.filter(pl.col('frequency') == frequency)
+        have = lf.collect_schema().names()
+        return lf.select(
+            *KEYS, 'sector', *[c for c in have if c in needed]
+        )
+
+    overview = None
+    if 'market_cap' in needed:
+        overview = store.scan('OVERVIEW').select('symbol', 'Market Cap')
+    panel = statement_panel(scan('INCOME_STATEMENT'), scan('BALANCE_SHEET'),
+                            scan('CASH_FLOW'), overview)
+    return compute_ratios(panel, names, keep=('sector',), lazy=lazy)
@@ -1,9 +1,315 @@
+"""Composite financial scores for a universe of stocks.
+
+FinancialScore evaluates Piotroski F, Altman Z, Beneish M & weighted
+factor scores as polars expressions over a statement panel (see
+ratios.statement_panel), so every symbol & period is scored in one
+pass. StockScore applies the same engine to a single Stock.
+
+Classes:
+FinancialScore -- batch scoring engine over a statement panel.
+StockScore -- Stock with its composite scores.
+
+"""
+from typing import Mapping, Optional, Sequence, Union
+
+import polars as pl
+
+import ratios
 from equity import Stock
+from ratios import KEYS, prior, safe_div
 
+Frame = Union[pl.DataFrame, pl.LazyFrame]
+
+# Panel columns read by the composite scores.
+COLUMNS = (
+    'tot_rev', 'gross_profit', 'sga', 'ebit', 'net_inc', 'net_inc_cont_ops',
+    'd_and_a', 'dd_and_a', 'tot_asset', 'tot_curr_asset', 'ppe', 'ar_net',
+    'tot_curr_lblt', 'lt_debt', 'tot_lblt', 'ret_earn', 'tot_SH_eq',
+    'comm_shares_out', 'op_cf', 'market_cap',
+)
+
+# Composite scores & their columns.
+SCORES = ('f_score', 'altman_z', 'beneish_m')
+
+# Factor weights for the default quality composite. Negative weights
+# favour low values.
+DEFAULT_WEIGHTS = {
+    'roic': 1.0,
+    'fcf_margin': 1.0,
+    'gross_margin': 0.5,
+    'rev_growth': 0.5,
+    'f_score': 0.5,
+    'net_debt_to_ebitda': -0.5,
+}
+
+# Cross-sectional z-scores are clipped to this many standard
+# deviations, so one outlier cannot dominate a factor score.
+Z_CLIP = 3.0
+
+
+def _col(name: str) -> pl.Expr:
+    return pl.col(name)
+
+
+# Per-report quantities the scores compare year over year. Computed
+# in a first pass so the second can take prior() of them.
+_BASE = {
+    # Piotroski:
+    '_roa': safe_div(_col('net_inc'), prior('tot_asset')),
+    '_leverage': safe_div(_col('lt_debt'), _col('tot_asset')),
+    '_current': safe_div(_col('tot_curr_asset'), _col('tot_curr_lblt')),
+    '_gross_margin': safe_div(_col('gross_profit'), _col('tot_rev')),
+    '_turnover': safe_div(_col('tot_rev'), _col('tot_asset')),
+    # Beneish:
+    '_receivable_days': safe_div(_col('ar_net'), _col('tot_rev')),
+    '_asset_quality': 1 - safe_div(
+        _col('tot_curr_asset') + _col('ppe'), _col('tot_asset')
+    ),
+    '_deprec_rate': safe_div(
+        pl.coalesce('d_and_a', 'dd_and_a'),
+        pl.coalesce('d_and_a', 'dd_and_a') + _col('ppe')
+    ),
+    '_sga_rate': safe_div(_col('sga'), _col('tot_rev')),
+    '_lt_leverage': safe_div(
+        _col('tot_curr_lblt') + _col('lt_debt').fill_null(0),
+        _col('tot_asset')
+    ),
+}
 
-class StockScore(Stock):
-    pass
+
+def _signal(condition: pl.Expr) -> pl.Expr:
+    # Missing data scores 0, as in Piotroski (2000).
+    return condition.fill_null(False).cast(pl.Int8)
+
+
+# Piotroski (2000) F-score signals; f_score is their sum.
+F_SIGNALS = {
+    'f_roa': _signal(_col('_roa') > 0),
+    'f_cfo': _signal(_col('op_cf') > 0),
+    'f_delta_roa': _signal(_col('_roa') > prior('_roa')),
+    'f_accrual': _signal(_col('op_cf') > _col('net_inc')),
+    'f_delta_leverage': _signal(_col('_leverage') < prior('_leverage')),
+    'f_delta_current': _signal(_col('_current') > prior('_current')),
+    'f_no_dilution': _signal(
+        _col('comm_shares_out') <= prior('comm_shares_out')
+    ),
+    'f_delta_margin': _signal(
+        _col('_gross_margin') > prior('_gross_margin')
+    ),
+    'f_delta_turnover': _signal(_col('_turnover') > prior('_turnover')),
+}
+
+
+def _altman_z() -> pl.Expr:
+    # Altman (1968) Z with market equity for each symbol's latest
+    # report, the only one the overview's market cap describes; the
+    # book-equity Z' (Altman 1983) for earlier reports.
+    assets = _col('tot_asset')
+    x1 = safe_div(_col('tot_curr_asset') - _col('tot_curr_lblt'), assets)
+    x2 = safe_div(_col('ret_earn'), assets)
+    x3 = safe_div(_col('ebit'), assets)
+    x5 = safe_div(_col('tot_rev'), assets)
+    market = safe_div(_col('market_cap'), _col('tot_lblt'))
+    book = safe_div(_col('tot_SH_eq'), _col('tot_lblt'))
+
+    is_latest = _col('fy_end') == _col('fy_end').max().over(ratios.GROUP)
+    z = 1.2 * x1 + 1.4 * x2 + 3.3 * x3 + 0.6 * market + 1.0 * x5
+    z_prime = (0.717 * x1 + 0.847 * x2 + 3.107 * x3 + 0.420 * book
+               + 0.998 * x5)
+    return (pl.when(is_latest & market.is_not_null())
+            .then(z).otherwise(z_prime))
+
+
+def _index(name: str, inverse: bool = False) -> pl.Expr:
+    # Beneish index: this year's value over last year's.
+    if inverse:
+        return safe_div(prior(name), _col(name))
+    return safe_div(_col(name), prior(name))
+
+
+def _beneish_m() -> pl.Expr:
+    # Beneish (1999) 8-variable M-score. Above about -1.78 suggests
+    # earnings manipulation.
+    accruals = safe_div(
+        pl.coalesce('net_inc_cont_ops', 'net_inc') - _col('op_cf'),
+        _col('tot_asset')
+    )
+    return (
+        -4.84
+        + 0.920 * _index('_receivable_days')
+        + 0.528 * _index('_gross_margin', inverse=True)
+        + 0.404 * _index('_asset_quality')
+        + 0.892 * _index('tot_rev')
+        + 0.115 * _index('_deprec_rate', inverse=True)
+        - 0.172 * _index('_sga_rate')
+        + 4.679 * accruals
+        - 0.327 * _index('_lt_leverage')
+    )
 
 
 class FinancialScore:
-    pass
+    """Composite scores for every symbol & period of a statement panel.
+
+    Scores are year-over-year, so annual panels need two consecutive
+    fiscal years & quarterly panels the same quarter a year earlier.
+    """
+
+    def __init__(self, panel: Frame):
+        self.panel = panel.lazy()
+
+    @classmethod
+    def from_store(cls, store, frequency: Optional[str] = 'annual',
+                   keep: Sequence[str] = ('sector',)) -> 'FinancialScore':
+        """Score every symbol in a FundamentalsStore, reading only the
+        columns the scores & ratios need.
+
+        """
+        needed = set(COLUMNS) | set(ratios.required_columns(ratios.RATIOS))
+
+        def scan(fn):
+            lf = store.scan(fn)
+            if frequency is not None:
+                lf = lf.filter(pl.col('frequency') == frequency)
+            have = lf.collect_schema().names()
+            return lf.select(*KEYS, *[c for c in have
+                                      if c in needed or c in keep])
+
+        return cls(ratios.statement_panel(
+            scan('INCOME_STATEMENT'), scan('BALANCE_SHEET'),
+            scan('CASH_FLOW'),
+            store.scan('OVERVIEW').select('symbol', 'Market Cap')
+        ))
+
+    def _scored(self) -> pl.LazyFrame:
+        lf = ratios.with_keys(self.panel)
+        have = lf.collect_schema().names()
+        lf = lf.with_columns(**{
+            # Absent line items score as missing data.
+            col: pl.lit(None, dtype=pl.Int64)
+            for col in COLUMNS if col not in have
+        })
+        return (
+            lf.with_columns(**_BASE)
+            .with_columns(**F_SIGNALS,
+                          altman_z=_altman_z(),
+                          beneish_m=_beneish_m())
+            .with_columns(f_score=pl.sum_horizontal(*F_SIGNALS)
+                          .cast(pl.Int8))
+        )
+
+    def _select(self, columns: Sequence[str], latest: bool,
+                lazy: bool) -> Frame:
+        lf = self._scored()
+        if latest:
+            lf = ratios.latest(lf)
+        lf = lf.select(*KEYS, *columns).sort(KEYS)
+        return lf if lazy else lf.collect()
+
+    def piotroski(self, detail: bool = False, latest: bool = False,
+                  lazy: bool = False) -> Frame:
+        """Return f_score (0-9), & each signal if detail=True."""
+        columns = ['f_score', *F_SIGNALS] if detail else ['f_score']
+        return self._select(columns, latest, lazy)
+
+    def altman_z(self, latest: bool = False, lazy: bool = False) -> Frame:
+        return self._select(['altman_z'], latest, lazy)
+
+    def beneish_m(self, latest: bool = False, lazy: bool = False) -> Frame:
+        return self._select(['beneish_m'], latest, lazy)
+
+    def scores(self, latest: bool = True, lazy: bool = False) -> Frame:
+        """Return every composite score, for each symbol's latest
+        report only by default.
+
+        """
+        return self._select(SCORES, latest, lazy)
+
+    def factor_score(self,
+                     weights: Mapping[str, float] = DEFAULT_WEIGHTS,
+                     by: Optional[Union[str, Sequence[str]]] = None,
+                     lazy: bool = False) -> Frame:
+        """Return a weighted composite of factors for each symbol's
+        latest report.
+
+        weights maps ratio (see ratios.RATIOS) or score names to
+        weights. Each factor is z-scored across symbols, within `by`
+        groups (e.g. 'sector') if given, clipped to +/-Z_CLIP & missing
+        values scored 0 before weighting. Returns KEYS, `by`, each
+        factor, its z-score & `factor_score`.
+        """
+        unknown = set(weights) - set(ratios.RATIOS) - set(SCORES)
+        if unknown:
+            raise ValueError(f'Unknown factors {sorted(unknown)}; use '
+                             f'ratios.RATIOS or {SCORES}.')
+        by = [by] if isinstance(by, str) else list(by or ())
+        total = sum(abs(w) for w in weights.values())
+
+        def zscore(name: str) -> pl.Expr:
+            mean, std = _col(name).mean(), _col(name).std()
+            if by:
+                mean, std = mean.over(by), std.over(by)
+            return (safe_div(_col(name) - mean, std)
+                    .clip(-Z_CLIP, Z_CLIP).fill_null(0))
+
+        lf = ratios.latest(self._scored().with_columns(**{
+            name: ratios.RATIOS[name].expr.cast(pl.Float64)
+            for name in weights if name in ratios.RATIOS
+        }))
+        lf = (
+            lf.select(*KEYS, *by, *weights)
+            .with_columns(**{f'{name} z': zscore(name) for name in weights})
+            .with_columns(factor_score=pl.sum_horizontal(
+                weight * _col(f'{name} z') for name, weight in weights.items()
+            ) / total)
+            .sort(['factor_score', 'symbol'], descending=[True, False],
+                  nulls_last=True)
+        )
+        return lf if lazy else lf.collect()
+
+    def rank(self, weights: Mapping[str, float] = DEFAULT_WEIGHTS,
+             by: Optional[Union[str, Sequence[str]]] = None) -> pl.DataFrame:
+        """Return symbols ranked by factor_score, best first, beside
+        their composite scores.
+
+        """
+        ranked = self.factor_score(weights, by).select(
+            *KEYS, 'factor_score'
+        ).with_row_index('rank', offset=1)
+        return ranked.join(self.scores(), on=list(KEYS), how='left')
+
+
+class StockScore(Stock):
+    """Stock with composite scores from its annual statements."""
+
+    def panel(self) -> pl.LazyFrame:
+        symbol = pl.lit(self.symbol).alias('symbol')
+        self.prefetch()
+        return ratios.statement_panel(
+            self.income_statement.with_columns(symbol),
+            self.balance_sheet.with_columns(symbol),
+            self.cash_flow_statement.with_columns(symbol),
+            self.overview.with_columns(symbol),
+        )
+
+    @property
+    def engine(self) -> FinancialScore:
+        return FinancialScore(self.panel())
+
+    def scores(self, latest: bool = False) -> pl.DataFrame:
+        """Return composite scores for each fiscal year (only the
+        latest if latest=True).
+
+        """
+        return self.engine.scores(latest=latest)
+
+    @property
+    def f_score(self) -> int:
+        return self.engine.scores()['f_score'].item()
+
+    @property
+    def altman_z(self) -> float:
+        return self.engine.scores()['altman_z'].item()
+
+    @property
+    def beneish_m(self) -> float:
+        return self.engine.scores()['beneish_m'].item()
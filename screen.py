@@ -0,0 +1,328 @@
+"""Stock screens over the fundamentals store.
+
+A screen is a comma-separated query of clauses; GICS names holding a
+comma (e.g. 'Oil, Gas & Consumable Fuels') are read whole:
+
+    screen('Health Care, ROE > 15%, net debt/EBITDA < 2, '
+           'last 3 fiscal years')
+
+GICS names -- a Sector, Industry Group, Industry or Sub-Industry name.
+    Names at one level are alternatives; levels must all match.
+Conditions -- `<ratio or overview metric> <op> <number>`, op one of
+    > >= < <= = != & number optionally suffixed %, x or K/M/B/T.
+    Ratios are ratios.RATIOS names, written loosely ('ROE',
+    'net debt/EBITDA', 'current ratio'); overview metrics use
+    fundamentals.Overview labels ('P/E', 'Market Cap').
+Period -- 'last N fiscal years' or 'last N quarters'; ratio
+    conditions must hold in each of a symbol's last N reports (default
+    the latest annual report).
+
+A screen runs as one lazy polars query over the FundamentalsStore:
+GICS clauses become symbol & `sector` partition filters on the scans,
+so only matching sector directories are read, & only the columns the
+conditions' ratios need are projected.
+
+Classes:
+Condition -- one threshold on a ratio or overview metric.
+Screen -- a parsed screen.
+
+Functions:
+parse -- parse a screen query.
+screen -- parse & run a screen query.
+
+"""
+import functools
+import operator
+import re
+from dataclasses import dataclass, field
+from typing import Optional
+
+import polars as pl
+
+import ratios
+import statements
+from cache import STATEMENT_FUNCTIONS
+from industries import LEVELS
+from ratios import GROUP, KEYS, RATIOS
+from store import FundamentalsStore
+
+OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+}
+
+SUFFIXES = {
+    '%': 0.01, 'x': 1, 'k': 1e3, 'm': 1e6, 'b': 1e9, 't': 1e12,
+}
+
+# Loose names for ratios, after _key().
+ALIASES = {
+    'operating_margin': 'op_margin',
+    'profit_margin': 'net_margin',
+    'revenue_growth': 'rev_growth',
+    'sales_growth': 'rev_growth',
+    'earnings_growth': 'net_inc_growth',
+    'free_cash_flow': 'fcf',
+    'free_cash_flow_yield': 'fcf_yield',
+    'free_cash_flow_margin': 'fcf_margin',
+    'd_to_e': 'debt_to_equity',
+    'debt_to_ebitda': 'net_debt_to_ebitda',
+}
+
+_CONDITION = re.compile(
+    r'^(?P<name>.+?)\s*(?P<op>>=|<=|==|!=|=|>|<)\s*'
+    r'(?P<value>-?\d+(?:\.\d+)?)\s*(?P<suffix>[%xXkKmMbBtT])?$'
+)
+_PERIOD = re.compile(
+    r'^(?:last|past)\s+(?P<n>\d+)\s+(?:fiscal\s+)?'
+    r'(?P<unit>years?|quarters?)$', re.IGNORECASE
+)
+
+
+def _key(name: str) -> str:
+    # 'net debt/EBITDA' -> 'net_debt_to_ebitda'
+    name = name.lower().replace('/', ' to ')
+    return re.sub(r'[^0-9a-z]+', '_', name).strip('_')
+
+
+@functools.lru_cache(maxsize=None)
+def _metrics() -> dict:
+    return {_key(f.name): f.name for f in statements.OVERVIEW_METRICS
+            if f.dtype in (pl.Int64, pl.Float64)}
+
+
+@functools.lru_cache(maxsize=None)
+def _gics_names() -> dict:
+    # {lowercase name: (level, name)}, broadest level first where
+    # names repeat across levels (e.g. 'Energy').
+    from industries import gics_index
+    index = gics_index()
+    names = {}
+    for level in LEVELS:
+        for name in sorted(index.names(level)):
+            names.setdefault(name.lower(), (level, name))
+    return names
+
+
+def _clauses(query: str) -> list:
+    # Split on commas, rejoining runs of pieces that make up a GICS
+    # name with commas in it, longest first.
+    names = _gics_names()
+    longest = 1 + max(name.count(',') for name in names)
+    pieces = [p.strip() for p in query.split(',')]
+    clauses, i = [], 0
+    while i < len(pieces):
+        n = next((n for n in range(min(longest, len(pieces) - i), 1, -1)
+                  if ', '.join(pieces[i:i + n]).lower() in names), 1)
+        clauses.append(', '.join(pieces[i:i + n]))
+        i += n
+    return [clause for clause in clauses if clause]
+
+
+@functools.lru_cache(maxsize=None)
+def gics_frame() -> pl.DataFrame:
+    """Return constituents' GICS classification with Enum columns.
+
+    One row per symbol; each level's Enum holds every GICS name at
+    that level, so filters compare integer codes.
+    """
+    from industries import gics_index, sp500_constituents
+    index = gics_index()
+    constituents = sp500_constituents()
+    constituents = constituents.loc[constituents.index.notna()]
+    return pl.DataFrame({
+        'symbol': constituents.index.to_list(),
+        **{
+            level: pl.Series(
+                constituents[level].to_list(),
+                dtype=pl.Enum(sorted(index.names(level)
+                                     | set(constituents[level])))
+            )
+            for level in LEVELS
+        },
+    })
+
+
+@dataclass(frozen=True)
+class Condition:
+    """A threshold on a ratio (see ratios.RATIOS) or overview metric."""
+    column: str
+    op: str
+    value: float
+
+    @property
+    def is_ratio(self) -> bool:
+        return self.column in RATIOS
+
+    def expr(self) -> pl.Expr:
+        return OPERATORS[self.op](pl.col(self.column), self.value)
+
+
+@dataclass
+class Screen:
+    """A parsed screen; see the module docstring for the query
+    syntax.
+
+    gics -- {GICS level: [names]}.
+    conditions -- Conditions every result must meet.
+    frequency -- 'annual' or 'quarterly' reports.
+    periods -- number of latest reports conditions must hold in.
+
+    """
+    gics: dict = field(default_factory=dict)
+    conditions: list = field(default_factory=list)
+    frequency: str = 'annual'
+    periods: int = 1
+
+    def symbols(self) -> Optional[list]:
+        """Return constituents matching the GICS clauses, or None if
+        there are none.
+
+        """
+        if not self.gics:
+            return None
+        lf = gics_frame().lazy().filter(*[
+            pl.col(level).is_in(names) for level, names in self.gics.items()
+        ])
+        return lf.select('symbol').collect()['symbol'].to_list()
+
+    def sectors(self) -> Optional[list]:
+        """Return the sectors the GICS clauses fall under, or None if
+        there are none.
+
+        """
+        if not self.gics:
+            return None
+        from industries import gics_index
+        index = gics_index()
+        sectors = None
+        for level, names in self.gics.items():
+            level_sectors = {index.ancestors(level, name)['Sector']
+                             for name in names}
+            sectors = level_sectors if sectors is None \
+                else sectors & level_sectors
+        return sorted(sectors)
+
+    def plan(self, store: Optional[FundamentalsStore] = None
+             ) -> pl.LazyFrame:
+        """Return the screen as a LazyFrame over the store."""
+        store = FundamentalsStore() if store is None else store
+        names = list(dict.fromkeys(
+            c.column for c in self.conditions if c.is_ratio
+        ))
+        metrics = list(dict.fromkeys(
+            c.column for c in self.conditions if not c.is_ratio
+        ))
+        needed = ratios.required_columns(names)
+        remaining = list(needed)
+        symbols, sectors = self.symbols(), self.sectors()
+
+        def scan(fn, columns=()):
+            lf = store.scan(fn)
+            if sectors is not None:
+                # Partition column: prunes whole sector directories.
+                lf = lf.filter(pl.col('sector').is_in(sectors))
+            if symbols is not None:
+                lf = lf.filter(pl.col('symbol').is_in(symbols))
+            if fn != 'OVERVIEW':
+                lf = lf.filter(pl.col('frequency') == self.frequency)
+            return lf.select(*columns)
+
+        # Read each needed line item from the first statement with it,
+        # & always the income statement for the reports themselves.
+        panel = None
+        for fn in STATEMENT_FUNCTIONS:
+            have = {f.name for f in statements.SCHEMAS[fn]}
+            columns = [c for c in remaining if c in have]
+            remaining = [c for c in remaining if c not in have]
+            if panel is None:
+                panel = scan(fn, (*KEYS, *columns))
+            elif columns:
+                panel = panel.join(scan(fn, (*KEYS, *columns)),
+                                   on=list(KEYS), how='left')
+
+        overview_columns = dict.fromkeys(
+            [*metrics, *(['Market Cap'] if 'market_cap' in needed else [])]
+        )
+        if overview_columns:
+            overview = scan('OVERVIEW', ('symbol', *overview_columns))
+            if 'market_cap' in needed:
+                overview = overview.with_columns(
+                    market_cap=pl.col('Market Cap')
+                )
+            panel = panel.join(overview, on='symbol', how='inner')
+
+        lf = (
+            ratios.compute_ratios(panel, names, keep=metrics, lazy=True)
+            .filter(pl.col('fy_end').rank('ordinal', descending=True)
+                    .over(GROUP) <= self.periods)
+        )
+        if self.conditions:
+            lf = lf.filter(
+                pl.all_horizontal(*[c.expr() for c in self.conditions])
+                .fill_null(False).all().over(GROUP)
+            )
+        return (
+            lf.filter(pl.len().over(GROUP) == self.periods)
+            .join(gics_frame().lazy(), on='symbol', how='left')
+            .select(*KEYS, *LEVELS, *names, *metrics)
+            .sort('symbol', 'fy_end')
+        )
+
+    def run(self, store: Optional[FundamentalsStore] = None
+            ) -> pl.DataFrame:
+        return self.plan(store).collect()
+
+
+def parse(query: str) -> Screen:
+    """Parse a screen query; see the module docstring for syntax."""
+    result = Screen()
+    for clause in _clauses(query):
+        gics = _gics_names().get(clause.lower())
+        if gics is not None:
+            level, name = gics
+            result.gics.setdefault(level, []).append(name)
+            continue
+
+        period = _PERIOD.match(clause)
+        if period is not None:
+            result.periods = int(period['n'])
+            result.frequency = 'quarterly' \
+                if period['unit'].lower().startswith('quarter') else 'annual'
+            continue
+
+        condition = _CONDITION.match(clause)
+        if condition is None:
+            raise ValueError(f'Cannot parse screen clause {clause!r}.')
+        key = _key(condition['name'])
+        key = ALIASES.get(key, key)
+        if key in RATIOS:
+            column = key
+        elif key in _metrics():
+            column = _metrics()[key]
+        else:
+            raise ValueError(
+                f'Unknown screen field {condition["name"]!r}; use a name '
+                f'in ratios.RATIOS or an overview metric.'
+            )
+        scale = SUFFIXES[(condition['suffix'] or 'x').lower()]
+        result.conditions.append(Condition(
+            column, condition['op'], float(condition['value']) * scale
+        ))
+    return result
+
+
+def screen(query: str,
+           store: Optional[FundamentalsStore] = None) -> pl.DataFrame:
+    """Run a screen query against the store (by default the one in
+    the working directory).
+
+    Returns KEYS, GICS levels & every screened ratio & metric, one row
+    per matching symbol & report.
+    """
+    return parse(query).run(store)
@@ -0,0 +1,332 @@
+"""Declarative schemas & normalization of AV statements & overviews.
+
+Each AV function has one schema: an ordered tuple of Fields giving the
+source field(s), canonical column name, dtype & null policy. normalize()
+applies a schema to raw AV data (live, cached or saved) in one lazy
+polars pass, so every statement of a type has the same columns & dtypes
+however it was obtained.
+
+Classes:
+Field -- one column of a statement schema.
+
+Functions:
+source_schema -- raw AV fields of a schema, all as strings.
+normalize -- apply the schema for an AV function to a raw frame.
+
+"""
+import functools
+from dataclasses import dataclass
+from typing import Sequence, Union
+
+import polars as pl
+
+import metrics
+
+# Strings AV uses for missing values.
+NULL_MARKERS = ('None', '-', '')
+
+
+@dataclass(frozen=True)
+class Field:
+    """One column of a statement schema.
+
+    source -- AV field name.
+    name -- canonical column name.
+    dtype -- polars dtype of the canonical column.
+    nulls -- 'keep' leaves missing values null, distinct from a
+        reported zero; 'zero' fills them with 0, for fields AV omits
+        when nothing happened (e.g. no dividends paid).
+    aliases -- older AV field names for the same item, used when
+        source is absent (e.g. in archived responses).
+
+    """
+    source: str
+    name: str
+    dtype: pl.DataType = pl.Int64
+    nulls: str = 'keep'
+    aliases: tuple = ()
+
+    def expr(self, columns: Sequence[str]) -> pl.Expr:
+        """Return the expression building this column from a raw frame
+        with the given columns.
+
+        """
+        sources = [c for c in (self.source, *self.aliases) if c in columns]
+        if not sources:
+            return pl.lit(None, dtype=self.dtype).alias(self.name)
+
+        raw = pl.coalesce([_null_markers(pl.col(c)) for c in sources])
+        if self.dtype == pl.Date:
+            value = raw.str.to_date('%Y-%m-%d', strict=False)
+        elif self.dtype == pl.String:
+            value = raw
+        else:
+            value = raw.cast(self.dtype, strict=False)
+
+        if self.nulls == 'zero':
+            value = value.fill_null(0)
+        return value.alias(self.name)
+
+
+def _null_markers(col: pl.Expr) -> pl.Expr:
+    col = col.cast(pl.String)
+    return pl.when(col.is_in(NULL_MARKERS)).then(None).otherwise(col)
+
+
+# Fields leading every statement.
+_PERIOD = (
+    Field('fiscalDateEnding', 'fy_end', pl.Date),
+    Field('reportedCurrency', 'report_currency', pl.String),
+)
+
+INCOME_STATEMENT = _PERIOD + (
+    Field('totalRevenue', 'tot_rev'),
+    Field('costOfRevenue', 'cost_rev'),
+    Field('costofGoodsAndServicesSold', 'cogs'),
+    Field('grossProfit', 'gross_profit'),
+    Field('sellingGeneralAndAdministrative', 'sga'),
+    Field('researchAndDevelopment', 'rnd'),
+    Field('operatingExpenses', 'op_exp',
+          aliases=('totalOperatingExpense',)),
+    Field('operatingIncome', 'op_inc'),
+    Field('investmentIncomeNet', 'invest_inc_net'),
+    Field('netInterestIncome', 'net_int_inc'),
+    Field('interestIncome', 'int_inc'),
+    Field('interestExpense', 'int_exp'),
+    Field('nonInterestIncome', 'non_int_inc'),
+    Field('otherNonOperatingIncome', 'oth_nonop_inc'),
+    Field('depreciation', 'deprec'),
+    Field('depreciationAndAmortization', 'd_and_a'),
+    Field('incomeBeforeTax', 'pretax_inc'),
+    Field('incomeTaxExpense', 'inc_tax_exp'),
+    Field('interestAndDebtExpense', 'int_debt_exp'),
+    Field('netIncomeFromContinuingOperations', 'net_inc_cont_ops'),
+    Field('comprehensiveIncomeNetOfTax', 'comp_inc_net_tax'),
+    Field('ebit', 'ebit'),
+    Field('ebitda', 'ebitda'),
+    Field('netIncome', 'net_inc'),
+)
+
+BALANCE_SHEET = _PERIOD + (
+    # ST Assets:
+    Field('cashAndCashEquivalentsAtCarryingValue', 'cash'),
+    Field('shortTermInvestments', 'st_invest'),
+    Field('cashAndShortTermInvestments', 'cash_st_invest'),
+    Field('currentNetReceivables', 'ar_net', aliases=('netReceivables',)),
+    Field('inventory', 'inventory'),
+    Field('otherCurrentAssets', 'oth_curr_asset'),
+    Field('totalCurrentAssets', 'tot_curr_asset'),
+    # LT Assets:
+    Field('propertyPlantEquipment', 'ppe'),
+    Field('accumulatedDepreciationAmortizationPPE', 'accum_deprec',
+          aliases=('accumulatedDepreciation',)),
+    Field('goodwill', 'gw'),
+    Field('intangibleAssets', 'intang_asset'),
+    Field('intangibleAssetsExcludingGoodwill', 'intang_asset_ex_gw'),
+    Field('investments', 'invest'),
+    Field('longTermInvestments', 'lt_invest'),
+    Field('otherNonCurrentAssets', 'oth_noncurr_asset',
+          aliases=('otherNonCurrrentAssets',)),
+    Field('totalNonCurrentAssets', 'tot_noncurr_asset'),
+    Field('totalAssets', 'tot_asset'),
+    # ST Lblts:
+    Field('currentAccountsPayable', 'ap', aliases=('accountsPayable',)),
+    Field('deferredRevenue', 'def_rev'),
+    Field('currentDebt', 'curr_debt'),
+    Field('shortTermDebt', 'st_debt'),
+    Field('currentLongTermDebt', 'curr_lt_debt'),
+    Field('otherCurrentLiabilities', 'oth_curr_lblt'),
+    Field('totalCurrentLiabilities', 'tot_curr_lblt'),
+    # LT Lblts:
+    Field('capitalLeaseObligations', 'cap_lease_obligation'),
+    Field('longTermDebt', 'lt_debt'),
+    Field('longTermDebtNoncurrent', 'lt_debt_noncurr',
+          aliases=('totalLongTermDebt',)),
+    Field('shortLongTermDebtTotal', 'tot_debt'),
+    Field('otherNonCurrentLiabilities', 'oth_noncurr_lblt'),
+    Field('totalNonCurrentLiabilities', 'tot_noncurr_lblt'),
+    Field('totalLiabilities', 'tot_lblt'),
+    # SH Equity:
+    Field('commonStock', 'comm_stock'),
+    Field('retainedEarnings', 'ret_earn'),
+    Field('treasuryStock', 'treasury_stock'),
+    Field('totalShareholderEquity', 'tot_SH_eq'),
+    Field('commonStockSharesOutstanding', 'comm_shares_out'),
+)
+
+CASH_FLOW = _PERIOD + (
+    # Operating:
+    Field('operatingCashflow', 'op_cf'),
+    Field('paymentsForOperatingActivities', 'op_payments'),
+    Field('proceedsFromOperatingActivities', 'op_proceeds'),
+    Field('changeInOperatingLiabilities', 'chg_op_lblt'),
+    Field('changeInOperatingAssets', 'chg_op_asset'),
+    Field('depreciationDepletionAndAmortization', 'dd_and_a'),
+    Field('changeInReceivables', 'chg_receivables'),
+    Field('changeInInventory', 'chg_inventory'),
+    Field('profitLoss', 'profit_loss'),
+    Field('netIncome', 'net_inc'),
+    # Investing:
+    Field('capitalExpenditures', 'capex'),
+    Field('cashflowFromInvestment', 'invest_cf'),
+    # Financing:
+    Field('proceedsFromRepaymentsOfShortTermDebt', 'st_debt_net_proceeds'),
+    Field('paymentsForRepurchaseOfCommonStock', 'comm_stock_repurchase',
+          nulls='zero'),
+    Field('paymentsForRepurchaseOfEquity', 'eq_repurchase', nulls='zero'),
+    Field('paymentsForRepurchaseOfPreferredStock', 'pref_stock_repurchase',
+          nulls='zero'),
+    Field('dividendPayout', 'div_payout', nulls='zero'),
+    Field('dividendPayoutCommonStock', 'div_payout_comm', nulls='zero'),
+    Field('dividendPayoutPreferredStock', 'div_payout_pref', nulls='zero'),
+    Field('proceedsFromIssuanceOfCommonStock', 'comm_stock_issue'),
+    Field('proceedsFromIssuanceOfLongTermDebtAndCapitalSecuritiesNet',
+          'lt_debt_issue_net'),
+    Field('proceedsFromIssuanceOfPreferredStock', 'pref_stock_issue'),
+    Field('proceedsFromRepurchaseOfEquity', 'eq_repurchase_proceeds'),
+    Field('proceedsFromSaleOfTreasuryStock', 'treasury_stock_sale'),
+    Field('cashflowFromFinancing', 'fin_cf'),
+    # Net:
+    Field('changeInCashAndCashEquivalents', 'chg_cash'),
+    Field('changeInExchangeRate', 'chg_fx'),
+)
+
+# Overview metadata keeps AV's field names; metrics use the display
+# labels of fundamentals.Overview. Per-share values & ratios are
+# Float64, counts & currency amounts Int64.
+OVERVIEW_METADATA = (
+    Field('Symbol', 'Symbol', pl.String),
+    Field('AssetType', 'AssetType', pl.String),
+    Field('Name', 'Name', pl.String),
+    Field('Description', 'Description', pl.String),
+    Field('CIK', 'CIK', pl.String),
+    Field('Exchange', 'Exchange', pl.String),
+    Field('Currency', 'Currency', pl.String),
+    Field('Country', 'Country', pl.String),
+    Field('Sector', 'Sector', pl.String),
+    Field('Industry', 'Industry', pl.String),
+    Field('Address', 'Address', pl.String),
+    Field('FullTimeEmployees', 'FullTimeEmployees'),
+    Field('FiscalYearEnd', 'FiscalYearEnd', pl.String),
+    Field('LatestQuarter', 'LatestQuarter', pl.Date),
+)
+
+OVERVIEW_METRICS = (
+    Field('MarketCapitalization', 'Market Cap'),
+    Field('EBITDA', 'EBITDA'),
+    Field('PERatio', 'P/E', pl.Float64),
+    Field('PEGRatio', 'PEG', pl.Float64),
+    Field('BookValue', 'BV', pl.Float64),
+    Field('DividendPerShare', 'DPS', pl.Float64),
+    Field('DividendYield', 'Div Yield', pl.Float64),
+    Field('EPS', 'EPS', pl.Float64),
+    Field('RevenuePerShareTTM', 'TTM RPS', pl.Float64),
+    Field('ProfitMargin', 'Net Prof Margin', pl.Float64),
+    Field('OperatingMarginTTM', 'TTM Op Margin', pl.Float64),
+    Field('ReturnOnAssetsTTM', 'TTM ROA', pl.Float64),
+    Field('ReturnOnEquityTTM', 'TTM ROE', pl.Float64),
+    Field('RevenueTTM', 'TTM Rev'),
+    Field('GrossProfitTTM', 'TTM Gross Prof'),
+    Field('DilutedEPSTTM', 'TTM Diluted EPS', pl.Float64),
+    Field('QuarterlyEarningsGrowthYOY', 'YOY Q Earnings Growth',
+          pl.Float64),
+    Field('QuarterlyRevenueGrowthYOY', 'YOY Q Rev Growth', pl.Float64),
+    Field('AnalystTargetPrice', 'Analyst Target Price', pl.Float64),
+    Field('TrailingPE', 'Trailing P/E', pl.Float64),
+    Field('ForwardPE', 'Forward P/E', pl.Float64),
+    Field('PriceToSalesRatioTTM', 'TTM P/S', pl.Float64),
+    Field('PriceToBookRatio', 'P/B', pl.Float64),
+    Field('EVToRevenue', 'EV/Rev', pl.Float64),
+    Field('EVToEBITDA', 'EV/EBITDA', pl.Float64),
+    Field('Beta', 'Beta', pl.Float64),
+    Field('52WeekHigh', '52 Wk High', pl.Float64),
+    Field('52WeekLow', '52 Wk Low', pl.Float64),
+    Field('50DayMovingAverage', 'SMA50', pl.Float64),
+    Field('200DayMovingAverage', 'SMA200', pl.Float64),
+    Field('SharesOutstanding', 'Shares Outstanding'),
+    Field('SharesFloat', 'Shares Float'),
+    Field('SharesShort', 'Shares Short'),
+    Field('SharesShortPriorMonth', 'Shares Short Prior Month'),
+    Field('ShortRatio', 'Short Ratio', pl.Float64),
+    Field('ShortPercentOutstanding', 'Short % Outstanding', pl.Float64),
+    Field('ShortPercentFloat', 'Short % Float', pl.Float64),
+    Field('PercentInsiders', '% Insiders', pl.Float64),
+    Field('PercentInstitutions', '% Institutions', pl.Float64),
+    Field('ForwardAnnualDividendRate', 'Fwd Ann Div Rate', pl.Float64),
+    Field('ForwardAnnualDividendYield', 'Fwd Annual Div Yield', pl.Float64),
+    Field('PayoutRatio', 'Payout Ratio', pl.Float64),
+    Field('DividendDate', 'Div Date', pl.Date),
+    Field('ExDividendDate', 'Ex-Div Date', pl.Date),
+    Field('LastSplitFactor', 'Last Split Factor', pl.String),
+    Field('LastSplitDate', 'Last Split Date', pl.Date),
+)
+
+OVERVIEW = OVERVIEW_METADATA + OVERVIEW_METRICS
+
+SCHEMAS = {
+    'OVERVIEW': OVERVIEW,
+    'INCOME_STATEMENT': INCOME_STATEMENT,
+    'BALANCE_SHEET': BALANCE_SHEET,
+    'CASH_FLOW': CASH_FLOW,
+}
+
+
+def _is_normalized(schema: Sequence[Field], columns: Sequence[str]) -> bool:
+    # Every canonical column & no source field.
+    columns = set(columns)
+    return (all(f.name in columns for f in schema)
+            and not any(f.source in columns for f in schema
+                        if f.source != f.name))
+
+
+@functools.lru_cache(maxsize=None)
+def source_schema(fn: str) -> dict:
+    """Return {AV field: pl.String} for every source field & alias
+    of the schema for AV function fn, the explicit schema raw AV
+    records are read with. The returned dict is shared; don't modify
+    it.
+
+    """
+    return {
+        source: pl.String
+        for field in SCHEMAS[fn.upper()]
+        for source in (field.source, *field.aliases)
+    }
+
+
+def normalize(frame: Union[pl.DataFrame, pl.LazyFrame],
+              fn: str,
+              keep: Sequence[str] = (),
+              lazy: bool = False) -> Union[pl.DataFrame, pl.LazyFrame]:
+    """Apply the schema for AV function fn to a raw frame.
+
+    Returns exactly the schema's columns, in schema order, after any
+    `keep` columns (e.g. 'symbol') passed through unchanged. Source
+    fields missing from frame become all-null columns; fields not in
+    the schema are dropped. Frames already normalized are returned
+    with the schema's columns. With lazy=True, return the LazyFrame.
+    """
+    fn = fn.upper()
+    schema = SCHEMAS[fn]
+    lf = frame.lazy()
+    dtypes = lf.collect_schema()
+    columns = dtypes.names()
+    if _is_normalized(schema, columns):
+        # e.g. a normalized statement read back from storage; text
+        # formats (NDJSON, json) give dates as strings.
+        fields = [
+            pl.col(f.name) if dtypes[f.name] == f.dtype
+            else pl.col(f.name).str.to_date('%Y-%m-%d', strict=False)
+            if f.dtype == pl.Date
+            else pl.col(f.name).cast(f.dtype, strict=False)
+            for f in schema
+        ]
+    else:
+        fields = [field.expr(columns) for field in schema]
+    lf = lf.select(*[pl.col(c) for c in keep if c in columns], *fields)
+    if lazy:
+        return lf
+    with metrics.registry.timer('normalize_seconds', fn=fn):
+        normalized = lf.collect()
+    metrics.registry.inc('normalize_rows_total', normalized.height, fn=fn)
+    return normalized
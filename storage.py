@@ -0,0 +1,217 @@
+"""Reading & writing frames in binary & text formats.
+
+The format is taken from the file suffix:
+
+    .parquet -- Parquet, compressed; the default for storage.
+    .arrow, .ipc, .feather -- Arrow IPC, uncompressed so reads are
+        memory-mapped & zero-copy.
+    .ndjson, .jsonl -- newline-delimited json, streamed.
+    .json -- a json array of records, for older dumps.
+
+Writes go to a temporary file beside the target that is then swapped
+in, so readers never see a partial file; replacing() does the same for
+files written any other way. Reads memory-map Parquet & IPC files:
+
+    storage.write(stock.income_statement, 'ISRG_is.arrow')
+    storage.read('ISRG_is.arrow')              # zero-copy
+    storage.scan('archive/*.parquet')          # lazy
+
+Classes:
+NDJSONWriter -- append frames to an NDJSON file as they arrive.
+
+Functions:
+format_of -- storage format of a path.
+replacing -- context manager writing a file atomically.
+write -- write a frame (or stream a LazyFrame) in a path's format.
+read -- read a file, memory-mapped where the format allows.
+scan -- lazily scan a file or glob.
+latest -- the newest readable file matching a pattern.
+
+"""
+import contextlib
+import os
+import threading
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+import polars as pl
+
+FORMATS = {
+    '.parquet': 'parquet',
+    '.arrow': 'ipc',
+    '.ipc': 'ipc',
+    '.feather': 'ipc',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.json': 'json',
+}
+
+Frame = Union[pl.DataFrame, pl.LazyFrame]
+
+
+def format_of(path: Union[str, Path]) -> str:
+    """Return 'parquet', 'ipc', 'ndjson' or 'json' for path's suffix.
+
+    Raises ValueError for other suffixes.
+    """
+    suffix = Path(path).suffix.lower()
+    try:
+        return FORMATS[suffix]
+    except KeyError:
+        raise ValueError(
+            f"Unknown storage format '{suffix}'; use one of "
+            f"{', '.join(FORMATS)}."
+        ) from None
+
+
+def _write(frame: Frame, path: Path, fmt: str, **kwargs) -> None:
+    if isinstance(frame, pl.LazyFrame):
+        # Streamed, so the frame is never held in memory whole.
+        if fmt == 'parquet':
+            frame.sink_parquet(path, **kwargs)
+        elif fmt == 'ipc':
+            frame.sink_ipc(path, **{'compression': 'uncompressed',
+                                    **kwargs})
+        elif fmt == 'ndjson':
+            frame.sink_ndjson(path, **kwargs)
+        else:
+            frame.collect().write_json(path)
+    elif fmt == 'parquet':
+        frame.write_parquet(path, **kwargs)
+    elif fmt == 'ipc':
+        frame.write_ipc(path, **{'compression': 'uncompressed', **kwargs})
+    elif fmt == 'ndjson':
+        frame.write_ndjson(path)
+    else:
+        frame.write_json(path)
+
+
+def _temporary(path: Path) -> Path:
+    # Beside path, so os.replace() is a rename on one file system, &
+    # unique to the writing thread.
+    return path.with_name(
+        f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp'
+    )
+
+
+@contextlib.contextmanager
+def replacing(path: Union[str, Path]) -> Iterator[Path]:
+    """Yield a temporary path to write instead of path, swapped in for
+    it once the block succeeds & removed if it fails.
+
+        with storage.replacing(root / 'values.bin') as tmp:
+            array.tofile(tmp)
+
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = _temporary(path)
+    try:
+        yield tmp
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def write(frame: Frame, path: Union[str, Path],
+          fmt: Optional[str] = None, **kwargs) -> Path:
+    """Write frame to path in fmt (default: from the suffix) & return
+    the path.
+
+    A LazyFrame is streamed to Parquet, IPC & NDJSON files without
+    being collected. kwargs go to the polars writer (e.g.
+    compression, or metadata for Parquet).
+    """
+    path = Path(path)
+    fmt = format_of(path) if fmt is None else fmt
+    with replacing(path) as tmp:
+        _write(frame, tmp, fmt, **kwargs)
+    return path
+
+
+def read(path: Union[str, Path], fmt: Optional[str] = None,
+         memory_map: bool = True, **kwargs) -> pl.DataFrame:
+    """Read a file written by write(), or any file in a known format.
+
+    Parquet & IPC files are memory-mapped unless memory_map=False;
+    uncompressed IPC columns then point into the mapped file rather
+    than being copied. kwargs go to the polars reader (e.g. columns).
+    """
+    path = Path(path)
+    fmt = format_of(path) if fmt is None else fmt
+    if fmt == 'parquet':
+        return pl.read_parquet(path, memory_map=memory_map, **kwargs)
+    if fmt == 'ipc':
+        # polars maps IPC files itself; bytes read up front are not.
+        source = path if memory_map else path.read_bytes()
+        return pl.read_ipc(source, **kwargs)
+    if fmt == 'ndjson':
+        return pl.read_ndjson(path, **kwargs)
+    return pl.read_json(path, **kwargs)
+
+
+def scan(source: Union[str, Path], fmt: Optional[str] = None,
+         **kwargs) -> pl.LazyFrame:
+    """Lazily scan a file or glob, so filters & column selections are
+    pushed down into the read.
+
+    """
+    fmt = format_of(source) if fmt is None else fmt
+    if fmt == 'parquet':
+        return pl.scan_parquet(source, **kwargs)
+    if fmt == 'ipc':
+        return pl.scan_ipc(source, **kwargs)
+    if fmt == 'ndjson':
+        return pl.scan_ndjson(source, **kwargs)
+    return pl.read_json(source, **kwargs).lazy()
+
+
+def latest(folder: Union[str, Path], pattern: str) -> Optional[Path]:
+    """Return the last, by name, file in folder matching the glob
+    pattern in a readable format, or None.
+
+    With dates in file names (e.g. ISRG_is_2025-04-11.parquet) that
+    is the newest.
+    """
+    paths = sorted(
+        path for path in Path(folder).glob(pattern)
+        if path.suffix.lower() in FORMATS
+    )
+    return paths[-1] if paths else None
+
+
+class NDJSONWriter:
+    """Append frames to an NDJSON file as they arrive, e.g. batches of
+    a bulk fetch, without holding them all in memory.
+
+    The file appears at path once the writer is closed:
+
+        with NDJSONWriter('overviews.ndjson') as writer:
+            for frame in frames:
+                writer.write(frame)
+
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        # Closing the file, then swapping it in (or removing it on an
+        # error), is left to the stack.
+        self._stack = contextlib.ExitStack()
+        tmp = self._stack.enter_context(replacing(self.path))
+        self._file = self._stack.enter_context(open(tmp, 'wb'))
+        self.rows = 0
+
+    def write(self, frame: pl.DataFrame) -> None:
+        frame.write_ndjson(self._file)
+        self.rows += frame.height
+
+    def close(self) -> Path:
+        self._stack.close()
+        return self.path
+
+    def __enter__(self) -> 'NDJSONWriter':
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        # On an error, leave no partial file behind.
+        self._stack.__exit__(exc_type, exc, tb)
@@ -0,0 +1,391 @@
+"""Universe-wide store of normalized fundamentals.
+
+Statements for every constituent live in one hive-partitioned Parquet
+dataset, one file per symbol:
+
+    <root>/statement=<FUNCTION>/sector=<Sector>/<SYMBOL>.parquet
+
+Each file holds the symbol's normalized annual & quarterly reports
+(see statements.normalize), tagged with `symbol` & `frequency`
+columns & the `snapshot` date the data was fetched (or dumped) on.
+OVERVIEW files hold the latest overview snapshot. A report from a
+newer snapshot replaces the stored one. A manifest
+records each symbol's latest reported quarter, so a refresh spends
+quota only on companies that reported a new period since the last run.
+
+Classes:
+FundamentalsStore -- partitioned Parquet store with incremental refresh.
+
+Functions:
+universe -- the constituents & their sectors.
+
+"""
+import datetime as dt
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, Optional, Sequence
+
+import polars as pl
+
+import storage
+from batch import fetch_many
+from cache import REPORT_KEYS
+from cache import STATEMENT_FUNCTIONS
+from cache import response_frame
+from equity import AVRequest
+from exceptions import AVResponseError
+from statements import normalize
+
+MANIFEST_SCHEMA = {
+    'symbol': pl.String,
+    'sector': pl.String,
+    'latest_quarter': pl.Date,
+    'refreshed_at': pl.Datetime('us', 'UTC'),
+}
+
+# Columns identifying one report of a symbol's statement.
+REPORT_KEY = ('frequency', 'fy_end')
+
+# Partition for symbols outside the universe, e.g. former constituents
+# in archived dumps (see importer.py).
+UNKNOWN_SECTOR = 'Unknown'
+
+
+def _today() -> dt.date:
+    return dt.datetime.now(dt.timezone.utc).date()
+
+
+def _snapshot(frame: pl.DataFrame) -> pl.Expr:
+    # Its snapshot column; null for files written before they had one.
+    return pl.col('snapshot') if 'snapshot' in frame.columns \
+        else pl.lit(None, dtype=pl.Date)
+
+
+def _write(frame: pl.DataFrame, path: Path) -> None:
+    # Atomic, so readers never see a partially written file.
+    storage.write(frame, path)
+
+
+def universe() -> pl.DataFrame:
+    """Return the constituents' `symbol` & `sector`."""
+    # Deferred: industries reads its CSVs with pandas on first use.
+    from industries import sp500_constituents
+    constituents = sp500_constituents()
+    constituents = constituents.loc[constituents.index.notna()]
+    return pl.DataFrame({
+        'symbol': constituents.index.to_list(),
+        'sector': constituents['Sector'].to_list(),
+    })
+
+
+class FundamentalsStore:
+    """Partitioned Parquet store of normalized fundamentals.
+
+    refresh() fills the store for a universe of symbols (by default
+    the S&P 500 constituents) & on later runs refetches only symbols
+    whose overview LatestQuarter is newer than the one stored,
+    adding fiscal periods not already stored & replacing stored ones
+    with the newer snapshot.
+
+    """
+
+    def __init__(self, root: Optional[Path] = None):
+        self.root = Path.cwd() / 'fundamentals_db' if root is None \
+            else Path(root)
+        # Manifest updates read, modify & rewrite the whole file.
+        self._manifest_lock = threading.Lock()
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.root / '_manifest.parquet'
+
+    def path(self, fn: str, sector: str, symbol: str) -> Path:
+        return (self.root / f'statement={fn.upper()}' / f'sector={sector}'
+                / f'{symbol.upper()}.parquet')
+
+    def manifest(self) -> pl.DataFrame:
+        if not self.manifest_path.exists():
+            return pl.DataFrame(schema=MANIFEST_SCHEMA)
+        # Read in one go: polars opens a path more than once, & a
+        # concurrent update may replace the file in between.
+        return pl.read_parquet(self.manifest_path.read_bytes())
+
+    def scan(self, fn: str) -> pl.LazyFrame:
+        """Lazily scan one statement type across every sector.
+
+        `sector` is read from the partition path, so filters on it
+        skip whole directories.
+        """
+        return pl.scan_parquet(
+            self.root / f'statement={fn.upper()}' / '**' / '*.parquet',
+            hive_partitioning=True,
+            # Files written before `snapshot` existed lack it.
+            missing_columns='insert', extra_columns='ignore',
+        )
+
+    def read(self, fn: str, symbols: Optional[Iterable[str]] = None,
+             frequency: Optional[str] = 'annual') -> pl.DataFrame:
+        lf = self.scan(fn)
+        if symbols is not None:
+            lf = lf.filter(pl.col('symbol').is_in(list(symbols)))
+        if frequency is not None and fn.upper() in STATEMENT_FUNCTIONS:
+            lf = lf.filter(pl.col('frequency') == frequency)
+        return lf.collect()
+
+    def _merge(self, fn: str, sector: str, symbol: str,
+               new: pl.DataFrame) -> int:
+        # Add reports whose key ((frequency, fy_end), or symbol for
+        # an overview) is not stored yet & replace stored ones from an
+        # older snapshot; rows without a snapshot count as oldest &
+        # never replace. Returns the number of rows added.
+        path = self.path(fn, sector, symbol)
+        for stale in self.root.glob(f'statement={fn.upper()}/sector=*/'
+                                    f'{symbol.upper()}.parquet'):
+            if stale != path:
+                # Symbol was reclassified into another sector.
+                stale.unlink()
+
+        if not path.exists():
+            _write(new, path)
+            return new.height
+
+        statement = fn.upper() in STATEMENT_FUNCTIONS
+        key = list(REPORT_KEY) if statement else ['symbol']
+        stored = pl.read_parquet(path)
+        incoming = new.with_columns(_new=_snapshot(new)).join(
+            stored.select(*key, _stored=_snapshot(stored),
+                          _found=pl.lit(True)),
+            on=key, how='left', nulls_equal=True
+        )
+        found = pl.col('_found').fill_null(False)
+        newer = (pl.col('_new') > pl.col('_stored').fill_null(dt.date.min)) \
+            .fill_null(False)
+        added = incoming.filter(~found).drop('_new', '_stored', '_found')
+        replacing = incoming.filter(found & newer) \
+            .drop('_new', '_stored', '_found')
+        if added.height or replacing.height:
+            merged = pl.concat([
+                stored.join(replacing.select(key), on=key, how='anti',
+                            nulls_equal=True),
+                replacing,
+                added,
+            ], how='diagonal_relaxed')
+            if statement:
+                merged = merged.sort(REPORT_KEY, descending=[False, True])
+            _write(merged, path)
+        return added.height
+
+    def _statement_frame(self, fn: str, symbol: str,
+                         response: dict) -> pl.DataFrame:
+        frames = [
+            normalize(
+                response_frame(fn, response, frequency)
+                .with_columns(symbol=pl.lit(symbol),
+                              frequency=pl.lit(frequency),
+                              snapshot=pl.lit(_today())),
+                fn, keep=('symbol', 'frequency', 'snapshot')
+            )
+            for frequency in REPORT_KEYS
+        ]
+        return pl.concat(frames)
+
+    def ingest(self, frames: dict, sectors: Optional[dict] = None,
+               workers: Optional[int] = None) -> int:
+        """Merge normalized frames of many symbols into the store &
+        return the number of rows added.
+
+        frames -- {AV function: frame}, each frame with a `symbol`
+            column, `frequency` for statements & optionally `snapshot`.
+        sectors -- {symbol: sector} partitions; by default the
+            universe's, with other symbols under UNKNOWN_SECTOR.
+        workers -- threads writing symbols' files concurrently.
+
+        Reports not yet stored are added, & stored ones (overviews
+        included) are replaced by those of a newer snapshot; rows
+        without a snapshot replace nothing. Only added rows are
+        counted. Symbols given every statement get a
+        manifest entry at the earliest of their statements' latest
+        quarters, unless the manifest already has a later one.
+        """
+        if sectors is None:
+            sectors = dict(universe().iter_rows())
+        sectors = {
+            symbol: sectors.get(symbol, UNKNOWN_SECTOR)
+            for frame in frames.values()
+            for symbol in frame['symbol'].unique()
+        }
+
+        def merge(fn, symbol, part):
+            return self._merge(fn, sectors[symbol], symbol, part)
+
+        # Each symbol's files are separate, so are merged concurrently.
+        tasks = [
+            (fn, symbol, part)
+            for fn, frame in frames.items()
+            for (symbol,), part in frame.partition_by(
+                'symbol', as_dict=True).items()
+        ]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            rows_added = sum(pool.map(lambda task: merge(*task), tasks))
+
+        if all(fn in frames for fn in STATEMENT_FUNCTIONS):
+            latest = (
+                pl.concat([
+                    frames[fn].filter(pl.col('frequency') == 'quarterly')
+                    .group_by('symbol').agg(pl.col('fy_end').max())
+                    for fn in STATEMENT_FUNCTIONS
+                ])
+                .group_by('symbol')
+                .agg(pl.col('fy_end').min().alias('LatestQuarter'),
+                     pl.len().alias('statements'))
+                .filter(pl.col('statements') == len(STATEMENT_FUNCTIONS))
+                .join(self.manifest(), on='symbol', how='left')
+                .filter(pl.col('latest_quarter').is_null()
+                        | (pl.col('LatestQuarter')
+                           > pl.col('latest_quarter')))
+            )
+            if latest.height:
+                self._update_manifest(latest, sectors)
+        return rows_added
+
+    def stale_symbols(self, overviews: pl.DataFrame) -> list:
+        """Return symbols whose overview reports a newer LatestQuarter
+        than the manifest, or which are not stored yet.
+
+        overviews needs `symbol` & `LatestQuarter` (Date) columns.
+        """
+        return (
+            overviews.select('symbol', 'LatestQuarter')
+            .join(self.manifest().select('symbol', 'latest_quarter'),
+                  on='symbol', how='left')
+            .filter(pl.col('latest_quarter').is_null()
+                    | (pl.col('LatestQuarter') > pl.col('latest_quarter'))
+                    | pl.col('LatestQuarter').is_null())
+            ['symbol'].to_list()
+        )
+
+    def refresh(self,
+                symbols: Optional[Sequence[str]] = None,
+                statements: Sequence[str] = STATEMENT_FUNCTIONS,
+                concurrency: int = 8,
+                force: bool = False) -> dict:
+        """Bring the store up to date & return a summary.
+
+        Fetches every symbol's overview (cached daily), then every
+        statement only for symbols that reported a new quarter (or all
+        of them if force=True).
+        """
+        members = universe()
+        if symbols is not None:
+            symbols = [s.upper() for s in symbols]
+            members = members.filter(pl.col('symbol').is_in(symbols))
+        sectors = dict(members.iter_rows())
+
+        raw_overviews = fetch_many(
+            'OVERVIEW', sectors, concurrency=concurrency,
+            output_format='polars', return_exceptions=True
+        )
+        overviews = []
+        for symbol, raw_ov in raw_overviews.items():
+            if isinstance(raw_ov, Exception):
+                warnings.warn(f'No overview for {symbol}: {raw_ov}')
+                continue
+            overviews.append(normalize(
+                raw_ov.with_columns(symbol=pl.lit(symbol),
+                                    snapshot=pl.lit(_today())),
+                'OVERVIEW', keep=('symbol', 'snapshot')
+            ))
+        if not overviews:
+            return {'symbols': 0, 'refreshed': [], 'rows_added': 0}
+        overviews = pl.concat(overviews, how='diagonal_relaxed')
+
+        stale = overviews['symbol'].to_list() if force \
+            else self.stale_symbols(overviews)
+
+        rows_added = 0
+        refreshed = set(stale)
+        for fn in statements:
+            responses = fetch_many(
+                fn, stale, concurrency=concurrency, return_exceptions=True
+            )
+            for symbol, response in responses.items():
+                if (isinstance(response, Exception)
+                        or REPORT_KEYS['annual'] not in response):
+                    warnings.warn(f'No {fn} for {symbol}: {response}')
+                    refreshed.discard(symbol)
+                    continue
+                rows_added += self._merge(
+                    fn, sectors[symbol], symbol,
+                    self._statement_frame(fn, symbol, response)
+                )
+
+        for (symbol,), ov in overviews.partition_by('symbol',
+                                                    as_dict=True).items():
+            self._merge('OVERVIEW', sectors[symbol], symbol, ov)
+
+        self._update_manifest(
+            overviews.filter(pl.col('symbol').is_in(list(refreshed))),
+            sectors
+        )
+        return {
+            'symbols': overviews.height,
+            'refreshed': sorted(refreshed),
+            'rows_added': rows_added,
+        }
+
+    def refresh_symbol(self, symbol: str, sector: str,
+                       statements: Sequence[str] = STATEMENT_FUNCTIONS,
+                       force: bool = False) -> dict:
+        """Bring one symbol up to date as refresh() does & return
+        whether its statements were refetched & the rows added.
+
+        Safe to call for different symbols from several threads.
+        Raises AVResponseError if a response has no data.
+        """
+        symbol = symbol.upper()
+        overview = normalize(
+            AVRequest('OVERVIEW', symbol).output('polars')
+            .with_columns(symbol=pl.lit(symbol), snapshot=pl.lit(_today())),
+            'OVERVIEW', keep=('symbol', 'snapshot')
+        )
+        stale = force or bool(self.stale_symbols(overview))
+        rows_added = 0
+        if stale:
+            for fn in statements:
+                response = AVRequest(fn, symbol).output('json')
+                if REPORT_KEYS['annual'] not in response:
+                    raise AVResponseError(f'No {fn} for {symbol}: '
+                                          f'{response}')
+                rows_added += self._merge(
+                    fn, sector, symbol,
+                    self._statement_frame(fn, symbol, response)
+                )
+        self._merge('OVERVIEW', sector, symbol, overview)
+        if stale:
+            self._update_manifest(overview, {symbol: sector})
+        return {'refreshed': stale, 'rows_added': rows_added}
+
+    def _update_manifest(self, overviews: pl.DataFrame,
+                         sectors: dict) -> None:
+        with self._manifest_lock:
+            self._write_manifest(overviews, sectors)
+
+    def _write_manifest(self, overviews: pl.DataFrame,
+                        sectors: dict) -> None:
+        now = dt.datetime.now(dt.timezone.utc)
+        updates = overviews.select(
+            pl.col('symbol'),
+            pl.col('symbol').replace_strict(sectors, return_dtype=pl.String)
+            .alias('sector'),
+            pl.col('LatestQuarter').alias('latest_quarter'),
+            pl.lit(now, dtype=MANIFEST_SCHEMA['refreshed_at'])
+            .alias('refreshed_at'),
+        )
+        manifest = pl.concat([
+            self.manifest().join(updates.select('symbol'), on='symbol',
+                                 how='anti'),
+            updates,
+        ])
+        _write(manifest.sort('symbol'), self.manifest_path)
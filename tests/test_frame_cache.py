@@ -0,0 +1,154 @@
+import datetime as dt
+import threading
+
+import polars as pl
+
+import cache
+from cache import FrameCache
+
+
+def _frame(rows: int = 100) -> pl.DataFrame:
+    return pl.DataFrame({'value': pl.Series(range(rows), dtype=pl.Int64)})
+
+
+SIZE = _frame().estimated_size()
+
+
+def test_hit_returns_equal_frame():
+    frames = FrameCache()
+    frame = _frame()
+    assert frames.put('isrg', 'income_statement', frame, 'annual')
+    assert frames.get('ISRG', 'INCOME_STATEMENT', 'annual').equals(frame)
+    assert frames.get('ISRG', 'INCOME_STATEMENT', 'quarterly') is None
+    assert frames.stats()['hits'] == 1
+    assert frames.stats()['misses'] == 1
+
+
+def test_evicts_least_recently_used_within_budget():
+    frames = FrameCache(max_bytes=3 * SIZE)
+    for symbol in ('A', 'B', 'C'):
+        frames.put(symbol, 'OVERVIEW', _frame())
+    frames.get('A', 'OVERVIEW')  # B is now the least recently used
+    frames.put('D', 'OVERVIEW', _frame())
+
+    assert frames.get('B', 'OVERVIEW') is None
+    assert all(frames.get(s, 'OVERVIEW') is not None for s in 'ACD')
+    stats = frames.stats()
+    assert stats['evictions'] == 1
+    assert stats['frames'] == 3
+    assert stats['bytes'] == 3 * SIZE <= stats['max_bytes']
+
+
+def test_larger_frame_evicts_several():
+    frames = FrameCache(max_bytes=3 * SIZE)
+    for symbol in ('A', 'B', 'C'):
+        frames.put(symbol, 'OVERVIEW', _frame())
+    big = _frame(250)
+    assert frames.put('D', 'OVERVIEW', big)
+    assert frames.stats()['bytes'] <= 3 * SIZE
+    assert frames.get('A', 'OVERVIEW') is None
+    assert frames.get('D', 'OVERVIEW').equals(big)
+
+
+def test_frame_over_budget_is_not_kept():
+    frames = FrameCache(max_bytes=SIZE)
+    frames.put('A', 'OVERVIEW', _frame())
+    assert not frames.put('B', 'OVERVIEW', _frame(1000))
+    assert frames.get('B', 'OVERVIEW') is None
+    # Nothing was evicted for it.
+    assert frames.get('A', 'OVERVIEW') is not None
+
+
+def test_replacing_an_entry_keeps_bytes_exact():
+    frames = FrameCache()
+    frames.put('A', 'OVERVIEW', _frame())
+    frames.put('A', 'OVERVIEW', _frame(10))
+    assert frames.stats()['bytes'] == _frame(10).estimated_size()
+    assert len(frames) == 1
+
+
+def test_other_version_misses():
+    frames = FrameCache()
+    frames.put('A', 'CASH_FLOW', _frame(), 'annual', version=('a.json', 1))
+    assert frames.get('A', 'CASH_FLOW', 'annual', ('a.json', 2)) is None
+    # The stale entry is dropped on the miss.
+    assert frames.get('A', 'CASH_FLOW', 'annual', ('a.json', 1)) is None
+    assert frames.stats() == {
+        'hits': 0, 'misses': 2, 'hit_rate': 0.0, 'evictions': 0,
+        'frames': 0, 'bytes': 0, 'max_bytes': frames.max_bytes,
+    }
+
+
+def test_sources_are_kept_apart():
+    frames = FrameCache()
+    version = ('IBM_is_1.json', 1)
+    frames.put('IBM', 'INCOME_STATEMENT', _frame(), 'annual')
+    frames.put('IBM', 'INCOME_STATEMENT', _frame(10), 'annual', version,
+               source='dump')
+    assert len(frames) == 2
+    for _ in range(2):
+        assert frames.get('IBM', 'INCOME_STATEMENT', 'annual').height == 100
+        assert frames.get('IBM', 'INCOME_STATEMENT', 'annual', version,
+                          source='dump').height == 10
+    assert frames.stats()['misses'] == 0
+    assert frames.invalidate(symbol='IBM') == 2
+
+
+def test_expired_entry_misses(monkeypatch):
+    now = dt.datetime(2025, 1, 2, tzinfo=dt.timezone.utc)
+    monkeypatch.setattr(cache, '_now', lambda: now)
+    frames = FrameCache()
+    frames.put('A', 'OVERVIEW', _frame())
+
+    now += cache.TTL['OVERVIEW'] - dt.timedelta(seconds=1)
+    assert frames.get('A', 'OVERVIEW') is not None
+    now += dt.timedelta(seconds=1)
+    assert frames.get('A', 'OVERVIEW') is None
+    assert frames.stats()['bytes'] == 0
+
+
+def test_cached_frame_is_not_changed_by_callers():
+    frames = FrameCache()
+    frames.put('A', 'OVERVIEW', _frame())
+    got = frames.get('A', 'OVERVIEW')
+    got.insert_column(0, pl.Series('extra', range(got.height)))
+    assert frames.get('A', 'OVERVIEW').columns == ['value']
+
+
+def test_get_or_load_and_invalidate():
+    frames = FrameCache()
+    loads = []
+
+    def load():
+        loads.append(1)
+        return _frame()
+
+    for _ in range(3):
+        frames.get_or_load('A', 'BALANCE_SHEET', load, 'annual')
+    frames.put('A', 'OVERVIEW', _frame())
+    frames.put('B', 'OVERVIEW', _frame())
+    assert len(loads) == 1
+    assert frames.invalidate(symbol='a') == 2
+    assert frames.invalidate(statement='overview') == 1
+    assert len(frames) == 0
+
+
+def test_concurrent_use_stays_within_budget():
+    threads = 8
+    frames = FrameCache(max_bytes=4 * SIZE)
+
+    def work(k):
+        for i in range(500):
+            frames.get_or_load(f'S{(i * k) % 9}', 'OVERVIEW', _frame)
+
+    workers = [threading.Thread(target=work, args=(k,))
+               for k in range(1, threads + 1)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    stats = frames.stats()
+    assert stats['bytes'] <= stats['max_bytes']
+    assert stats['bytes'] == SIZE * stats['frames']
+    assert stats['hits'] + stats['misses'] == 500 * threads
@@ -0,0 +1,81 @@
+import datetime as dt
+
+import numpy as np
+import polars as pl
+import pytest
+
+from av_server import synthetic_daily
+from indicators import LABELS
+from indicators import Indicators
+from indicators import history
+from prices import PriceStore
+from prices import parse_daily
+
+SYMBOLS = ('AAA', 'BBB', 'SPY')
+AS_OF = dt.date(2012, 6, 29)
+START = dt.date(2011, 12, 30)
+
+
+@pytest.fixture(scope='module')
+def bars():
+    bars = {
+        symbol: parse_daily(synthetic_daily(symbol, AS_OF, compact=False))
+        for symbol in SYMBOLS
+    }
+    # A gap in one symbol's bars leaves NaNs in the windows.
+    gap = pl.col('date').is_between(dt.date(2012, 2, 1),
+                                    dt.date(2012, 2, 14))
+    bars['BBB'] = bars['BBB'].filter(~gap)
+    return bars
+
+
+def _until(bars, date):
+    return {s: frame.filter(pl.col('date') <= date)
+            for s, frame in bars.items()}
+
+
+def _assert_matches_history(indicators, prices):
+    for label in LABELS:
+        np.testing.assert_allclose(
+            indicators.values(label), history(prices, label)[-1],
+            rtol=1e-9, atol=1e-12, equal_nan=True, err_msg=label
+        )
+
+
+def test_update_equals_history(tmp_path, bars):
+    prices = PriceStore(tmp_path)
+    prices.append(_until(bars, START))
+    indicators = Indicators.from_prices(prices)
+    _assert_matches_history(indicators, prices)
+
+    # One bar, then many at once, across the gap.
+    for date in (dt.date(2012, 1, 3), dt.date(2012, 3, 30), AS_OF):
+        prices.append(_until(bars, date))
+        assert indicators.update(prices) > 0
+        _assert_matches_history(indicators, prices)
+    assert indicators.as_of == prices.dates[-1]
+
+
+def test_update_equals_from_prices(tmp_path, bars):
+    prices = PriceStore(tmp_path)
+    prices.append(_until(bars, START))
+    indicators = Indicators.from_prices(prices)
+    prices.append(bars)
+    indicators.update(prices)
+
+    fresh = Indicators.from_prices(prices)
+    for label in LABELS:
+        np.testing.assert_allclose(indicators.values(label),
+                                   fresh.values(label), rtol=1e-9,
+                                   atol=1e-12, equal_nan=True,
+                                   err_msg=label)
+
+
+def test_new_symbol_recomputes(tmp_path, bars):
+    prices = PriceStore(tmp_path)
+    prices.append({s: bars[s] for s in ('AAA', 'SPY')})
+    indicators = Indicators.from_prices(prices)
+    prices.append({'BBB': bars['BBB']})
+    indicators.update(prices)
+    assert indicators.symbols == prices.symbols
+    _assert_matches_history(indicators, prices)
@@ -0,0 +1,111 @@
+import datetime as dt
+
+import polars as pl
+import pytest
+
+from industries import LEVELS
+from membership import Membership
+
+ENERGY = ('Energy', 'Energy', 'Oil, Gas & Consumable Fuels',
+          'Integrated Oil & Gas')
+MEDIA = ('Consumer Discretionary', 'Media', 'Media', 'Broadcasting')
+TELECOM = ('Communication Services', 'Media & Entertainment', 'Media',
+           'Broadcasting')
+
+FIRST = dt.date(2018, 1, 2)
+SECOND = dt.date(2018, 9, 28)
+THIRD = dt.date(2019, 3, 1)
+
+
+def _snapshot(rows: dict) -> pl.DataFrame:
+    return pl.DataFrame(
+        [(symbol, *gics) for symbol, gics in rows.items()],
+        schema=['symbol', *LEVELS], orient='row'
+    )
+
+
+SNAPSHOTS = {
+    FIRST: _snapshot({'XOM': ENERGY, 'CVX': ENERGY, 'DISCA': MEDIA,
+                      'CBS': MEDIA}),
+    # GICS moved media to Communication Services; DISCA was removed.
+    SECOND: _snapshot({'XOM': ENERGY, 'CVX': ENERGY, 'CBS': TELECOM,
+                       'HES': ENERGY}),
+    # DISCA came back.
+    THIRD: _snapshot({'XOM': ENERGY, 'CVX': ENERGY, 'CBS': TELECOM,
+                      'HES': ENERGY, 'DISCA': TELECOM}),
+}
+
+
+@pytest.fixture
+def membership():
+    return Membership.from_snapshots(SNAPSHOTS)
+
+
+def _gics(levels):
+    return dict(zip(LEVELS, levels))
+
+
+def test_members_as_of(membership):
+    # Members of the oldest snapshot count as members before it.
+    assert set(membership.members(dt.date(2010, 1, 4))) \
+        == {'XOM', 'CVX', 'DISCA', 'CBS'}
+    assert set(membership.members(SECOND - dt.timedelta(days=1))) \
+        == {'XOM', 'CVX', 'DISCA', 'CBS'}
+    # Intervals start on the recorded date.
+    assert set(membership.members(SECOND)) == {'XOM', 'CVX', 'CBS', 'HES'}
+    assert set(membership.members('2030-01-01')) \
+        == {'XOM', 'CVX', 'CBS', 'HES', 'DISCA'}
+
+
+def test_members_by_level(membership):
+    assert membership.members(FIRST, 'Sub-Industry', 'Broadcasting') \
+        == ['CBS', 'DISCA']
+    assert membership.members(SECOND, 'Sub-Industry', 'Broadcasting') \
+        == ['CBS']
+    assert membership.members(SECOND, 'Sector', 'Consumer Discretionary') \
+        == []
+    assert set(membership.members(THIRD, 'Industry',
+                                  'Oil, Gas & Consumable Fuels')) \
+        == {'XOM', 'CVX', 'HES'}
+    assert membership.members(THIRD, 'Sector', 'No Such Sector') == []
+
+
+def test_classify(membership):
+    assert membership.classify('CBS', FIRST) == _gics(MEDIA)
+    assert membership.classify('CBS', SECOND) == _gics(TELECOM)
+    assert membership.classify('DISCA', SECOND) is None
+    assert membership.classify('DISCA', THIRD) == _gics(TELECOM)
+    assert membership.classify('HES', FIRST) is None
+    assert membership.classify('NOPE', THIRD) is None
+
+
+def test_classify_many_matches_classify(membership):
+    symbols = ['XOM', 'CBS', 'DISCA', 'HES', 'NOPE']
+    dates = [FIRST, SECOND - dt.timedelta(days=1), SECOND, THIRD,
+             dt.date(2017, 6, 1)]
+    pairs = [(s, d) for s in symbols for d in dates]
+    frame = membership.classify_many([s for s, _ in pairs],
+                                     [d for _, d in pairs])
+    assert frame['date'].to_list() == [d for _, d in pairs]
+    for row, (symbol, date) in zip(frame.iter_rows(named=True), pairs):
+        expected = membership.classify(symbol, date)
+        got = {level: row[level] for level in LEVELS}
+        assert got == (expected or dict.fromkeys(LEVELS)), (symbol, date)
+
+
+def test_record_reports_changes():
+    membership = Membership.from_snapshot(SNAPSHOTS[FIRST])
+    assert membership.record(SNAPSHOTS[SECOND], SECOND) == {
+        'added': ['HES'], 'removed': ['DISCA'], 'reclassified': ['CBS'],
+    }
+    assert membership.record(SNAPSHOTS[SECOND], THIRD) == {
+        'added': [], 'removed': [], 'reclassified': [],
+    }
+    with pytest.raises(ValueError):
+        membership.record(SNAPSHOTS[FIRST], FIRST)
+
+
+def test_save_load(tmp_path, membership):
+    loaded = Membership.load(membership.save(tmp_path))
+    assert loaded.intervals.equals(membership.intervals)
+    assert loaded.members(SECOND) == membership.members(SECOND)
@@ -0,0 +1,129 @@
+import datetime as dt
+import json
+
+import numpy as np
+import polars as pl
+import pytest
+
+import storage
+from prices import BAR_SCHEMA
+from prices import FIELDS
+from prices import PriceStore
+
+
+def _bars(start: dt.date, days: int, base: float = 100.0) -> pl.DataFrame:
+    dates = [start + dt.timedelta(days=i) for i in range(days)]
+    close = [base + i for i in range(days)]
+    return pl.DataFrame({
+        'date': dates,
+        **{field: close for field in FIELDS},
+    }, schema=BAR_SCHEMA)
+
+
+JAN = dt.date(2024, 1, 1)
+
+
+@pytest.fixture
+def store(tmp_path):
+    prices = PriceStore(tmp_path)
+    prices.append({'AAA': _bars(JAN, 5), 'BBB': _bars(JAN, 3, 200.0)})
+    return PriceStore(tmp_path)
+
+
+def _files(root):
+    return sorted(p.name for p in root.iterdir())
+
+
+def test_append_to_empty_store(store):
+    assert store.rows == 5
+    assert store.symbols == ['AAA', 'BBB']
+    assert store.last == {'AAA': JAN + dt.timedelta(days=4),
+                          'BBB': JAN + dt.timedelta(days=2)}
+    assert store.bars('AAA').equals(_bars(JAN, 5))
+    assert store.bars('BBB').equals(_bars(JAN, 3, 200.0))
+    assert np.isnan(store.loc(symbols=['BBB'])[3:]).all()
+
+
+def test_append_skips_stored_bars(store):
+    assert store.append({'AAA': _bars(JAN, 5)}) == 0
+    assert store.append({'AAA': _bars(JAN, 7)}) == 2
+    assert PriceStore(store.root).bars('AAA').equals(_bars(JAN, 7))
+
+
+def test_extend_appends_rows_in_place(store):
+    generation = store.generation
+    later = JAN + dt.timedelta(days=5)
+    assert store.append({'BBB': _bars(later, 4, 300.0)}) == 4
+
+    reopened = PriceStore(store.root)
+    assert reopened.generation == generation
+    assert reopened.rows == 9
+    assert reopened.bars('AAA').equals(_bars(JAN, 5))
+    assert reopened.bars('BBB').equals(pl.concat([
+        _bars(JAN, 3, 200.0), _bars(later, 4, 300.0),
+    ]))
+
+
+def test_interrupted_extend_is_ignored(store):
+    # Rows appended without the index landing are cut off by the next
+    # extend.
+    store._extend(np.array(['2024-01-06', '2024-01-07'], 'datetime64[D]'))
+    reopened = PriceStore(store.root)
+    assert reopened.rows == 5
+    assert reopened.bars('AAA').equals(_bars(JAN, 5))
+
+    assert reopened.append({'AAA': _bars(JAN, 6)}) == 1
+    assert PriceStore(store.root).rows == 6
+
+
+def test_rebuild_for_new_symbol_and_earlier_dates(store):
+    generation = store.generation
+    earlier = JAN - dt.timedelta(days=2)
+    assert store.append({'CCC': _bars(earlier, 4, 50.0)}) == 4
+
+    reopened = PriceStore(store.root)
+    assert reopened.generation == generation + 1
+    assert reopened.symbols == ['AAA', 'BBB', 'CCC']
+    assert reopened.rows == 7
+    assert reopened.bars('AAA').equals(_bars(JAN, 5))
+    assert reopened.bars('BBB').equals(_bars(JAN, 3, 200.0))
+    assert reopened.bars('CCC').equals(_bars(earlier, 4, 50.0))
+    # Only the new generation's files are left.
+    assert _files(store.root) == sorted(
+        [reopened.path(f).name for f in ('date', *FIELDS)] + ['index.json']
+    )
+
+
+def test_interrupted_rebuild_leaves_store_as_it_was(store, monkeypatch):
+    before = _files(store.root)
+    replacing = storage.replacing
+    calls = []
+
+    def failing(path):
+        calls.append(path)
+        if len(calls) == 3:
+            raise OSError('disk full')
+        return replacing(path)
+
+    monkeypatch.setattr(storage, 'replacing', failing)
+    with pytest.raises(OSError):
+        store.append({'CCC': _bars(JAN, 5, 50.0)})
+    monkeypatch.undo()
+
+    reopened = PriceStore(store.root)
+    assert reopened.symbols == ['AAA', 'BBB']
+    assert reopened.bars('AAA').equals(_bars(JAN, 5))
+    assert reopened.bars('BBB').equals(_bars(JAN, 3, 200.0))
+
+    # The next rebuild completes & clears the partial generation.
+    assert reopened.append({'CCC': _bars(JAN, 5, 50.0)}) == 5
+    assert PriceStore(store.root).bars('CCC').equals(_bars(JAN, 5, 50.0))
+    assert len(_files(store.root)) == len(before)
+
+
+def test_file_not_matching_index_raises(store):
+    index = json.loads((store.root / 'index.json').read_text())
+    index['symbols'].append('CCC')
+    (store.root / 'index.json').write_text(json.dumps(index))
+    with pytest.raises(ValueError, match='does not match'):
+        PriceStore(store.root).array('close')